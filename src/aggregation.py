@@ -0,0 +1,305 @@
+import math
+import typing
+
+
+def parse_resolutions(spec: str) -> typing.List[float]:
+    """Window lengths from comma separated seconds, e.g. 1,60,900"""
+    try:
+        resolutions = [float(r) for r in spec.split(',')]
+    except ValueError:
+        resolutions = None
+    if resolutions is None or not all(math.isfinite(r) and r > 0 for r in resolutions):
+        raise ValueError("Invalid --aggregate {}, expected seconds like 1,60,900".format(spec))
+    return resolutions
+
+
+class P2Quantile:
+    """
+    Estimate of the `p` quantile of a stream, in constant memory, using the
+    P² algorithm (Jain & Chlamtac, 1985).
+    """
+    __slots__ = ('p', 'heights', 'positions', 'desired', 'increments')
+
+    def __init__(self, p: float):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float) -> None:
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                h = self._parabolic(i, d)
+                if not q[i - 1] < h < q[i + 1]:
+                    h = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = h
+                n[i] += d
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self) -> float:
+        q = self.heights
+        if len(q) == 0:
+            return math.nan
+        if len(q) < 5:
+            return q[min(len(q) - 1, int(round(self.p * (len(q) - 1))))]
+        return q[2]
+
+
+class WindowStats:
+    """Running statistics of one field over one window"""
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'integral', 'quantiles')
+
+    def __init__(self, quantiles: typing.Sequence[float] = ()):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.integral = 0.0
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        self.total += x
+        if x < self.minimum:
+            self.minimum = x
+        if x > self.maximum:
+            self.maximum = x
+        for q in self.quantiles:
+            q.add(x)
+
+    def fields(self, name: str) -> dict:
+        fields = {
+            name + '_mean': self.total / self.count,
+            name + '_min': self.minimum,
+            name + '_max': self.maximum,
+            name + '_integral_h': self.integral / 3600,
+        }
+        for q in self.quantiles:
+            fields["{}_p{:g}".format(name, 100 * q.p)] = q.value()
+        return fields
+
+
+class CounterStats:
+    """A cumulative counter (e.g. kWh) over one window: its last value and its increase"""
+    __slots__ = ('count', 'start', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.start = None  # the value at the start of the window
+        self.last = None
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        if self.start is None:
+            self.start = x
+        self.last = x
+
+    def fields(self, name: str) -> dict:
+        return {
+            name + '_last': self.last,
+            name + '_increase': self.last - self.start,
+        }
+
+
+class LastStats:
+    """Only the last value over one window, for fields that don't average (e.g. angles)"""
+    __slots__ = ('count', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.last = None
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        self.last = x
+
+    def fields(self, name: str) -> dict:
+        return {name + '_last': self.last}
+
+
+class _Window:
+    __slots__ = ('start', 'stats')
+
+    def __init__(self, start: float):
+        self.start = start
+        self.stats = {}
+
+
+class Aggregator:
+    """
+    Rolls fast polls up into windows of each of `resolutions` seconds,
+    aligned to the epoch (e.g. 1 s, 1 min and 15 min).
+
+    For every numeric field, each window has the mean, min, max, the
+    `quantiles` (estimated in constant memory) and the time integral in
+    value-hours (trapezoidal, so Wh for a field in W). Samples more than
+    `max_gap` seconds apart are not integrated over. Fields named in
+    `counters` are cumulative (e.g. kWh), and only get their last value and
+    their increase over the window; fields named in `last_only` (e.g.
+    angles) only get their last value.
+
+    add() takes points in the dict format of InfluxDBClient.write_points(),
+    and returns the rollups of the windows that it closed, as points of the
+    same measurement with an extra 'resolution' tag, timestamped with the
+    start of the window. Memory use does not depend on the poll rate.
+    """
+    def __init__(self, resolutions: typing.Sequence[float] = (1, 60, 900),
+                 quantiles: typing.Sequence[float] = (0.5, 0.95),
+                 max_gap: float = None,
+                 counters: typing.Collection[str] = (),
+                 last_only: typing.Collection[str] = ()):
+        self.resolutions = resolutions
+        self.quantiles = quantiles
+        self.max_gap = max_gap
+        self.counters = frozenset(counters)
+        self.last_only = frozenset(last_only)
+        self._windows = {}  # (series, resolution) -> _Window
+        self._last = {}  # (series, field) -> (time, value)
+
+    @staticmethod
+    def _tag(resolution: float) -> str:
+        return "{:g}s".format(resolution)
+
+    def add(self, points: typing.Iterable[dict], t: float = None) -> typing.List[dict]:
+        """
+        Add points, each at its own 'time' (in ns), or at `t` (in s) if it
+        has none. Returns the closed windows.
+        """
+        out = []
+        for point in points:
+            point_t = point.get('time')
+            point_t = t if point_t is None else point_t / 1e9
+            if point_t is None:
+                raise ValueError("Point without a time")
+            tags = point.get('tags', {})
+            series = (point['measurement'], tuple(sorted(tags.items())))
+            # As floats: rollups of an int field (e.g. a count) would be ints
+            # or floats depending on the samples, and InfluxDB refuses a
+            # field that changes type
+            fields = {
+                name: float(value)
+                for name, value in point['fields'].items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)
+            }
+            for resolution in self.resolutions:
+                window = self._windows.get((series, resolution))
+                start = point_t - point_t % resolution
+                if window is not None and start < window.start:
+                    continue  # Its window was closed already
+                if window is not None and window.start != start:
+                    self._integrate_until(window, series, fields, start, point_t)
+                    self._close(out, series, resolution, window)
+                    window = None
+                if window is None:
+                    window = self._windows[series, resolution] = _Window(start)
+                self._add(window, series, fields, point_t)
+            for name, value in fields.items():
+                self._last[series, name] = (point_t, value)
+        return out
+
+    def flush(self) -> typing.List[dict]:
+        """Rollups of the current, incomplete, windows"""
+        out = []
+        for (series, resolution), window in self._windows.items():
+            self._close(out, series, resolution, window)
+        self._windows.clear()
+        return out
+
+    def _stats(self, window: _Window, name: str):
+        stats = window.stats.get(name)
+        if stats is None:
+            if name in self.counters:
+                stats = CounterStats()
+            elif name in self.last_only:
+                stats = LastStats()
+            else:
+                stats = WindowStats(self.quantiles)
+            window.stats[name] = stats
+        return stats
+
+    def _is_gauge(self, name: str) -> bool:
+        return name not in self.counters and name not in self.last_only
+
+    def _segment(self, series, name: str, t: float, value: float):
+        """The previous sample of a field, if it is recent enough to integrate from"""
+        last = self._last.get((series, name))
+        if last is None or t <= last[0] or (self.max_gap is not None and t - last[0] > self.max_gap):
+            return None
+        return last
+
+    def _integrate_until(self, window: _Window, series, fields: dict, boundary: float, t: float) -> None:
+        """Add the part of the segments up to the sample at `t` that is before `boundary` to `window`"""
+        for name, value in fields.items():
+            if not self._is_gauge(name):
+                continue
+            last = self._segment(series, name, t, value)
+            if last is None or last[0] >= boundary:
+                continue
+            t0, v0 = last
+            end = min(boundary, t)
+            v_end = v0 + (value - v0) * (end - t0) / (t - t0)
+            self._stats(window, name).integral += (v0 + v_end) / 2 * (end - t0)
+
+    def _add(self, window: _Window, series, fields: dict, t: float) -> None:
+        for name, value in fields.items():
+            stats = self._stats(window, name)
+            last = self._segment(series, name, t, value)
+            if name in self.counters and stats.count == 0 and last is not None:
+                # Count the increase since the last sample of the previous window
+                stats.start = last[1]
+            stats.add(value)
+            if last is None or not self._is_gauge(name):
+                continue
+            t0, v0 = last
+            begin = max(window.start, t0)
+            v_begin = v0 + (value - v0) * (begin - t0) / (t - t0)
+            stats.integral += (v_begin + value) / 2 * (t - begin)
+
+    def _close(self, out: list, series, resolution: float, window: _Window) -> None:
+        """Append the rollup of `window` to `out`"""
+        fields = {}
+        for name, stats in window.stats.items():
+            if stats.count > 0:
+                fields.update(stats.fields(name))
+        if len(fields) == 0:
+            return
+        measurement, tags = series
+        tags = dict(tags)
+        tags['resolution'] = self._tag(resolution)
+        out.append({
+            'measurement': measurement,
+            'tags': tags,
+            'fields': fields,
+            'time': int(window.start * 1e9),
+        })
@@ -0,0 +1,222 @@
+import argparse
+import random
+import statistics
+import struct
+import time
+import typing
+
+import serial
+
+from bus_scheduler import BusScheduler
+from eastron import DebuggableSerial, Eastron3P3W, Modbus, ModbusException, crc_valid, eastron_crc, table_crc
+from simulator import Sdm630Simulator, default_values
+import read_influx
+
+
+def workload_dump_all(m: Eastron3P3W) -> int:
+    """Read every register of the wiring mode, like dump_all.py. Returns the number of registers read."""
+    m.read_registers()
+    return 2 * len(m.registers())
+
+
+def workload_read_influx(m: Eastron3P3W) -> int:
+    """Take a reading and build the points, like read_influx.py"""
+    m.refresh()
+    read_influx.measure(m, m.slave_address)
+    return 2 * len(m.registers_used)
+
+
+WORKLOADS = {
+    'dump_all': workload_dump_all,
+    'read_influx': workload_read_influx,
+}
+
+
+def run(workload: typing.Callable, polls: int, meter_class: type = Eastron3P3W,
+        **simulator_kwargs) -> dict:
+    """
+    Run `workload` `polls` times against a simulated meter on a pty.
+
+    CPU time is measured on the polling thread only, so it excludes the
+    simulator.
+    """
+    sim, path = Sdm630Simulator.open_pty(**simulator_kwargs)
+    with sim:
+        ser = DebuggableSerial(path, 9600, serial.EIGHTBITS, serial.PARITY_EVEN, serial.STOPBITS_ONE,
+                               timeout=0.1)
+        try:
+            m = meter_class(ser, 1)
+            latencies = []
+            registers = 0
+            errors = 0
+            wall_start = time.perf_counter()
+            cpu_start = time.thread_time()
+            for _ in range(polls):
+                t = time.perf_counter()
+                try:
+                    registers += workload(m)
+                except (TimeoutError, ValueError, ModbusException):
+                    errors += 1
+                    ser.reset_input_buffer()
+                latencies.append(time.perf_counter() - t)
+            cpu = time.thread_time() - cpu_start
+            wall = time.perf_counter() - wall_start
+        finally:
+            ser.close()
+
+    latencies.sort()
+    return {
+        'polls': polls,
+        'errors': errors,
+        'frames': sim.responses,
+        'wall_time': wall,
+        'frames_per_s': sim.responses / wall,
+        'registers_per_s': registers / wall,
+        'latency_mean': statistics.mean(latencies),
+        'latency_p50': latencies[len(latencies) // 2],
+        'latency_p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        'cpu_per_poll': cpu / polls,
+    }
+
+
+def run_scheduler(slaves: int, polls: int, baudrate: int, pipelined: bool = True,
+                  turnaround: float = 0.0, bits_per_char: int = 11) -> dict:
+    """
+    Poll `slaves` simulated meters back-to-back with a BusScheduler, until
+    `polls` polls are done, and compare the time taken to the theoretical
+    minimum: the time to clock all bytes over the line, plus the meter
+    turnaround and inter-frame gap for every frame.
+    """
+    sim, path = Sdm630Simulator.open_pty(
+        slaves={addr: default_values(addr) for addr in range(1, slaves + 1)},
+        baudrate=baudrate, bits_per_char=bits_per_char, turnaround=turnaround)
+    with sim:
+        ser = DebuggableSerial(path, 9600, serial.EIGHTBITS, serial.PARITY_EVEN, serial.STOPBITS_ONE,
+                               timeout=0.1)
+        s = BusScheduler(ser, baudrate=baudrate, bits_per_char=bits_per_char,
+                         background_decode=pipelined, spin=0.001 if pipelined else 0.0)
+        try:
+            tasks = [
+                s.add_float_task(s.meter(addr, Eastron3P3W), Eastron3P3W.registers_used, 0)
+                for addr in range(1, slaves + 1)
+            ]
+            s.reset_stats()
+            while sum(t.polls + t.errors for t in tasks) < polls:
+                s.step()
+            u = s.utilisation()
+        finally:
+            s.close()
+            ser.close()
+
+    theoretical = u['wire_time'] + u['frames'] * (turnaround + s.gap)
+    return {
+        'polls': polls,
+        'errors': u['errors'],
+        'frames': u['frames'],
+        'wall_time': u['elapsed'],
+        'frames_per_s': u['frames'] / u['elapsed'],
+        'max_frames_per_s': u['frames'] / theoretical,
+        'efficiency': theoretical / u['elapsed'],
+    }
+
+
+def _time_per_call(func: typing.Callable, items: list) -> float:
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - start) / len(items)
+
+
+def crc_benchmark(frames: int = 10000, seed: int = 0) -> dict:
+    """
+    Check that the CRC implementations agree, and that the residue check
+    catches corrupted frames; then time them on response frames of random
+    length. Also times building a plan's request frames against the cache.
+    """
+    rnd = random.Random(seed)
+    messages = [bytes(rnd.getrandbits(8) for _ in range(rnd.randrange(3, 256))) for _ in range(frames)]
+    for msg in messages:
+        if table_crc(msg) != eastron_crc(msg):
+            raise AssertionError("CRC mismatch for {}".format(msg.hex()))
+    good = [msg + struct.pack("<H", eastron_crc(msg)) for msg in messages]
+    if not all(crc_valid(frame) for frame in good):
+        raise AssertionError("Residue check rejected a valid frame")
+    undetected = 0
+    for frame in good:
+        bit = rnd.randrange(8 * len(frame))
+        corrupted = bytearray(frame)
+        corrupted[bit // 8] ^= 1 << (bit % 8)
+        undetected += crc_valid(bytes(corrupted))
+    if undetected > 0:
+        raise AssertionError("{} single bit errors not detected".format(undetected))
+
+    def split_and_compare(frame):
+        crc, = struct.unpack_from("<H", frame, len(frame) - 2)
+        return crc == eastron_crc(frame[:-2])
+
+    m = Modbus(None, 1)
+    plan = Eastron3P3W(None, 1).plan_reads([(a, 2) for a in Eastron3P3W.registers_used])
+    plans = [plan.frames] * 1000
+    return {
+        'frames': frames,
+        'eastron_crc': _time_per_call(eastron_crc, messages),
+        'table_crc': _time_per_call(table_crc, messages),
+        'split_and_compare': _time_per_call(split_and_compare, good),
+        'residue_check': _time_per_call(crc_valid, good),
+        'construct_requests': _time_per_call(
+            lambda frames: [m._construct_request(1, 4, start, num) for start, num in frames], plans),
+        'cached_requests': _time_per_call(lambda frames: m._request_frames(4, frames), plans),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark polling against a simulated SDM630')
+    parser.add_argument('--workload', choices=WORKLOADS.keys(), action='append',
+                        help="Workload to run, may be repeated. Default: all")
+    parser.add_argument('--polls', type=int, default=100, help="Number of polls per workload")
+    parser.add_argument('--baudrate', type=int, default=None,
+                        help="Simulate transmission delays at this baud rate. Default: no delay")
+    parser.add_argument('--turnaround', type=float, default=0.0, help="Simulated meter response time [s]")
+    parser.add_argument('--crc-error-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--crc', action='store_true',
+                        help="Instead, verify and time the CRC implementations and the request frame cache")
+    parser.add_argument('--scheduler', type=int, default=None, metavar='SLAVES',
+                        help="Instead, poll SLAVES meters with the bus scheduler, with and without pipelining, "
+                             "and compare to the theoretical maximum frame rate. Requires --baudrate")
+
+    args = parser.parse_args()
+
+    if args.crc:
+        result = crc_benchmark()
+        print("CRC implementations agree on {} frames, all single bit errors detected".format(result['frames']))
+        for name in ['eastron_crc', 'table_crc', 'split_and_compare', 'residue_check',
+                     'construct_requests', 'cached_requests']:
+            print("  {:20} {:8.2f}us".format(name, 1e6 * result[name]))
+        return
+
+    if args.scheduler is not None:
+        if args.baudrate is None:
+            parser.error("--scheduler requires --baudrate")
+        for pipelined in (False, True):
+            result = run_scheduler(args.scheduler, args.polls, args.baudrate, pipelined=pipelined,
+                                   turnaround=args.turnaround)
+            print("scheduler, {}:".format("pipelined" if pipelined else "sequential"))
+            print("  {frames_per_s:10.1f} frames/s of {max_frames_per_s:.1f} theoretical maximum "
+                  "({efficiency:.1%}), {errors} errors".format(**result))
+        return
+
+    for name in args.workload or WORKLOADS.keys():
+        result = run(WORKLOADS[name], args.polls,
+                     baudrate=args.baudrate, turnaround=args.turnaround,
+                     crc_error_rate=args.crc_error_rate, drop_rate=args.drop_rate, seed=0)
+        print("{}:".format(name))
+        print("  {frames_per_s:10.1f} frames/s   {registers_per_s:10.1f} registers/s".format(**result))
+        print("  latency mean {:.2f}ms  p50 {:.2f}ms  p95 {:.2f}ms".format(
+            1000 * result['latency_mean'], 1000 * result['latency_p50'], 1000 * result['latency_p95']))
+        print("  {:.3f}ms CPU per poll, {} errors in {} polls".format(
+            1000 * result['cpu_per_poll'], result['errors'], result['polls']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+import concurrent.futures
+import sys
+import time
+import typing
+
+from eastron import Modbus, Eastron, ModbusException, SlaveHealth
+
+
+def inter_frame_gap(baudrate: int, bits_per_char: int = 11) -> float:
+    """
+    Modbus RTU silent interval between frames (t3.5), in seconds.
+    Above 19200 baud, the spec fixes this at 1.75ms.
+    """
+    if baudrate > 19200:
+        return 0.00175
+    return 3.5 * bits_per_char / baudrate
+
+
+class PollTask:
+    """
+    Periodic read of a set of input registers of a single meter.
+
+    `callback` is called with the decoded result after every complete poll.
+    `decode` converts the raw {address: register} dict before it is passed to
+    `callback`; by default the raw registers are passed. With `timestamped`,
+    `callback` also gets the times (on the scheduler's clock) at which each
+    frame of the poll was received.
+    Lower `priority` values are served first when several tasks are due.
+
+    The request frames of the plan are built once, up front.
+    """
+    def __init__(self, meter: Modbus, ranges, interval: float,
+                 priority: int = 0,
+                 callback: typing.Callable = None,
+                 decode: typing.Callable = None,
+                 timestamped: bool = False):
+        self.meter = meter
+        self.plan = meter.plan_reads(*ranges)
+        self.interval = interval
+        self.priority = priority
+        self.callback = callback
+        self.decode = decode
+        self.timestamped = timestamped
+
+        self.requests = meter._request_frames(4, self.plan.frames)
+        self.wanted = set(self.plan.registers)
+        self.next_due = None
+        self.frame_index = 0
+        self.payloads = []
+        self.frame_times = []
+
+        self.polls = 0
+        self.errors = 0
+        self.skipped = 0
+        self.last_error = None
+
+    def __repr__(self):
+        return "<PollTask slave {} every {}s, {}>".format(
+            self.meter.slave_address, self.interval, self.plan)
+
+    def _reschedule(self, now: float) -> None:
+        self.frame_index = 0
+        self.payloads = []
+        self.frame_times = []
+        if self.interval <= 0:
+            # Poll back-to-back
+            self.next_due = now
+            return
+        self.next_due += self.interval
+        if self.next_due < now:
+            missed = int((now - self.next_due) // self.interval) + 1
+            self.skipped += missed
+            self.next_due += missed * self.interval
+
+
+class BusScheduler:
+    """
+    Owns a serial port, and polls many meters on it, each with its own
+    interval and priority. This is a library: read_influx.py polls all its
+    meters at a single interval and doesn't use it; see
+    site_snapshot.add_site_power_tasks() and benchmark.py.
+
+    Tasks are executed one frame at a time, so a long, low-priority read plan
+    does not hold back a higher priority task that becomes due in the middle
+    of it. The Modbus inter-frame gap is observed between every frame.
+    Polls of meters that stopped responding are skipped until their
+    back-off time (see SlaveHealth) has passed.
+
+    Only the exchange itself happens between frames: request frames are
+    built in advance, and response payloads are only decoded once a poll is
+    complete. With `background_decode`, decoding and callbacks run on a
+    worker thread, so they overlap with the next exchanges; call close() to
+    wait for them. The last `spin` seconds of the inter-frame gap are
+    busy-waited instead of slept, since sleeps tend to overshoot by more
+    than the gap itself at high baud rates.
+    """
+    def __init__(self, serial_port,
+                 baudrate: int = None,
+                 bits_per_char: int = 11,
+                 background_decode: bool = False,
+                 spin: float = 0.0,
+                 clock: typing.Callable = time.monotonic,
+                 sleep: typing.Callable = time.sleep):
+        self.serial = serial_port
+        if baudrate is None:
+            baudrate = serial_port.baudrate
+        self.baudrate = baudrate
+        self.bits_per_char = bits_per_char
+        self.gap = inter_frame_gap(baudrate, bits_per_char)
+        self.clock = clock
+        self.sleep = sleep
+        self.spin = spin
+        self._executor = None
+        if background_decode:
+            self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='BusScheduler-decode')
+
+        self.meters = {}
+        self.tasks = []
+
+        self._bus_free_at = clock()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.stats_since = self.clock()
+        self.frames = 0
+        self.bytes = 0
+        self.busy_time = 0.0
+        self.errors = 0
+
+    def meter(self, slave_address: int, meter_class: type = Eastron, **kwargs) -> Modbus:
+        """Return the meter object for `slave_address`, creating it on the shared port if needed"""
+        if slave_address not in self.meters:
+            kwargs.setdefault('health', SlaveHealth(clock=self.clock))
+            self.meters[slave_address] = meter_class(self.serial, slave_address, **kwargs)
+        return self.meters[slave_address]
+
+    def add_task(self, meter: Modbus, ranges, interval: float, **kwargs) -> PollTask:
+        task = PollTask(meter, ranges, interval, **kwargs)
+        task.next_due = self.clock()
+        self.tasks.append(task)
+        return task
+
+    def add_float_task(self, meter: Eastron, addresses: typing.List[int], interval: float, **kwargs) -> PollTask:
+        """Poll float registers; `callback` receives {address: float}"""
+        addresses = list(addresses)
+        return self.add_task(
+            meter, [(a, 2) for a in addresses], interval,
+            decode=lambda registers: Eastron._registers_to_float(registers, addresses),
+            **kwargs)
+
+    def remove_task(self, task: PollTask) -> None:
+        self.tasks.remove(task)
+
+    def _next_task(self, now: float) -> typing.Optional[PollTask]:
+        due = [t for t in self.tasks if t.next_due <= now]
+        if len(due) == 0:
+            return None
+        return min(due, key=lambda t: (t.priority, t.next_due))
+
+    def close(self) -> None:
+        """Wait for background decoding to finish"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _wait_for_bus(self) -> None:
+        wait = self._bus_free_at - self.clock() - self.spin
+        if wait > 0:
+            self.sleep(wait)
+        if self.spin > 0:
+            while self.clock() < self._bus_free_at:
+                pass
+
+    def _execute_frame(self, task: PollTask) -> None:
+        start_addr, num = task.plan.frames[task.frame_index]
+
+        if task.meter.health.is_open():
+            # Don't spend bus time on a meter that has been failing
+            task.skipped += 1
+            task._reschedule(self.clock())
+            task.next_due = max(task.next_due, task.meter.health.open_until)
+            return
+
+        self._wait_for_bus()
+        request = task.requests[task.frame_index]
+        t_start = self.clock()
+        try:
+            resp = task.meter._request(4, start_addr, num, request=request)
+        except (TimeoutError, ConnectionError, ValueError, ModbusException) as e:
+            t_end = self.clock()
+            # Only what arrived of the response, if anything
+            self._account(t_start, t_end, len(request) + len(getattr(e, 'partial', b'')))
+            self.errors += 1
+            task.errors += 1
+            task.last_error = e
+            print("Poll of slave {} failed: {}".format(task.meter.slave_address, e), file=sys.stderr)
+            task._reschedule(t_end)
+            return
+        t_end = self.clock()
+        self._account(t_start, t_end, len(request) + len(resp['frame']))
+
+        task.payloads.append(resp['payload'])
+        task.frame_times.append(t_end)
+        task.frame_index += 1
+        if task.frame_index < len(task.plan):
+            return
+
+        payloads, frame_times = task.payloads, task.frame_times
+        task.polls += 1
+        task._reschedule(t_end)
+        if self._executor is not None:
+            self._executor.submit(self._complete, task, payloads, frame_times)
+        else:
+            self._complete(task, payloads, frame_times)
+
+    @staticmethod
+    def _complete(task: PollTask, payloads: typing.List[bytes], frame_times: typing.List[float]) -> None:
+        """Decode the responses of a complete poll, and pass them to the callback"""
+        try:
+            registers = {}
+            for (start_addr, num), payload in zip(task.plan.frames, payloads):
+                Modbus._decode_registers(start_addr, num, payload, task.wanted, registers)
+            if task.decode is not None:
+                registers = task.decode(registers)
+            if task.callback is None:
+                pass
+            elif task.timestamped:
+                task.callback(registers, frame_times)
+            else:
+                task.callback(registers)
+        except Exception as e:
+            # Don't let a broken callback take the bus down
+            task.last_error = e
+            print("Handling poll of slave {} failed: {}".format(task.meter.slave_address, e), file=sys.stderr)
+
+    def _account(self, t_start: float, t_end: float, n_bytes: int) -> None:
+        """Account for an exchange of `n_bytes` on the wire (request and response)"""
+        self._bus_free_at = t_end + self.gap
+        self.frames += 1
+        self.bytes += n_bytes
+        self.busy_time += t_end - t_start
+
+    def step(self) -> bool:
+        """
+        Execute a single frame of the most urgent due task.
+        Returns False if no task was due.
+        """
+        task = self._next_task(self.clock())
+        if task is None:
+            return False
+        self._execute_frame(task)
+        return True
+
+    def run(self, duration: float = None) -> None:
+        """Run tasks as they become due, for `duration` seconds or forever"""
+        end = None if duration is None else self.clock() + duration
+        while end is None or self.clock() < end:
+            if self.step():
+                continue
+            if len(self.tasks) == 0:
+                if end is None:
+                    return
+                self.sleep(end - self.clock())
+                continue
+            wake = min(t.next_due for t in self.tasks)
+            if end is not None:
+                wake = min(wake, end)
+            wait = wake - self.clock()
+            if wait > 0:
+                self.sleep(wait)
+
+    def utilisation(self) -> dict:
+        """
+        Bus statistics since the last reset_stats().
+
+        `utilisation` is the fraction of time the bus was occupied by a
+        request/response exchange or the inter-frame gap after it.
+        `wire_utilisation` only counts the time needed to clock the bytes over
+        the line at the configured baud rate; the difference is spent waiting
+        for the meters to respond.
+        """
+        elapsed = self.clock() - self.stats_since
+        occupied = self.busy_time + self.frames * self.gap
+        wire_time = self.bytes * self.bits_per_char / self.baudrate
+        return {
+            'elapsed': elapsed,
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'busy_time': occupied,
+            'wire_time': wire_time,
+            'utilisation': occupied / elapsed if elapsed > 0 else 0.0,
+            'wire_utilisation': wire_time / elapsed if elapsed > 0 else 0.0,
+        }
@@ -0,0 +1,271 @@
+import argparse
+import mmap
+import struct
+import time
+import typing
+
+from eastron import CrcError, Eastron, Modbus, ModbusException, RtuFrameDecoder
+
+
+TX = 0
+RX = 1
+
+
+class FrameCapture:
+    """
+    Binary capture of the raw bytes on a line, in a memory-mapped ring file
+    of `capacity` bytes: once it is full, the oldest records are overwritten.
+
+    Every record is a monotonic timestamp in ns, the direction (TX or RX),
+    and the bytes: a complete request frame for TX, the bytes as they were
+    read for RX. Recording only copies the bytes into the mapping; the OS
+    writes them out, so there is no system call per record.
+
+    An existing capture file is appended to.
+    """
+    magic = b'EASTRCAP'
+    version = 1
+    header = struct.Struct("<8sIIQQQ")  # magic, version, data offset, capacity, head, tail
+    data_offset = 64
+    record_header = struct.Struct("<QBH")  # time [ns], direction, length
+
+    def __init__(self, path: str, capacity: int = 1 << 20,
+                 clock: typing.Callable = time.monotonic_ns):
+        self.path = path
+        self.clock = clock
+        self._file = open(path, 'a+b')
+        self._file.seek(0)
+        existing = self._file.read(self.header.size)
+        if len(existing) == self.header.size and existing.startswith(self.magic):
+            magic, version, data_offset, capacity, head, tail = self.header.unpack(existing)
+            if version != self.version:
+                raise ValueError("Unsupported capture version {}".format(version))
+        else:
+            head = tail = 0
+            self._file.truncate(0)
+            self._file.truncate(self.data_offset + capacity)
+        self.capacity = capacity
+        self.head = head  # Positions are counted in bytes since the start of the capture
+        self.tail = tail
+        self._map = mmap.mmap(self._file.fileno(), self.data_offset + capacity)
+        self._write_header()
+
+        self.records = 0
+        self.overwritten = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            self._file.close()
+
+    def _write_header(self) -> None:
+        self.header.pack_into(self._map, 0, self.magic, self.version, self.data_offset,
+                              self.capacity, self.head, self.tail)
+
+    def _put(self, position: int, data: bytes) -> None:
+        offset = position % self.capacity
+        first = min(len(data), self.capacity - offset)
+        start = self.data_offset + offset
+        self._map[start:start + first] = data[:first]
+        if first < len(data):
+            self._map[self.data_offset:self.data_offset + len(data) - first] = data[first:]
+
+    def _get(self, position: int, size: int) -> bytes:
+        return _ring_read(self._map, self.data_offset, self.capacity, position, size)
+
+    def record(self, direction: int, data: bytes, t_ns: int = None) -> None:
+        if t_ns is None:
+            t_ns = self.clock()
+        size = self.record_header.size + len(data)
+        if size > self.capacity:
+            raise ValueError("Record of {} bytes does not fit in the capture".format(size))
+        while self.head + size - self.tail > self.capacity:
+            # Make room by dropping the oldest record
+            _, _, length = self.record_header.unpack(self._get(self.tail, self.record_header.size))
+            self.tail += self.record_header.size + length
+            self.overwritten += 1
+        self._put(self.head, self.record_header.pack(t_ns, direction, len(data)) + bytes(data))
+        self.head += size
+        self.records += 1
+        self._write_header()
+
+
+def _ring_read(buffer, data_offset: int, capacity: int, position: int, size: int) -> bytes:
+    offset = position % capacity
+    first = min(size, capacity - offset)
+    data = buffer[data_offset + offset:data_offset + offset + first]
+    if first < size:
+        data += buffer[data_offset:data_offset + size - first]
+    return bytes(data)
+
+
+def read_capture(path: str) -> typing.Iterator[typing.Tuple[int, int, bytes]]:
+    """The (time [ns], direction, bytes) records of a capture file, oldest first"""
+    with open(path, 'rb') as f:
+        buffer = f.read()
+    magic, version, data_offset, capacity, head, tail = FrameCapture.header.unpack_from(buffer)
+    if magic != FrameCapture.magic:
+        raise ValueError("{} is not a capture file".format(path))
+    if version != FrameCapture.version:
+        raise ValueError("Unsupported capture version {}".format(version))
+    record_header = FrameCapture.record_header
+    position = tail
+    while position < head:
+        t_ns, direction, length = record_header.unpack(
+            _ring_read(buffer, data_offset, capacity, position, record_header.size))
+        position += record_header.size
+        yield t_ns, direction, _ring_read(buffer, data_offset, capacity, position, length)
+        position += length
+
+
+class CapturingTransport:
+    """
+    Wraps a transport with RTU framing (a DebuggableSerial or an
+    RtuOverTcpTransport), and records everything written and read to a
+    FrameCapture.
+    """
+    def __init__(self, transport, capture: FrameCapture):
+        if hasattr(transport, 'transact'):
+            raise ValueError("Only transports with RTU framing can be captured")
+        self.transport = transport
+        self.capture = capture
+
+    def write(self, data: bytes) -> int:
+        self.capture.record(TX, data)
+        return self.transport.write(data)
+
+    def read_with_idle_timeout(self, size: int = 1, timeout: float = 0.1) -> bytearray:
+        try:
+            data = self.transport.read_with_idle_timeout(size, timeout)
+        except TimeoutError as e:
+            # A truncated response is worth keeping most of all
+            partial = getattr(e, 'partial', b'')
+            if len(partial) > 0:
+                self.capture.record(RX, partial)
+            raise
+        self.capture.record(RX, data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+
+class CaptureReplay:
+    """
+    Feeds the exchanges of a capture through the same response parsing
+    (Modbus._read_modbus_response()) and float decoding as a live meter, as
+    fast as possible.
+
+    The records are split into exchanges up front, so run() only measures
+    the decode path.
+    """
+    def __init__(self, records: typing.Iterable[typing.Tuple[int, int, bytes]]):
+        self.exchanges = []  # (time [ns], request, received bytes)
+        for t_ns, direction, data in records:
+            if direction == TX:
+                self.exchanges.append((t_ns, data, bytearray()))
+            elif len(self.exchanges) > 0:
+                self.exchanges[-1][2].extend(data)
+            # else: the response to a request from before the capture starts
+
+    @classmethod
+    def from_file(cls, path: str) -> "CaptureReplay":
+        return cls(read_capture(path))
+
+    @staticmethod
+    def _float_addresses(start_address: int, number_of_points: int) -> typing.Tuple[int, ...]:
+        """The addresses of the whole floats in a read"""
+        return tuple(range(start_address + start_address % 2, start_address + number_of_points - 1, 2))
+
+    def run(self, decode: bool = True, callback: typing.Callable = None) -> dict:
+        """
+        Replay all exchanges. `callback`, if given, is called with
+        (time [ns], request, response or exception, decoded floats or None)
+        for every exchange.
+        """
+        decoder = RtuFrameDecoder()
+        addresses_cache = {}
+        stats = {'exchanges': len(self.exchanges), 'responses': 0, 'timeouts': 0, 'crc_errors': 0,
+                 'exceptions': 0, 'unexpected': 0, 'values': 0}
+
+        start = time.perf_counter()
+        for t_ns, request, received in self.exchanges:
+            slave_address, function_number, start_address, number_of_points = struct.unpack_from(">BBHH", request)
+            pending = memoryview(received)
+
+            def get_n_bytes(n: int) -> bytes:
+                nonlocal pending
+                if len(pending) == 0:
+                    raise TimeoutError("No more bytes in the capture")
+                data, pending = pending[:n], pending[n:]
+                return data
+
+            values = None
+            try:
+                resp = Modbus._check_response(Modbus._read_modbus_response(get_n_bytes, decoder),
+                                              slave_address, function_number, number_of_points)
+            except TimeoutError as e:
+                stats['timeouts'] += 1
+                decoder.clear()
+                resp = e
+            except ModbusException as e:
+                stats['exceptions'] += 1
+                resp = e
+            except ValueError as e:
+                stats['crc_errors' if isinstance(e, CrcError) else 'unexpected'] += 1
+                decoder.clear()
+                resp = e
+            else:
+                stats['responses'] += 1
+                if decode and function_number in (3, 4):
+                    key = (start_address, number_of_points)
+                    addresses = addresses_cache.get(key)
+                    if addresses is None:
+                        addresses = addresses_cache[key] = self._float_addresses(*key)
+                    values = Eastron._decode_floats([(start_address, number_of_points, resp['payload'])],
+                                                    addresses, as_array=True)
+                    stats['values'] += len(values)
+            if callback is not None:
+                callback(t_ns, request, resp, values)
+        elapsed = time.perf_counter() - start
+
+        stats['elapsed'] = elapsed
+        stats['exchanges_per_s'] = len(self.exchanges) / elapsed if elapsed > 0 else 0.0
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a capture through the response parser and decoders')
+    parser.add_argument('capture', help="Capture file, see --capture of read_influx.py and dump_all.py")
+    parser.add_argument('--dump', help="Print every exchange", action='store_true')
+    parser.add_argument('--repeat', help="Replay this many times, for benchmarking", type=int, default=1)
+    args = parser.parse_args()
+
+    replay = CaptureReplay.from_file(args.capture)
+
+    def dump(t_ns, request, resp, values):
+        print("{:.6f} < {}".format(t_ns / 1e9, request.hex(' ')))
+        if isinstance(resp, Exception):
+            print("  ! {}".format(resp))
+        else:
+            print("  > {}".format(bytes(resp['frame']).hex(' ')))
+        if values is not None:
+            print("  = {}".format(", ".join("{:g}".format(v) for v in values)))
+
+    for i in range(args.repeat):
+        stats = replay.run(callback=dump if args.dump and i == 0 else None)
+    print("{exchanges} exchanges: {responses} responses, {timeouts} timeouts, {crc_errors} CRC errors, "
+          "{exceptions} exceptions, {unexpected} unexpected responses".format(**stats))
+    print("{exchanges_per_s:.0f} exchanges/s, {values} values decoded".format(**stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,50 @@
 import argparse
-import serial
 import cmath
 
-from src.eastron import DebuggableSerial, Eastron3P3W
+from eastron import Eastron, Eastron3P3W
+from transport import TRANSPORTS, open_transport
 
 
 parser = argparse.ArgumentParser(description='Eastron reader')
 parser.add_argument('--addr', help="Address to query", type=int, default=1)
-parser.add_argument('serial_port', help="Serial port to open")
+parser.add_argument('--gap-threshold', help="Bytes of unused registers to read to avoid an additional request",
+                    type=int, default=None)
+parser.add_argument('--plan', help="Print the read plan before reading", action='store_true')
+parser.add_argument('serial_port', help="Serial port to open, or host:port for TCP transports")
+parser.add_argument('--transport', help="How to reach the meter", choices=TRANSPORTS, default='serial')
+parser.add_argument('--capture', help="Record all traffic in this ring file, for capture.py to replay. "
+                                     "Not supported with --transport tcp", default=None)
+parser.add_argument('--wiring', help="Wiring mode of the installation: only read registers that are valid for it. "
+                                     "'auto' asks the meter. Default: read all registers",
+                    choices=['auto', 'all', '4w', '3w', '2w'], default='all')
+parser.add_argument('--config', help="Also print the meter's configuration (holding registers)", action='store_true')
 
 args = parser.parse_args()
 
 
-ser = DebuggableSerial(args.serial_port, 9600, serial.EIGHTBITS, serial.PARITY_EVEN, serial.STOPBITS_ONE)
-ser.debug = False
-ser.reset_input_buffer()
-m = Eastron3P3W(ser, args.addr)
+ser = open_transport(args.transport, args.serial_port, capture=args.capture)
+m = Eastron(ser, args.addr, gap_threshold=args.gap_threshold,
+            wiring=None if args.wiring == 'all' else args.wiring)
 
-all_addresses = [
-    info['addr']
-    for name, info in Eastron3P3W.defined_registers.items()
-]
-all_data = m.read_input_registers_float(all_addresses)
-
-for name in sorted(Eastron3P3W.defined_registers.keys(),
-                   key=lambda n: Eastron3P3W.defined_registers[n]['addr']):
-    addr = Eastron3P3W.defined_registers[name]['addr']
-    print("{n} = {v}".format(n=name, v=all_data[addr]))
+registers = m.registers()
+if args.wiring == 'auto':
+    print("Wiring mode: {}".format(m.wiring))
+if args.config:
+    for name, value in m.config().items():
+        print("{n} = {v}".format(n=name, v=value))
+    print("")
+if args.plan:
+    plan = m.register_map.plan(m, m.wiring)
+    print("Read plan: {} frames, {} bytes on the wire ({} bytes unused registers)".format(
+        len(plan), plan.total_bytes, plan.junk_bytes))
+    for start_addr, num in plan:
+        print("  0x{:04x} +{}".format(start_addr, num))
+    print("")
+values = m.read_registers()
+all_data = {}
+for register, value in zip(registers, values):
+    all_data[register.addr] = value
+    print("{n} = {v}".format(n=register.name, v=value))
 
 
 def abs_angle(num: complex) -> str:
@@ -36,10 +54,14 @@ def abs_angle(num: complex) -> str:
     )
 
 
+if m.wiring not in (None, '3w'):
+    exit(0)
+
+v = Eastron3P3W.derive(all_data)
 print("")
-print("Calculated I1 [A] = {}".format(abs_angle(m.I1)))
-print("Calculated I2 [A] = {}".format(abs_angle(m.I2)))
-print("Calculated I3 [A] = {}".format(abs_angle(m.I3)))
-print("Calculated S1 [W] = {}".format(m.S1))
-print("Calculated S3 [W] = {}".format(m.S3))
-print("Calculated S [W] = {}".format(m.S))
+print("Calculated I1 [A] = {}".format(abs_angle(v.I1_u1)))
+print("Calculated I2 [A] = {}".format(abs_angle(v.I2_u1)))
+print("Calculated I3 [A] = {}".format(abs_angle(v.I3_u1)))
+print("Calculated S1 [W] = {}".format(v.S1_u12))
+print("Calculated S3 [W] = {}".format(v.S3_u32))
+print("Calculated S [W] = {}".format(v.S))
@@ -1,6 +1,12 @@
-import functools
+import array
+import bisect
 import cmath
+import collections
+import os
+import select
 import struct
+import sys
+import time
 import typing
 
 import crcmod
@@ -11,6 +17,46 @@ from Promise import Promise
 eastron_crc = crcmod.mkCrcFun(0x18005, 0xffff, True, 0x0000)
 
 
+def _crc_table() -> typing.List[int]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xa001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def table_crc(data: bytes) -> int:
+    """
+    Table-driven Modbus CRC in pure Python. Same result as eastron_crc, which
+    is faster when crcmod's C extension is available.
+    """
+    crc = 0xffff
+    table = _CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+    return crc
+
+
+def crc_valid(frame: bytes) -> bool:
+    """
+    Check the CRC of a complete RTU frame. The CRC over a frame including its
+    (little endian) CRC is 0, so there's no need to split off and unpack it.
+    """
+    return eastron_crc(frame) == 0
+
+
+class ReadTimeout(TimeoutError):
+    """No new byte arrived in time. `partial` holds the bytes of the read that did arrive."""
+    def __init__(self, partial: bytes = b''):
+        super().__init__("No new bytes received within timeout")
+        self.partial = bytes(partial)
+
+
 class DebuggableSerial(serial.Serial):
     def __init__(self, *args, **kwargs):
         self.debug = False
@@ -24,21 +70,39 @@ class DebuggableSerial(serial.Serial):
         return data
 
     def read_with_idle_timeout(self, size=1, timeout=0.1):
+        """Read `size` bytes, raise ReadTimeout when no new byte arrives within `timeout` seconds"""
+        if os.name == 'posix':
+            # Wait with select(): changing the port's timeout reconfigures the
+            # port, which is too slow to do for every request.
+            data = bytearray()
+            while len(data) < size:
+                readable, _, _ = select.select([self.fd], [], [], timeout)
+                if not readable:
+                    raise ReadTimeout(data)
+                data += self.read(min(size - len(data), max(1, self.in_waiting)))
+            return data
+
         old_timeout = self.timeout
+        if old_timeout == timeout:
+            # Changing the timeout reconfigures the port, avoid it when possible
+            return self._read_with_idle_timeout(size)
         try:
             self.timeout = timeout
-            data = bytearray()
-            while size > 0:
-                new_data = self.read(size)
-                if len(new_data) > 0:
-                    size -= len(new_data)
-                    data += new_data
-                else:
-                    raise TimeoutError("No new bytes received within timeout")
-            return data
+            return self._read_with_idle_timeout(size)
         finally:
             self.timeout = old_timeout
 
+    def _read_with_idle_timeout(self, size):
+        data = bytearray()
+        while size > 0:
+            new_data = self.read(size)
+            if len(new_data) > 0:
+                size -= len(new_data)
+                data += new_data
+            else:
+                raise ReadTimeout(data)
+        return data
+
     def write(self, data):
         if self.debug:
             hexdata = " ".join("{:02x}".format(c) for c in data)
@@ -46,43 +110,398 @@ class DebuggableSerial(serial.Serial):
         return super().write(data)
 
 
+class CrcError(ValueError):
+    """A response frame with a CRC mismatch"""
+
+
+class ModbusException(Exception):
+    """Exception response (function code | 0x80) received from a slave"""
+    def __init__(self, slave_address: int, function: int, exception_code: int):
+        super().__init__("Slave {} responded to function {} with exception code {}".format(
+            slave_address, function, exception_code))
+        self.slave_address = slave_address
+        self.function = function
+        self.exception_code = exception_code
+
+
+class SlaveUnavailable(TimeoutError):
+    """The slave failed too often recently; it is not asked again until its back-off time has passed"""
+    def __init__(self, slave_address: int, retry_in: float):
+        super().__init__("Slave {} is not responding, retrying in {:.1f}s".format(slave_address, retry_in))
+        self.slave_address = slave_address
+        self.retry_in = retry_in
+
+
+class SlaveHealth:
+    """
+    Response statistics of a single slave, used to adapt its timeout and to
+    stop wasting bus time on it when it is dead.
+
+    The timeout is `factor` times the 95th percentile of the last `window`
+    response times, limited to [min_timeout, max_timeout]; `initial_timeout`
+    is used until there are `min_samples` samples.
+
+    After `failure_threshold` consecutive failed requests, the circuit opens:
+    requests fail immediately with SlaveUnavailable for `min_backoff`
+    seconds. After that, a single request is let through; if it fails too,
+    the back-off time doubles, up to `max_backoff`.
+    """
+    def __init__(self,
+                 initial_timeout: float = 0.1,
+                 min_timeout: float = 0.02,
+                 max_timeout: float = 1.0,
+                 factor: float = 2.0,
+                 window: int = 50,
+                 min_samples: int = 5,
+                 failure_threshold: int = 3,
+                 min_backoff: float = 5.0,
+                 max_backoff: float = 300.0,
+                 clock: typing.Callable = time.monotonic):
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.factor = factor
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+
+        self.latencies = collections.deque(maxlen=window)
+        self.timeout = initial_timeout
+        self.consecutive_failures = 0
+        self.backoff = 0.0
+        self.open_until = None
+
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def latency_percentile(self, p: float) -> typing.Optional[float]:
+        if len(self.latencies) == 0:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def record_success(self, latency: float) -> None:
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.backoff = 0.0
+        self.open_until = None
+        self.latencies.append(latency)
+        if len(self.latencies) >= self.min_samples:
+            self.timeout = min(self.max_timeout, max(self.min_timeout,
+                                                     self.factor * self.latency_percentile(0.95)))
+
+    def record_failure(self) -> None:
+        """A request failed, after its retries"""
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.open_until is not None or self.consecutive_failures >= self.failure_threshold:
+            self.backoff = min(self.max_backoff, max(self.min_backoff, 2 * self.backoff))
+            self.open_until = self.clock() + self.backoff
+
+    def is_open(self) -> bool:
+        """Should requests to this slave be refused right now?"""
+        return self.open_until is not None and self.clock() < self.open_until
+
+    def check(self, slave_address: int) -> None:
+        """Raise SlaveUnavailable if the circuit is open"""
+        if self.is_open():
+            self.rejected += 1
+            raise SlaveUnavailable(slave_address, self.open_until - self.clock())
+
+
+class RtuFrameDecoder:
+    """
+    Incremental Modbus RTU response parser.
+
+    feed() it whatever bytes are available; next_frame() returns complete,
+    CRC-checked frames one at a time, or None if more bytes are needed.
+    When the buffer doesn't start with a valid frame (unknown function code,
+    CRC mismatch), the first byte is discarded and parsing restarts at the
+    next one, until the stream is in sync again.
+    """
+    # Function codes whose response carries a byte count in the 3rd byte
+    counted_functions = {1, 2, 3, 4}
+    # Function codes whose response is an 8 byte echo of the request
+    fixed_functions = {5, 6, 15, 16}
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.crc_errors = 0
+        self.discarded_bytes = 0
+        self._in_sync = True
+
+    def feed(self, data: bytes) -> None:
+        self.buffer += data
+
+    def clear(self) -> None:
+        self.discarded_bytes += len(self.buffer)
+        self.buffer.clear()
+        self._in_sync = True
+
+    def _frame_length(self) -> typing.Optional[int]:
+        """
+        Length of the frame at the start of the buffer, None if not known yet,
+        0 if the buffer does not start with a valid frame.
+        """
+        if len(self.buffer) < 2:
+            return None
+        func = self.buffer[1]
+        if func & 0x80:
+            return 5
+        if func in self.fixed_functions:
+            return 8
+        if func in self.counted_functions:
+            if len(self.buffer) < 3:
+                return None
+            return 3 + self.buffer[2] + 2
+        return 0
+
+    def bytes_needed(self) -> int:
+        """Minimum number of bytes to feed() before next_frame() can succeed"""
+        length = self._frame_length()
+        if length is None:
+            return 3 - len(self.buffer)
+        return max(1, length - len(self.buffer))
+
+    def _discard(self, n: int = 1) -> None:
+        del self.buffer[:n]
+        self.discarded_bytes += n
+        self._in_sync = False
+
+    def _valid_frame_at(self, offset: int) -> bool:
+        """Is there a complete frame with a valid CRC at `offset` in the buffer?"""
+        if len(self.buffer) - offset < 5:
+            return False
+        func = self.buffer[offset + 1]
+        if func & 0x80:
+            length = 5
+        elif func in self.fixed_functions:
+            length = 8
+        elif func in self.counted_functions:
+            length = 3 + self.buffer[offset + 2] + 2
+        else:
+            return False
+        if len(self.buffer) - offset < length:
+            return False
+        with memoryview(self.buffer) as view:
+            # Release the view right away, or the buffer can't be resized
+            return crc_valid(view[offset:offset + length])
+
+    def next_frame(self) -> typing.Optional[dict]:
+        while True:
+            length = self._frame_length()
+            if length is None:
+                return None
+            if length == 0:
+                self._discard()
+                continue
+            if len(self.buffer) < length:
+                if not self._in_sync:
+                    # The bytes at the start may be garbage that merely looks
+                    # like the start of a long frame. Look for a valid frame
+                    # further on before waiting for more data.
+                    for offset in range(1, len(self.buffer) - 4):
+                        if self._valid_frame_at(offset):
+                            self._discard(offset)
+                            break
+                    else:
+                        return None
+                    continue
+                return None
+
+            frame = bytes(self.buffer[:length])
+            if not crc_valid(frame):
+                self.crc_errors += 1
+                self._discard()
+                continue
+            del self.buffer[:length]
+            self._in_sync = True
+
+            slave_address, func = frame[0], frame[1]
+            resp = {
+                'slave_address': slave_address,
+                'function': func,
+                'frame': frame,
+            }
+            if func & 0x80:
+                resp['exception_code'] = frame[2]
+                resp['payload'] = frame[2:3]
+            elif func in self.counted_functions:
+                resp['payload'] = frame[3:-2]
+            else:
+                resp['payload'] = frame[2:-2]
+            return resp
+
+    def resync_on_timeout(self, timeout: TimeoutError, crc_errors: int) -> typing.Optional[dict]:
+        """
+        No more bytes are coming: garbage at the start may have made us wait
+        for more than the response, so look for it in what did arrive.
+        Raises CrcError instead of `timeout` when frames failed their CRC
+        check since the decoder counted `crc_errors` of them.
+        """
+        self.feed(getattr(timeout, 'partial', b''))
+        # Even the start of the buffer is suspect now
+        self._in_sync = False
+        frame = self.next_frame()
+        if frame is None and self.crc_errors != crc_errors:
+            raise CrcError("CRC mismatch") from timeout
+        return frame
+
+    def __iter__(self):
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+
+class ReadPlan:
+    """
+    Sequence of (start_address, number_of_registers) frames that cover the
+    requested registers, together with the wire cost of executing it.
+    """
+    request_overhead = 8  # slave, function, start, count, CRC
+    response_overhead = 5  # slave, function, byte count, CRC
+
+    def __init__(self, frames: typing.List[typing.Tuple[int, int]], registers: typing.List[int]):
+        self.frames = frames
+        self.registers = registers
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def registers_read(self) -> int:
+        return sum(num for _, num in self.frames)
+
+    @property
+    def request_bytes(self) -> int:
+        return len(self.frames) * self.request_overhead
+
+    @property
+    def response_bytes(self) -> int:
+        return len(self.frames) * self.response_overhead + 2 * self.registers_read
+
+    @property
+    def junk_bytes(self) -> int:
+        """Bytes of registers that are read, but were not requested"""
+        return 2 * (self.registers_read - len(self.registers))
+
+    @property
+    def total_bytes(self) -> int:
+        return self.request_bytes + self.response_bytes
+
+    def __repr__(self):
+        return "<ReadPlan {} frames, {} bytes ({} junk)>".format(
+            len(self.frames), self.total_bytes, self.junk_bytes)
+
+
 class Modbus:
-    def __init__(self, serial_port, slave_address):
+    max_registers_per_request = 64
+    gap_threshold = 0  # bytes of unrequested input registers worth reading to avoid an additional request
+    # Same, for holding registers. These are configuration: sparse, and
+    # rarely read, so only the requested ones are read by default.
+    holding_gap_threshold = 0
+    forbidden_ranges = {}  # {function: [(start, length)]} ranges the device refuses to read
+    # {function: [(start, length)]} ranges that are not read along with other
+    # registers, but may still be requested explicitly
+    undefined_ranges = {}
+
+    # Ready-to-send request frames, per (slave address, function, frames of a plan)
+    _request_frame_cache = {}
+    request_frame_cache_size = 1024
+
+    retries = 2  # additional attempts after a timeout or corrupt response
+    metrics = None  # metrics.ModbusMetrics to record traffic in, if any
+
+    def __init__(self, serial_port, slave_address,
+                 gap_threshold: int = None,
+                 forbidden_ranges: typing.Dict[int, typing.List[typing.Tuple[int, int]]] = None,
+                 max_registers_per_request: int = None,
+                 retries: int = None,
+                 health: SlaveHealth = None,
+                 metrics=None):
         self.serial = serial_port
         self.slave_address = slave_address
+        self._decoder = RtuFrameDecoder()
+        if retries is not None:
+            self.retries = retries
+        self.health = health if health is not None else SlaveHealth()
+        if metrics is not None:
+            self.metrics = metrics
+        self._metrics = self.metrics.for_slave(slave_address) if self.metrics is not None else None
+        if gap_threshold is not None:
+            self.gap_threshold = gap_threshold
+        if forbidden_ranges is not None:
+            self.forbidden_ranges = forbidden_ranges
+        if max_registers_per_request is not None:
+            self.max_registers_per_request = max_registers_per_request
 
     @staticmethod
     def _construct_request(slave_address: int,
                            function_number: int,
                            start_address: int,
-                           number_of_points: int) -> bytes:
-        msg = struct.pack("> B B H H", slave_address, function_number, start_address, number_of_points)
+                           number_of_points: int,
+                           data: bytes = b'') -> bytes:
+        """
+        `number_of_points` is the register value for function 6. `data` follows
+        it, e.g. the byte count and values for function 16.
+        """
+        msg = struct.pack("> B B H H", slave_address, function_number, start_address, number_of_points) + data
         crc = eastron_crc(msg)
         msg += struct.pack("< H", crc)  # Yes, little endian...
         return msg
 
-    @staticmethod
-    def _read_modbus_response(get_n_bytes: typing.Callable) -> dict:
-        data = get_n_bytes(3)
-        crc_data = bytearray(data)
-        slave_address, func, data_len = struct.unpack("BBB", data)
-
-        payload = get_n_bytes(data_len)
-        crc_data += payload
-
-        data = get_n_bytes(2)
-        crc_actual, = struct.unpack("<H", data)  # Yes, little endian...
+    def _request_frames(self, function_number: int,
+                        frames: typing.Sequence[typing.Tuple[int, int]]) -> typing.Tuple[bytes, ...]:
+        """
+        The RTU request frames for (start_address, number_of_points) `frames`.
+        Polling repeats the same plans, so they are only built once.
+        """
+        key = (self.slave_address, function_number, tuple(frames))
+        cache = Modbus._request_frame_cache
+        requests = cache.get(key)
+        if requests is None:
+            if len(cache) >= self.request_frame_cache_size:
+                cache.clear()
+            requests = cache[key] = tuple(
+                self._construct_request(self.slave_address, function_number, start_address, number_of_points)
+                for start_address, number_of_points in frames
+            )
+        return requests
 
-        crc_should = eastron_crc(crc_data)
-        if crc_actual != crc_should:
-            raise ValueError("CRC mismatch. Calculated 0x{:x}, Received 0x{:x}".format(
-                crc_should, crc_actual))
+    @staticmethod
+    def _read_modbus_response(get_n_bytes: typing.Callable, decoder: "RtuFrameDecoder" = None) -> dict:
+        """
+        Read a single response frame, asking `get_n_bytes` for exactly as many
+        bytes as are needed to complete it. Bytes beyond the frame stay in
+        `decoder` for the next call.
 
-        return {
-            'slave_address': slave_address,
-            'function': func,
-            'payload': payload,
-        }
+        A CRC mismatch may just be noise in front of the response, so the
+        decoder keeps looking further on until no more bytes arrive; only
+        then is CrcError raised.
+        """
+        if decoder is None:
+            decoder = RtuFrameDecoder()
+        crc_errors = decoder.crc_errors
+        while True:
+            frame = decoder.next_frame()
+            if frame is not None:
+                return frame
+            try:
+                decoder.feed(get_n_bytes(decoder.bytes_needed()))
+            except TimeoutError as e:
+                frame = decoder.resync_on_timeout(e, crc_errors)
+                if frame is not None:
+                    return frame
+                raise
 
     @staticmethod
     def _normalize_ranges(*ranges) -> typing.List[typing.Tuple[int, int]]:
@@ -115,45 +534,487 @@ class Modbus:
         return normalized_ranges
 
     @staticmethod
-    def _aggregate_ranges(*ranges) -> typing.List[typing.Tuple[int, int]]:
-        ranges = Modbus._normalize_ranges(*ranges)
-        ranges = sorted(ranges)
-
-        # Always add the first item
-        agg_ranges = [ranges[0]]
-        ranges = ranges[1:]
-        while len(ranges):
-            next_address = agg_ranges[-1][0] + agg_ranges[-1][1]
-            if ranges[0][0] == next_address:
-                # Match, extend the length
-                agg_ranges[-1] = (agg_ranges[-1][0], agg_ranges[-1][1] + ranges[0][1])
+    def _expand_ranges(*ranges) -> typing.List[int]:
+        """
+        Return the sorted list of individual register addresses covered by ranges
+        """
+        if len(ranges) == 0 or (len(ranges) == 1 and isinstance(ranges[0], (list, tuple)) and len(ranges[0]) == 0):
+            return []
+        addresses = set()
+        for start_address, range_length in Modbus._normalize_ranges(*ranges):
+            addresses.update(range(start_address, start_address + range_length))
+        return sorted(addresses)
+
+    @staticmethod
+    def _plan_reads(registers: typing.List[int],
+                    max_registers: int,
+                    gap_threshold: int,
+                    forbidden: typing.List[int] = (),
+                    joined: typing.Container[int] = ()) -> ReadPlan:
+        """
+        Plan the fewest frames that read all (sorted, unique) `registers`.
+
+        Unrequested registers between two requested ones are read along if
+        they are at most `gap_threshold` bytes, and none of them are in
+        `forbidden`. A register in `joined` is read in the same frame as the
+        one before it (e.g. the second half of a float); ValueError is raised
+        when that is impossible. Amongst plans with the same number of frames,
+        the one reading the fewest bytes is chosen.
+        """
+        forbidden = sorted(forbidden)
+        for addr in registers:
+            i = bisect.bisect_left(forbidden, addr)
+            if i < len(forbidden) and forbidden[i] == addr:
+                raise ValueError("Register 0x{:04x} is in a forbidden range".format(addr))
+
+        def can_bridge(lower: int, upper: int) -> bool:
+            gap = upper - lower - 1
+            if gap == 0:
+                return True
+            if 2 * gap > gap_threshold:
+                return False
+            # Is there a forbidden address in ]lower, upper[ ?
+            i = bisect.bisect_right(forbidden, lower)
+            return i >= len(forbidden) or forbidden[i] >= upper
+
+        # best[i] = (frames, registers_read, index of next frame start) to cover registers[i:]
+        n = len(registers)
+        best = [None] * (n + 1)
+        best[n] = (0, 0, None)
+        for i in reversed(range(n)):
+            if registers[i] in joined:
+                continue  # Can't start a frame here
+            j = i
+            while j < n:
+                if registers[j] - registers[i] + 1 > max_registers:
+                    break
+                if j > i and not can_bridge(registers[j-1], registers[j]):
+                    break
+                if best[j+1] is not None:
+                    frames, read, _ = best[j+1]
+                    candidate = (frames + 1, read + registers[j] - registers[i] + 1, j + 1)
+                    if best[i] is None or candidate[0:2] <= best[i][0:2]:  # prefer longer first frames on ties
+                        best[i] = candidate
+                j += 1
+        if best[0] is None:
+            # Splitting them would tear a float in two
+            raise ValueError("Joined registers don't fit in frames of {} registers".format(max_registers))
+
+        frames = []
+        i = 0
+        while i < n:
+            next_i = best[i][2]
+            frames.append((registers[i], registers[next_i - 1] - registers[i] + 1))
+            i = next_i
+        return ReadPlan(frames, list(registers))
+
+    def plan_reads(self, *ranges, function_number: int = 4) -> ReadPlan:
+        """
+        Plan the frames needed to read the given ranges with `function_number`
+        (4: input registers, 3: holding registers), taking this device's
+        request size limit, and the gap threshold, forbidden and undefined
+        ranges of that function into account. A range that fits in a single
+        frame is not split over two.
+        """
+        ranges = self._normalize_ranges(*ranges)
+        registers = self._expand_ranges(ranges)
+        forbidden = self._expand_ranges(self.forbidden_ranges.get(function_number, []))
+        undefined = self.undefined_ranges.get(function_number)
+        if undefined:
+            forbidden += set(self._expand_ranges(undefined)).difference(registers)
+        return self._plan_reads(
+            registers,
+            self.max_registers_per_request,
+            self.holding_gap_threshold if function_number == 3 else self.gap_threshold,
+            forbidden,
+            {
+                start_address + i
+                for start_address, range_length in ranges
+                if range_length <= self.max_registers_per_request
+                for i in range(1, range_length)
+            },
+        )
+
+    @staticmethod
+    def _check_response(resp: dict, slave_address: int, function_number: int,
+                        number_of_points: int = None) -> dict:
+        """
+        Raise ModbusException for an exception response, and ValueError for a
+        response that does not belong to the request, e.g. a late response to
+        an earlier one. For reads, the register count must match
+        `number_of_points`.
+        """
+        if resp['slave_address'] != slave_address:
+            raise ValueError("Unexpected response from slave {} function {}".format(
+                resp['slave_address'], resp['function']))
+        if resp['function'] == function_number | 0x80:
+            raise ModbusException(resp['slave_address'], function_number, resp['exception_code'])
+        if resp['function'] != function_number:
+            raise ValueError("Unexpected response from slave {} function {}".format(
+                resp['slave_address'], resp['function']))
+        if function_number in (3, 4) and number_of_points is not None \
+                and len(resp['payload']) != 2 * number_of_points:
+            raise ValueError("Response of slave {} has {} bytes of registers, expected {}".format(
+                slave_address, len(resp['payload']), 2 * number_of_points))
+        return resp
+
+    def _record_response(self, function_number: int, latency: float, resp: dict) -> None:
+        """Account for a valid response (an exception response is an answer too)"""
+        self.health.record_success(latency)
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.latency(function_number).observe(latency)
+            metrics.frames_received.inc()
+            metrics.bytes_received.inc(len(resp['frame']))
+
+    def _attempt_failed(self, error: Exception, attempt: int) -> bool:
+        """
+        Account for a timeout, lost connection or invalid response, and discard
+        whatever is left of it. Returns whether the request should be sent
+        again.
+        """
+        metrics = self._metrics
+        if metrics is not None:
+            if isinstance(error, (TimeoutError, ConnectionError)):
+                metrics.timeouts.inc()
+            elif isinstance(error, CrcError):
+                metrics.crc_errors.inc()
             else:
-                agg_ranges.append(ranges[0])
-            ranges = ranges[1:]
+                metrics.invalid_responses.inc()
+        self._resync()
+        if attempt < self.retries:
+            self.health.retries += 1
+            if metrics is not None:
+                metrics.retries.inc()
+            return True
+        self.health.record_failure()
+        return False
 
-        return agg_ranges
+    def _request(self, function_number: int, start_address: int, number_of_points: int,
+                 request: bytes = None, data: bytes = b'') -> dict:
+        """
+        Send a single request frame and wait for its response.
+        `request` is the RTU request frame, if it was built in advance.
+        `data` is appended to the request, see _construct_request().
 
-    def read_input_registers(self, *ranges):
-        ranges = self._aggregate_ranges(*ranges)
+        Timeouts, lost connections and invalid responses are retried up to
+        `retries` times, after discarding whatever is left of the response.
+        Raises SlaveUnavailable without using the bus if the slave has been
+        failing.
+        """
+        self.health.check(self.slave_address)
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                resp = self._exchange(function_number, start_address, number_of_points, request, data)
+                self._check_response(resp, self.slave_address, function_number, number_of_points)
+            except ModbusException:
+                self._record_response(function_number, time.monotonic() - start, resp)
+                raise
+            except (TimeoutError, ConnectionError, ValueError) as e:
+                if self._attempt_failed(e, attempt):
+                    attempt += 1
+                    continue
+                raise
+            self._record_response(function_number, time.monotonic() - start, resp)
+            return resp
+
+    def _exchange(self, function_number: int, start_address: int, number_of_points: int,
+                  request: bytes = None, data: bytes = b'') -> dict:
+        transact = getattr(self.serial, 'transact', None)
+        if transact is not None:
+            # Transport with its own framing (e.g. Modbus TCP)
+            sent = self._transport_sent()
+            try:
+                return transact(self.slave_address, function_number, start_address, number_of_points, data)
+            finally:
+                self._count_sent(sent)
+
+        if request is None:
+            request = self._construct_request(self.slave_address, function_number,
+                                              start_address, number_of_points, data)
+        self.serial.write(request)
+        if self._metrics is not None:
+            self._metrics.frames_sent.inc()
+            self._metrics.bytes_sent.inc(len(request))
+        timeout = self.health.timeout
+        return self._read_modbus_response(lambda n: self.serial.read_with_idle_timeout(n, timeout),
+                                          self._decoder)
+
+    def _transport_sent(self) -> typing.Tuple[int, int]:
+        """(frames, bytes) sent so far by a transport with its own framing"""
+        return self.serial.frames_sent, self.serial.bytes_sent
+
+    def _count_sent(self, before: typing.Tuple[int, int]) -> None:
+        """Count what the transport sent since _transport_sent() returned `before`"""
+        if self._metrics is not None:
+            frames_sent, bytes_sent = self._transport_sent()
+            self._metrics.frames_sent.inc(frames_sent - before[0])
+            self._metrics.bytes_sent.inc(bytes_sent - before[1])
+
+    def _resync(self) -> None:
+        """Drop partial and late responses, so the next response is read from its start"""
+        self._decoder.clear()
+        reset_input_buffer = getattr(self.serial, 'reset_input_buffer', None)
+        if reset_input_buffer is not None:
+            reset_input_buffer()
+
+    def _request_many(self, function_number: int,
+                      frames: typing.Iterable[typing.Tuple[int, int]]) -> typing.Iterator[dict]:
+        """
+        Responses to a (start_address, number_of_points) request per frame, in order.
+        Transports that support it get all requests outstanding at once.
+        """
+        frames = tuple(frames)
+        if getattr(self.serial, 'transact_many', None) is not None:
+            yield from self._request_pipelined(function_number, frames)
+            return
+
+        requests = self._request_frames(function_number, frames)
+        for (start_address, number_of_points), request in zip(frames, requests):
+            yield self._request(function_number, start_address, number_of_points, request=request)
+
+    def _request_pipelined(self, function_number: int,
+                           frames: typing.Sequence[typing.Tuple[int, int]]) -> typing.List[dict]:
+        """
+        _request_many() with all requests outstanding at once, and the same
+        accounting as _request(). If the pipelined attempt fails, the frames
+        without a valid response are retried one at a time.
+        """
+        self.health.check(self.slave_address)
+        sent = self._transport_sent()
+        try:
+            responses = self.serial.transact_many(self.slave_address, [
+                (function_number, start_address, number_of_points)
+                for start_address, number_of_points in frames
+            ])
+        except (TimeoutError, ConnectionError, ValueError) as e:
+            self._count_sent(sent)
+            if not self._attempt_failed(e, 0):
+                raise
+            return [self._request(function_number, start_address, number_of_points)
+                    for start_address, number_of_points in frames]
+        self._count_sent(sent)
+
+        for i, ((start_address, number_of_points), resp) in enumerate(zip(frames, responses)):
+            try:
+                self._check_response(resp, self.slave_address, function_number, number_of_points)
+            except ModbusException:
+                self._record_response(function_number, resp['latency'], resp)
+                raise
+            except ValueError as e:
+                if not self._attempt_failed(e, 0):
+                    raise
+                return responses[:i] + [self._request(function_number, start_address, number_of_points)
+                                        for start_address, number_of_points in frames[i:]]
+            self._record_response(function_number, resp['latency'], resp)
+        return responses
+
+    @staticmethod
+    def _decode_registers(start_addr: int, num: int, payload: bytes,
+                          wanted: typing.Container[int], registers: dict) -> None:
+        """Store the `wanted` registers from a response payload into `registers`"""
+        values = struct.unpack_from(">{}H".format(num), payload)
+        for i, register in enumerate(values):
+            if start_addr + i in wanted:
+                registers[start_addr + i] = register
+
+    def _read_registers(self, function_number: int, ranges) -> dict:
+        plan = self.plan_reads(*ranges, function_number=function_number)
+        wanted = set(plan.registers)
         registers = {}
-        for start_addr, num in ranges:
-            while num > 0:
-                limited_num = min(num, 64)  # limit number of regs per query
-
-                self.serial.write(self._construct_request(self.slave_address, 4, start_addr, limited_num))
-                resp = self._read_modbus_response(lambda n: self.serial.read_with_idle_timeout(n))
-                for i in range(limited_num):
-                    register, = struct.unpack_from(">H", resp['payload'])
-                    registers[start_addr + i] = register
-                    resp['payload'] = resp['payload'][2:]
-                num -= limited_num
+        for (start_addr, num), resp in zip(plan.frames, self._request_many(function_number, plan.frames)):
+            self._decode_registers(start_addr, num, resp['payload'], wanted, registers)
         return registers
 
+    def read_input_registers(self, *ranges):
+        return self._read_registers(4, ranges)
+
+    def read_holding_registers(self, *ranges):
+        return self._read_registers(3, ranges)
+
+    max_registers_per_write = 123  # Modbus limit for function 16
+
+    def write_register(self, address: int, value: int) -> None:
+        """Write a single holding register (function 6)"""
+        self._request(6, address, value)
+
+    def write_registers(self, start_address: int, values: typing.Sequence[int]) -> None:
+        """Write consecutive holding registers (function 16), in as few frames as possible"""
+        for offset in range(0, len(values), self.max_registers_per_write):
+            chunk = values[offset:offset + self.max_registers_per_write]
+            data = struct.pack(">B{}H".format(len(chunk)), 2 * len(chunk), *chunk)
+            self._request(16, start_address + offset, len(chunk), data=data)
+
+    def batch(self) -> "RequestBatch":
+        return RequestBatch(self)
+
+
+class RequestBatch:
+    """
+    Collects reads and writes for a single slave, and executes them in as
+    few frames as possible.
+
+    Writes are executed first, in the order they were added; writes to
+    adjacent registers are merged into a single function 16 frame, and a
+    lone register is written with function 6. Then the reads are executed,
+    one read plan per function, so they see the written values.
+
+    execute() returns {function: {address: register}}.
+    """
+    def __init__(self, modbus: Modbus):
+        self.modbus = modbus
+        self.reads = {}  # function -> [(start, count)]
+        self.writes = []  # [(start, [values])]
+
+    def read_input_registers(self, *ranges) -> "RequestBatch":
+        self.reads.setdefault(4, []).extend(Modbus._normalize_ranges(*ranges))
+        return self
+
+    def read_holding_registers(self, *ranges) -> "RequestBatch":
+        self.reads.setdefault(3, []).extend(Modbus._normalize_ranges(*ranges))
+        return self
+
+    def write_registers(self, start_address: int, values: typing.Sequence[int]) -> "RequestBatch":
+        if len(self.writes) > 0:
+            last_start, last_values = self.writes[-1]
+            if last_start + len(last_values) == start_address:
+                last_values.extend(values)
+                return self
+        self.writes.append((start_address, list(values)))
+        return self
+
+    def __len__(self):
+        """Number of frames execute() will send"""
+        frames = sum(
+            -(-len(values) // self.modbus.max_registers_per_write)
+            for _, values in self.writes
+        )
+        return frames + sum(
+            len(self.modbus.plan_reads(*ranges, function_number=function).frames)
+            for function, ranges in self.reads.items()
+        )
+
+    def execute(self) -> typing.Dict[int, dict]:
+        for start_address, values in self.writes:
+            if len(values) == 1:
+                self.modbus.write_register(start_address, values[0])
+            else:
+                self.modbus.write_registers(start_address, values)
+        return {
+            function: self.modbus._read_registers(function, ranges)
+            for function, ranges in self.reads.items()
+        }
+
+
+Register = collections.namedtuple('Register', ['index', 'name', 'addr', 'modes'])
+
+
+class RegisterMap:
+    """
+    A `defined_registers` table, compiled once into address-sorted, indexable
+    form: `registers[i]` is the i'th register in address order, with per
+    wiring mode subsets in `modes`. Read plans for a mode are cached, so
+    polling a mode does not rebuild address lists every time.
+    """
+    __slots__ = ('registers', 'by_name', 'by_addr', 'addresses', 'modes', 'mode_addresses', '_plans')
+
+    wiring_modes = ('4w', '3w', '2w')
+
+    def __init__(self, defined_registers: dict):
+        ordered = sorted(defined_registers.items(), key=lambda item: item[1]['addr'])
+        self.registers = tuple(
+            Register(i, name, info['addr'], frozenset(m for m in self.wiring_modes if info.get(m)))
+            for i, (name, info) in enumerate(ordered)
+        )
+        self.by_name = {r.name: r for r in self.registers}
+        self.by_addr = {r.addr: r for r in self.registers}
+        self.addresses = array.array('H', (r.addr for r in self.registers))
+        self.modes = {
+            mode: tuple(r for r in self.registers if mode in r.modes)
+            for mode in self.wiring_modes
+        }
+        self.mode_addresses = {
+            mode: array.array('H', (r.addr for r in registers))
+            for mode, registers in self.modes.items()
+        }
+        self.mode_addresses[None] = self.addresses
+        self._plans = {}
+
+    def __len__(self):
+        return len(self.registers)
+
+    def __iter__(self):
+        return iter(self.registers)
+
+    def undefined_ranges(self) -> typing.List[typing.Tuple[int, int]]:
+        """(start, length) of the holes between the (two register) floats of the map"""
+        holes = []
+        for lower, upper in zip(self.addresses, self.addresses[1:]):
+            if upper > lower + 2:
+                holes.append((lower + 2, upper - lower - 2))
+        return holes
+
+    def select(self, mode: str = None) -> typing.Tuple[Register, ...]:
+        """Registers valid in wiring `mode`, or all of them"""
+        if mode is None:
+            return self.registers
+        return self.modes[mode]
+
+    def plan(self, modbus: "Modbus", mode: str = None) -> ReadPlan:
+        """Read plan for the registers of `mode`, with `modbus`'s request settings"""
+        key = (mode, modbus.max_registers_per_request, modbus.gap_threshold,
+               tuple(tuple(r) for r in modbus.forbidden_ranges.get(4, [])),
+               tuple(tuple(r) for r in modbus.undefined_ranges.get(4, [])))
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = self._plans[key] = modbus.plan_reads([(r.addr, 2) for r in self.select(mode)])
+        return plan
+
 
 class Eastron(Modbus):
-    def __init__(self, *args, **kwargs):
+    # A request/response round trip costs ~13 bytes of framing, 2 inter-frame
+    # gaps and the meter's turnaround time: reading up to 48 bytes of unused
+    # registers is cheaper than that at 9600 baud. Only registers in
+    # defined_registers are read along: the meter isn't documented to accept
+    # reads of the holes between them (see undefined_ranges).
+    gap_threshold = 48
+
+    # Holding register with the configured system type, and the wiring mode
+    # (column in defined_registers) each type corresponds to
+    system_type_register = 0x000a
+    system_types = {1.0: '2w', 2.0: '3w', 3.0: '4w'}
+
+    wiring = None
+
+    # Configuration (holding registers). These are floats, except where
+    # 'type' says otherwise.
+    defined_holding_registers = {
+        'Demand period [min]':                   {'addr': 0x0002},
+        'System type':                           {'addr': 0x000a},
+        'Parity and stop bits':                  {'addr': 0x0012},
+        'Network node':                          {'addr': 0x0014},
+        'Baud rate':                             {'addr': 0x001c},
+        'Serial number':                         {'addr': 0xfc00, 'type': 'uint32'},
+    }
+    # Configuration changes rarely (and only when someone reconfigures the
+    # meter), keep it out of the poll cycle
+    config_max_age = 3600
+
+    def __init__(self, *args, wiring: str = None, **kwargs):
+        """
+        `wiring` is the installation's wiring mode ('4w', '3w' or '2w'), or
+        'auto' to ask the meter on first use. Only registers that are valid
+        for the wiring mode are read. None reads all registers.
+        """
         super().__init__(*args, **kwargs)
+        if wiring is not None:
+            if wiring != 'auto' and wiring not in RegisterMap.wiring_modes:
+                raise ValueError("Unknown wiring mode {}".format(wiring))
+            self.wiring = wiring
         self.delayed_reads = {}
+        self._config = SnapshotCache(self.read_config, self.config_max_age)
 
     defined_registers = {
         'Phase 1 line to neutral volts [V]':     {'addr': 0x0000, '4w': True,  '3w': False, '2w': True},
@@ -237,12 +1098,151 @@ class Eastron(Modbus):
         'Average line to line volts THD [%]':    {'addr': 0x0154, '4w': True,  '3w': True,  '2w': False},
     }
 
-    def read_input_registers_float(self, *addresses):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'defined_registers' in cls.__dict__:
+            cls.register_map = RegisterMap(cls.defined_registers)
+            cls.undefined_ranges = {4: cls.register_map.undefined_ranges()}
+
+    def read_input_registers_float(self, *addresses, as_array: bool = False):
+        """
+        Read the float values at `addresses`.
+        Returns a dict {address: value}, or with `as_array`, an array.array('f')
+        with the values in the order of `addresses`.
+        """
         if len(addresses) == 1 and (isinstance(addresses, list) or isinstance(addresses, tuple)):
             addresses = addresses[0]
 
-        ranges = [(a, 2) for a in addresses]
-        registers = self.read_input_registers(*ranges)
+        plan = self.plan_reads([(a, 2) for a in addresses])
+        return self._read_floats(plan, addresses, as_array)
+
+    def read_holding_registers_float(self, *addresses) -> dict:
+        """Read the float values of the holding registers at `addresses`"""
+        plan = self.plan_reads([(a, 2) for a in addresses], function_number=3)
+        return self._read_floats(plan, addresses, False, function_number=3)
+
+    def read_config(self) -> dict:
+        """Read all configuration registers, as {name: value}, bypassing the cache"""
+        addresses = [info['addr'] for info in self.defined_holding_registers.values()]
+        registers = self.batch().read_holding_registers([(a, 2) for a in addresses]).execute()[3]
+        return {
+            name: self._decode_holding(registers, info)
+            for name, info in self.defined_holding_registers.items()
+        }
+
+    def config(self) -> dict:
+        """The configuration, as {name: value}, read at most every `config_max_age` seconds"""
+        return self._config.get()
+
+    def write_config(self, name: str, value) -> None:
+        """Change a configuration register, and drop the cached configuration"""
+        info = self.defined_holding_registers[name]
+        if info.get('type') == 'uint32':
+            raw = struct.pack(">I", value)
+        else:
+            raw = struct.pack(">f", value)
+        try:
+            self.batch().write_registers(info['addr'], struct.unpack(">HH", raw)).execute()
+        finally:
+            self._config.invalidate()
+
+    @staticmethod
+    def _decode_holding(registers: dict, info: dict):
+        raw = struct.pack(">HH", registers[info['addr']], registers[info['addr'] + 1])
+        return struct.unpack(">I" if info.get('type') == 'uint32' else ">f", raw)[0]
+
+    def detect_wiring(self) -> str:
+        """Read the wiring mode from the meter's system type setting, and use it"""
+        system_type = self.config()['System type']
+        try:
+            self.wiring = self.system_types[system_type]
+        except KeyError:
+            raise ValueError("Unknown system type {}".format(system_type))
+        return self.wiring
+
+    def wiring_mode(self) -> typing.Optional[str]:
+        """The wiring mode, detecting it first if it is 'auto'"""
+        if self.wiring == 'auto':
+            self.detect_wiring()
+        return self.wiring
+
+    def registers(self) -> typing.Tuple[Register, ...]:
+        """The registers that are valid for the wiring mode"""
+        return self.register_map.select(self.wiring_mode())
+
+    def read_registers(self, mode: str = None, as_array: bool = True):
+        """
+        Read all registers of wiring `mode` (default: this meter's wiring
+        mode, all registers if that is None), using the precompiled register
+        map and read plan. With `as_array`, value i belongs to
+        `self.register_map.select(mode)[i]`.
+        """
+        if mode is None:
+            mode = self.wiring_mode()
+        return self._read_floats(self.register_map.plan(self, mode),
+                                 self.register_map.mode_addresses[mode], as_array)
+
+    def read_all(self) -> dict:
+        """Read all registers that are valid for the wiring mode, as {name: value}"""
+        registers = self.registers()
+        return {
+            r.name: value
+            for r, value in zip(registers, self.read_registers())
+        }
+
+    def _read_floats(self, plan: ReadPlan, addresses: typing.Sequence[int], as_array: bool,
+                     function_number: int = 4):
+        frames = [
+            (start_addr, num, resp['payload'])
+            for (start_addr, num), resp in zip(plan.frames, self._request_many(function_number, plan.frames))
+        ]
+        if self._metrics is None:
+            return self._decode_floats(frames, addresses, as_array)
+        start = time.perf_counter()
+        result = self._decode_floats(frames, addresses, as_array)
+        self._metrics.decode_time.observe(time.perf_counter() - start)
+        return result
+
+    @staticmethod
+    def _unpack_floats(payload: bytes) -> array.array:
+        """Decode a payload of consecutive big-endian floats in one go"""
+        values = array.array('f')
+        values.frombytes(memoryview(payload)[:len(payload) // 4 * 4])
+        if sys.byteorder == 'little':
+            values.byteswap()
+        return values
+
+    @staticmethod
+    def _decode_floats(frames: typing.Iterable[typing.Tuple[int, int, bytes]],
+                       addresses: typing.Sequence[int],
+                       as_array: bool = False) -> typing.Union[dict, array.array]:
+        """
+        Decode the floats at `addresses` from the response payloads of a read plan.
+        `frames` are (start_address, number_of_registers, payload), in address order.
+        """
+        if as_array:
+            result = array.array('f', bytes(4 * len(addresses)))
+        else:
+            result = {}
+        positions = sorted(range(len(addresses)), key=lambda i: addresses[i])
+        p = 0
+        for start_addr, num, payload in frames:
+            values = None
+            while p < len(positions) and addresses[positions[p]] < start_addr + num:
+                i = positions[p]
+                offset = addresses[i] - start_addr
+                if offset % 2 == 0:
+                    if values is None:
+                        values = Eastron._unpack_floats(payload)
+                    value = values[offset // 2]
+                else:
+                    value, = struct.unpack_from(">f", payload, 2 * offset)
+                result[i if as_array else addresses[i]] = value
+                p += 1
+        return result
+
+    @staticmethod
+    def _registers_to_float(registers: dict, addresses: typing.Iterable[int]) -> dict:
         assert len(registers) % 2 == 0
 
         float_regs = {}
@@ -273,49 +1273,181 @@ class Eastron(Modbus):
         self.delayed_reads = {}
 
 
+Eastron.register_map = RegisterMap(Eastron.defined_registers)
+Eastron.undefined_ranges = {4: Eastron.register_map.undefined_ranges()}
+
+
+class SnapshotCache:
+    """
+    Holds the result of `fetch()` for at most `max_age` seconds.
+
+    With `max_age` None, the value is kept until refresh() or invalidate() is
+    called. Every get() is counted as a hit or a miss; `expirations` counts the
+    misses caused by the value being too old.
+    """
+    def __init__(self, fetch: typing.Callable, max_age: float = None,
+                 clock: typing.Callable = time.monotonic):
+        self.fetch = fetch
+        self.max_age = max_age
+        self.clock = clock
+
+        self.value = None
+        self.timestamp = None
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+
+    @property
+    def age(self) -> typing.Optional[float]:
+        if self.timestamp is None:
+            return None
+        return self.clock() - self.timestamp
+
+    def stale(self) -> bool:
+        """
+        Whether the value has to be fetched again, counted as a hit or a miss.
+        For callers that fetch it themselves (e.g. with a coroutine), and
+        refresh() the cache with it.
+        """
+        if self.timestamp is None:
+            self.misses += 1
+            return True
+        if self.max_age is not None and self.age > self.max_age:
+            self.misses += 1
+            self.expirations += 1
+            return True
+        self.hits += 1
+        return False
+
+    def get(self):
+        if self.stale():
+            self.refresh()
+        return self.value
+
+    def refresh(self, value=None):
+        """Fetch a new value, or store `value` if given"""
+        if value is None:
+            value = self.fetch()
+        self.value = value
+        self.timestamp = self.clock()
+        return value
+
+    def invalidate(self) -> None:
+        self.value = None
+        self.timestamp = None
+
+
 class Eastron3P3W(Eastron):
     """Wrapper class to re-calculate wrong values"""
-    @functools.lru_cache()
+    wiring = '3w'
+
+    # Register addresses, resolved once from the register map
+    _U12 = Eastron.register_map.by_name['Line 1 to Line 2 volts [V]'].addr
+    _U23 = Eastron.register_map.by_name['Line 2 to Line 3 volts [V]'].addr
+    _U31 = Eastron.register_map.by_name['Line 3 to Line 1 volts [V]'].addr
+    _P1 = Eastron.register_map.by_name['Phase 1 power [W]'].addr
+    _Q1 = Eastron.register_map.by_name['Phase 1 volt amps reactive [VAr]'].addr
+    _P3 = Eastron.register_map.by_name['Phase 3 power [W]'].addr
+    _Q3 = Eastron.register_map.by_name['Phase 3 volt amps reactive [VAr]'].addr
+    _F = Eastron.register_map.by_name['Frequency of supply voltage [Hz]'].addr
+    _WH_IMPORT = Eastron.register_map.by_name['Import Wh since reset [kWh]'].addr
+    _WH_EXPORT = Eastron.register_map.by_name['Export Wh since reset [kWh]'].addr
+    _VARH_IMPORT = Eastron.register_map.by_name['Import VArh since reset [kVArh]'].addr
+    _VARH_EXPORT = Eastron.register_map.by_name['Export VArh since reset [kVArh]'].addr
+
+    registers_used = [
+        _U12, _U23, _U31,
+        _P1, _Q1, _P3, _Q3,
+        _F,
+        _WH_IMPORT, _WH_EXPORT, _VARH_IMPORT, _VARH_EXPORT,
+    ]
+
+    def __init__(self, *args, max_age: float = None, **kwargs):
+        """
+        Readings are taken in a single bus transaction, and shared by all
+        accessors until they are older than `max_age` seconds, or refresh() is
+        called.
+        """
+        super().__init__(*args, **kwargs)
+        self.snapshot = SnapshotCache(
+            lambda: self.read_input_registers_float(self.registers_used),
+            max_age)
+
+    def refresh(self, data: dict = None) -> dict:
+        """Take a new reading, or use `data` ({address: float}) if given"""
+        return self.snapshot.refresh(data)
+
     def _data(self) -> dict:
-        return self.read_input_registers_float(
-            self.defined_registers['Line 1 to Line 2 volts [V]']['addr'],
-            self.defined_registers['Line 2 to Line 3 volts [V]']['addr'],
-            self.defined_registers['Line 3 to Line 1 volts [V]']['addr'],
-            self.defined_registers['Phase 1 power [W]']['addr'],
-            self.defined_registers['Phase 1 volt amps reactive [VAr]']['addr'],
-            self.defined_registers['Phase 3 power [W]']['addr'],
-            self.defined_registers['Phase 3 volt amps reactive [VAr]']['addr'],
-            self.defined_registers['Frequency of supply voltage [Hz]']['addr'],
-            self.defined_registers['Import Wh since reset [kWh]']['addr'],
-            self.defined_registers['Export Wh since reset [kWh]']['addr'],
-            self.defined_registers['Import VArh since reset [kVArh]']['addr'],
-            self.defined_registers['Export VArh since reset [kVArh]']['addr'],
-        )
+        return self.snapshot.get()
 
     def _addr(self, addr: int) -> float:
         return self._data()[addr]
 
+    Values = collections.namedtuple('Values', [
+        'U12', 'U23', 'U31', 'f',
+        'S1_u12', 'S3_u32', 'S', 'E',
+        'I1_u12', 'I1_u1', 'I3_u32', 'I3_u1', 'I3_u3', 'I2_u1', 'I2_u2',
+    ])
+
+    @classmethod
+    def derive(cls, data: dict) -> "Eastron3P3W.Values":
+        """
+        Calculate all derived quantities from a snapshot {address: value}, in
+        a single pass. This is the same maths as the individual accessors.
+
+        The values may also be NumPy arrays (one element per snapshot), in which
+        case every field of the result is an array.
+        """
+        U12 = data[cls._U12]
+        U23 = data[cls._U23]
+        U31 = data[cls._U31]
+        S1_u12 = data[cls._P1] + 1j * data[cls._Q1]
+        S3_u32 = data[cls._P3] + 1j * data[cls._Q3]
+        E = (data[cls._WH_IMPORT] - data[cls._WH_EXPORT]) + \
+            1j * (data[cls._VARH_IMPORT] - data[cls._VARH_EXPORT])
+
+        I1_u12 = (S1_u12 / U12).conjugate()
+        I1_u1 = - (I1_u12 * cmath.rect(1, 150 / 180 * cmath.pi))
+        I3_u32 = (S3_u32 / U23).conjugate()
+        I3_u1 = - (I3_u32 * cmath.rect(1, 90 / 180 * cmath.pi))
+        I3_u3 = I3_u1 * cmath.rect(1, 120 / 180 * cmath.pi)
+        I2_u1 = - I1_u1 - I3_u1
+        I2_u2 = I2_u1 * cmath.rect(1, -120 / 180 * cmath.pi)
+
+        return cls.Values(
+            U12=U12, U23=U23, U31=U31,
+            f=data[cls._F],
+            S1_u12=S1_u12, S3_u32=S3_u32, S=S1_u12 + S3_u32, E=E,
+            I1_u12=I1_u12, I1_u1=I1_u1, I3_u32=I3_u32, I3_u1=I3_u1, I3_u3=I3_u3,
+            I2_u1=I2_u1, I2_u2=I2_u2,
+        )
+
+    def compute_all(self) -> "Eastron3P3W.Values":
+        """All derived quantities of the current snapshot"""
+        return self.derive(self._data())
+
     def U12(self) -> float:
-        return self._addr(self.defined_registers['Line 1 to Line 2 volts [V]']['addr'])
+        return self._addr(self._U12)
 
     def U23(self) -> float:
-        return self._addr(self.defined_registers['Line 2 to Line 3 volts [V]']['addr'])
+        return self._addr(self._U23)
 
     def U31(self) -> float:
-        return self._addr(self.defined_registers['Line 3 to Line 1 volts [V]']['addr'])
+        return self._addr(self._U31)
 
     def S1_u12(self) -> complex:
         """Phase 1 power. Angle lagging relative to U12."""
         return complex(
-            self._addr(self.defined_registers['Phase 1 power [W]']['addr']),
-            self._addr(self.defined_registers['Phase 1 volt amps reactive [VAr]']['addr']),
+            self._addr(self._P1),
+            self._addr(self._Q1),
         )
 
     def S3_u32(self) -> complex:
         """Phase 3 power. Angle lagging relative to U32."""
         return complex(
-            self._addr(self.defined_registers['Phase 3 power [W]']['addr']),
-            self._addr(self.defined_registers['Phase 3 volt amps reactive [VAr]']['addr']),
+            self._addr(self._P3),
+            self._addr(self._Q3),
         )
     
     def S(self) -> complex:
@@ -323,10 +1455,10 @@ class Eastron3P3W(Eastron):
         return self.S1_u12() + self.S3_u32()
 
     def E(self) -> complex:
-        r = self._addr(self.defined_registers['Import Wh since reset [kWh]']['addr']) - \
-            self._addr(self.defined_registers['Export Wh since reset [kWh]']['addr'])
-        im = self._addr(self.defined_registers['Import VArh since reset [kVArh]']['addr']) - \
-            self._addr(self.defined_registers['Export VArh since reset [kVArh]']['addr'])
+        r = self._addr(self._WH_IMPORT) - \
+            self._addr(self._WH_EXPORT)
+        im = self._addr(self._VARH_IMPORT) - \
+            self._addr(self._VARH_EXPORT)
         return complex(r, im)
 
     def I1_u12(self) -> complex:
@@ -363,4 +1495,4 @@ class Eastron3P3W(Eastron):
         return self.I2_u1() * cmath.rect(1, -120 / 180 * cmath.pi)
 
     def f(self) -> float:
-        return self._addr(self.defined_registers['Frequency of supply voltage [Hz]']['addr'])
+        return self._addr(self._F)
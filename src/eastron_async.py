@@ -0,0 +1,263 @@
+import asyncio
+import os
+import struct
+import time
+import typing
+
+from eastron import Modbus, Eastron, ModbusException, ReadPlan, ReadTimeout, Register, RequestBatch, RtuFrameDecoder
+
+
+class AsyncSerial:
+    """
+    Event-loop driven access to a serial port.
+
+    Works on anything with a file descriptor: an open `serial.Serial`, or a
+    plain fd such as one side of a pty. Incoming bytes are collected by a
+    reader callback on the event loop, so waiting for a response does not
+    block the thread, and several ports can be served from a single loop.
+    """
+    def __init__(self, port: typing.Union[int, typing.Any], loop: asyncio.AbstractEventLoop = None):
+        self.port = port
+        self.fd = port if isinstance(port, int) else port.fileno()
+        os.set_blocking(self.fd, False)
+        self.loop = loop or asyncio.get_running_loop()
+
+        self.lock = asyncio.Lock()  # held for a whole request/response exchange
+        self._buffer = bytearray()
+        self._data_available = asyncio.Event()
+        self.loop.add_reader(self.fd, self._on_readable)
+
+    def close(self) -> None:
+        self.loop.remove_reader(self.fd)
+
+    def _on_readable(self) -> None:
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        if len(data) == 0:
+            return
+        self._buffer += data
+        self._data_available.set()
+
+    def reset_input_buffer(self) -> None:
+        self._buffer.clear()
+        self._data_available.clear()
+
+    async def write(self, data: bytes) -> int:
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                written = os.write(self.fd, view)
+            except BlockingIOError:
+                writable = self.loop.create_future()
+                self.loop.add_writer(self.fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    self.loop.remove_writer(self.fd)
+                continue
+            view = view[written:]
+        return len(data)
+
+    async def read_with_idle_timeout(self, size: int = 1, timeout: float = 0.1) -> bytearray:
+        """
+        Return exactly `size` bytes. Raises ReadTimeout, with the bytes that
+        did arrive, if no new byte arrives within `timeout` seconds.
+        """
+        while len(self._buffer) < size:
+            self._data_available.clear()
+            try:
+                await asyncio.wait_for(self._data_available.wait(), timeout)
+            except asyncio.TimeoutError:
+                data = bytes(self._buffer)
+                self._buffer.clear()
+                raise ReadTimeout(data)
+        data = self._buffer[:size]
+        del self._buffer[:size]
+        return data
+
+
+class AsyncModbus(Modbus):
+    """
+    Modbus master on an AsyncSerial. Read plans, retries and slave health
+    are the same as for Modbus, but every method that uses the bus is a
+    coroutine.
+    """
+    @staticmethod
+    async def _read_modbus_response_async(get_n_bytes: typing.Callable, decoder: RtuFrameDecoder = None) -> dict:
+        """Coroutine version of Modbus._read_modbus_response()"""
+        if decoder is None:
+            decoder = RtuFrameDecoder()
+        crc_errors = decoder.crc_errors
+        while True:
+            frame = decoder.next_frame()
+            if frame is not None:
+                return frame
+            try:
+                decoder.feed(await get_n_bytes(decoder.bytes_needed()))
+            except TimeoutError as e:
+                frame = decoder.resync_on_timeout(e, crc_errors)
+                if frame is not None:
+                    return frame
+                raise
+
+    def _request(self, *args, **kwargs):
+        raise TypeError("AsyncModbus only supports its coroutines")
+
+    async def _request_async(self, function_number: int, start_address: int, number_of_points: int,
+                             data: bytes = b'') -> dict:
+        """Coroutine version of Modbus._request()"""
+        self.health.check(self.slave_address)
+        request = self._construct_request(self.slave_address, function_number, start_address,
+                                          number_of_points, data)
+        attempt = 0
+        while True:
+            # Clean up after a failed attempt while still holding the port,
+            # so the leftovers can't end up in another slave's response
+            async with self.serial.lock:
+                start = time.monotonic()
+                try:
+                    await self.serial.write(request)
+                    if self._metrics is not None:
+                        self._metrics.frames_sent.inc()
+                        self._metrics.bytes_sent.inc(len(request))
+                    timeout = self.health.timeout
+                    resp = await self._read_modbus_response_async(
+                        lambda n: self.serial.read_with_idle_timeout(n, timeout), self._decoder)
+                    self._check_response(resp, self.slave_address, function_number, number_of_points)
+                except ModbusException:
+                    self._record_response(function_number, time.monotonic() - start, resp)
+                    raise
+                except (TimeoutError, ValueError) as e:
+                    if self._attempt_failed(e, attempt):
+                        attempt += 1
+                        continue
+                    raise
+                except asyncio.CancelledError:
+                    self._resync()
+                    raise
+            self._record_response(function_number, time.monotonic() - start, resp)
+            return resp
+
+    async def _read_registers_async(self, function_number: int, ranges) -> dict:
+        plan = self.plan_reads(*ranges, function_number=function_number)
+        wanted = set(plan.registers)
+        registers = {}
+        for start_addr, num in plan.frames:
+            resp = await self._request_async(function_number, start_addr, num)
+            self._decode_registers(start_addr, num, resp['payload'], wanted, registers)
+        return registers
+
+    async def read_input_registers(self, *ranges):
+        return await self._read_registers_async(4, ranges)
+
+    async def read_holding_registers(self, *ranges):
+        return await self._read_registers_async(3, ranges)
+
+    async def write_register(self, address: int, value: int) -> None:
+        await self._request_async(6, address, value)
+
+    async def write_registers(self, start_address: int, values: typing.Sequence[int]) -> None:
+        for offset in range(0, len(values), self.max_registers_per_write):
+            chunk = values[offset:offset + self.max_registers_per_write]
+            data = struct.pack(">B{}H".format(len(chunk)), 2 * len(chunk), *chunk)
+            await self._request_async(16, start_address + offset, len(chunk), data=data)
+
+    def batch(self) -> "AsyncRequestBatch":
+        return AsyncRequestBatch(self)
+
+
+class AsyncRequestBatch(RequestBatch):
+    """RequestBatch for an AsyncModbus: execute() is a coroutine"""
+    async def execute(self) -> typing.Dict[int, dict]:
+        for start_address, values in self.writes:
+            if len(values) == 1:
+                await self.modbus.write_register(start_address, values[0])
+            else:
+                await self.modbus.write_registers(start_address, values)
+        return {
+            function: await self.modbus._read_registers_async(function, ranges)
+            for function, ranges in self.reads.items()
+        }
+
+
+class AsyncEastron(AsyncModbus, Eastron):
+    async def _read_floats_async(self, plan: ReadPlan, addresses: typing.Sequence[int], as_array: bool,
+                                 function_number: int = 4):
+        frames = []
+        for start_addr, num in plan.frames:
+            resp = await self._request_async(function_number, start_addr, num)
+            frames.append((start_addr, num, resp['payload']))
+        return self._decode_floats(frames, addresses, as_array)
+
+    async def read_input_registers_float(self, *addresses, as_array: bool = False):
+        if len(addresses) == 1 and (isinstance(addresses, list) or isinstance(addresses, tuple)):
+            addresses = addresses[0]
+
+        plan = self.plan_reads([(a, 2) for a in addresses])
+        return await self._read_floats_async(plan, addresses, as_array)
+
+    async def read_holding_registers_float(self, *addresses) -> dict:
+        plan = self.plan_reads([(a, 2) for a in addresses], function_number=3)
+        return await self._read_floats_async(plan, addresses, False, function_number=3)
+
+    async def read_config(self) -> dict:
+        addresses = [info['addr'] for info in self.defined_holding_registers.values()]
+        registers = (await self.batch().read_holding_registers([(a, 2) for a in addresses]).execute())[3]
+        return {
+            name: self._decode_holding(registers, info)
+            for name, info in self.defined_holding_registers.items()
+        }
+
+    async def config(self) -> dict:
+        if self._config.stale():
+            self._config.refresh(await self.read_config())
+        return self._config.value
+
+    async def write_config(self, name: str, value) -> None:
+        info = self.defined_holding_registers[name]
+        raw = struct.pack(">I" if info.get('type') == 'uint32' else ">f", value)
+        try:
+            await self.batch().write_registers(info['addr'], struct.unpack(">HH", raw)).execute()
+        finally:
+            self._config.invalidate()
+
+    async def detect_wiring(self) -> str:
+        system_type = (await self.config())['System type']
+        try:
+            self.wiring = self.system_types[system_type]
+        except KeyError:
+            raise ValueError("Unknown system type {}".format(system_type))
+        return self.wiring
+
+    async def wiring_mode(self) -> typing.Optional[str]:
+        if self.wiring == 'auto':
+            await self.detect_wiring()
+        return self.wiring
+
+    async def registers(self) -> typing.Tuple[Register, ...]:
+        return self.register_map.select(await self.wiring_mode())
+
+    async def read_registers(self, mode: str = None, as_array: bool = True):
+        if mode is None:
+            mode = await self.wiring_mode()
+        return await self._read_floats_async(self.register_map.plan(self, mode),
+                                             self.register_map.mode_addresses[mode], as_array)
+
+    async def read_all(self) -> dict:
+        registers = await self.registers()
+        return {
+            r.name: value
+            for r, value in zip(registers, await self.read_registers())
+        }
+
+    async def do_delayed_reads(self):
+        addresses = list(self.delayed_reads.keys())
+        vals = await self.read_input_registers_float(addresses)
+
+        for addr, proms in self.delayed_reads.items():
+            for prom in proms:
+                prom.set_value(vals[addr])
+
+        self.delayed_reads = {}
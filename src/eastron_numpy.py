@@ -0,0 +1,28 @@
+import typing
+
+import numpy
+
+from eastron import Eastron3P3W
+
+
+def compute_all(snapshots: typing.Union[dict, numpy.ndarray],
+                registers: typing.Sequence[int] = Eastron3P3W.registers_used) -> Eastron3P3W.Values:
+    """
+    Vectorised Eastron3P3W.compute_all() over many snapshots.
+
+    `snapshots` is either a dict {address: array of values}, or a 2D array
+    with one row per snapshot and one column per address in `registers`.
+    Every field of the result is an array with one element per snapshot.
+    """
+    if isinstance(snapshots, dict):
+        data = {
+            addr: numpy.asarray(values, dtype=numpy.float64)
+            for addr, values in snapshots.items()
+        }
+    else:
+        snapshots = numpy.asarray(snapshots, dtype=numpy.float64)
+        data = {
+            addr: snapshots[:, i]
+            for i, addr in enumerate(registers)
+        }
+    return Eastron3P3W.derive(data)
@@ -0,0 +1,282 @@
+import collections
+import numbers
+import os
+import queue
+import sys
+import threading
+import time
+import typing
+
+from influxdb.exceptions import InfluxDBClientError
+
+
+def _escape_key(s: str) -> str:
+    return s.replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def _escape_measurement(s: str) -> str:
+    return s.replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ')
+
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    # numbers.*, to include numpy's scalars
+    if isinstance(value, numbers.Integral):
+        return "{}i".format(int(value))
+    if isinstance(value, numbers.Real):
+        return repr(float(value))
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+class LineProtocolSerializer:
+    """
+    Converts points in the dict format of InfluxDBClient.write_points() to
+    line protocol.
+
+    The series key (measurement and tags) and the escaped field names are
+    cached, since the same series are written every poll. Like
+    InfluxDBClient, fields that are None and empty tags are left out: they
+    can't be written.
+    """
+    def __init__(self):
+        self._series = {}
+        self._fields = {}
+
+    def _series_key(self, measurement: str, tags: dict) -> str:
+        key = (measurement, tuple(sorted(tags.items())))
+        series = self._series.get(key)
+        if series is None:
+            series = _escape_measurement(measurement) + ''.join(
+                ",{}={}".format(_escape_key(str(k)), _escape_key(str(v)))
+                for k, v in key[1]
+                if v is not None and str(k) != '' and str(v) != ''
+            )
+            self._series[key] = series
+        return series
+
+    def _field_key(self, name: str) -> str:
+        escaped = self._fields.get(name)
+        if escaped is None:
+            escaped = self._fields[name] = _escape_key(name)
+        return escaped
+
+    def serialize(self, point: dict, time_ns: int = None) -> typing.Optional[str]:
+        """The line of `point`, None if it has no fields to write"""
+        fields = ",".join(
+            "{}={}".format(self._field_key(k), _format_value(v))
+            for k, v in point['fields'].items()
+            if v is not None
+        )
+        if fields == '':
+            return None
+        line = "{} {}".format(self._series_key(point['measurement'], point.get('tags', {})), fields)
+        t = point.get('time', time_ns)
+        if t is not None:
+            line += " {:d}".format(t)
+        return line
+
+
+class InfluxSink:
+    """
+    Write-behind buffer in front of an InfluxDBClient.
+
+    write_points() serialises the points, timestamps them, and puts them in a
+    bounded in-memory queue; it never waits for the database. A background
+    thread writes the queue in batches of up to `batch_size` lines, at least
+    every `flush_interval` seconds.
+
+    When a write fails, the batch is appended to the spool file at
+    `spool_path` (or kept in memory, up to `max_queue` lines, if there is no
+    spool file), and writes are suspended for an exponentially increasing
+    back-off time. Once a write succeeds again, the spooled lines are replayed
+    in bulk. Batches that the database rejects as invalid (4xx) are dropped.
+    """
+    def __init__(self, client,
+                 max_queue: int = 100000,
+                 batch_size: int = 5000,
+                 flush_interval: float = 1.0,
+                 spool_path: str = None,
+                 min_backoff: float = 1.0,
+                 max_backoff: float = 300.0,
+                 clock: typing.Callable = time.monotonic):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.max_queue = max_queue
+
+        self.serializer = LineProtocolSerializer()
+        self._queue = queue.Queue(max_queue)
+        self._retained = collections.deque()  # failed lines, when there is no spool file
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._spooled = spool_path is not None and (
+            os.path.exists(spool_path) or os.path.exists(spool_path + '.replay'))
+
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.failures = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "InfluxSink":
+        self._thread = threading.Thread(target=self._run, name='InfluxSink', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop the background thread, after trying to write what is queued"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write_points(self, points: typing.List[dict]) -> None:
+        time_ns = time.time_ns()
+        for point in points:
+            line = self.serializer.serialize(point, time_ns)
+            if line is None:
+                continue
+            try:
+                self._queue.put_nowait(line)
+            except queue.Full:
+                self.dropped += 1
+
+    def _next_batch(self) -> typing.List[str]:
+        batch = []
+        deadline = self.clock() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - self.clock()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            self._deliver(batch)
+        # Last attempt to write what is left
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._retry_at = 0.0
+        self._deliver(batch)
+
+    def _write(self, lines: typing.List[str]) -> None:
+        self.client.write_points(lines, protocol='line')
+        self.written += len(lines)
+
+    def _deliver(self, lines: typing.List[str]) -> None:
+        if self.clock() < self._retry_at:
+            self._hold(lines)
+            return
+        try:
+            self._replay()
+            if len(lines) > 0:
+                self._write(lines)
+        except InfluxDBClientError as e:
+            if e.code is not None and 400 <= e.code < 500:
+                print("InfluxDB rejected {} lines: {}".format(len(lines), e), file=sys.stderr)
+                self.rejected += len(lines)
+                return
+            self._failed(lines, e)
+        except Exception as e:  # Connection errors, server errors, ...
+            self._failed(lines, e)
+        else:
+            self._backoff = 0.0
+
+    def _failed(self, lines: typing.List[str], error: Exception) -> None:
+        self.failures += 1
+        self._backoff = min(self.max_backoff, max(self.min_backoff, 2 * self._backoff))
+        self._retry_at = self.clock() + self._backoff
+        print("Writing to InfluxDB failed, retrying in {}s: {}".format(self._backoff, error), file=sys.stderr)
+        self._hold(lines)
+
+    def _hold(self, lines: typing.List[str]) -> None:
+        """Keep lines for a later attempt"""
+        if len(lines) == 0:
+            return
+        if self.spool_path is not None:
+            with open(self.spool_path, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+            self._spooled = True
+            return
+        self._retained.extend(lines)
+        while len(self._retained) > self.max_queue:
+            self._retained.popleft()
+            self.dropped += 1
+
+    def _replay(self) -> None:
+        """Write held lines, oldest first"""
+        while len(self._retained) > 0:
+            batch = [self._retained[i] for i in range(min(self.batch_size, len(self._retained)))]
+            try:
+                self._write(batch)
+            except InfluxDBClientError as e:
+                if e.code is None or not 400 <= e.code < 500:
+                    raise
+                # Retrying invalid lines won't help, skip them
+                print("InfluxDB rejected {} held lines: {}".format(len(batch), e), file=sys.stderr)
+                self.rejected += len(batch)
+            for _ in batch:
+                self._retained.popleft()
+
+        if not self._spooled:
+            return
+        replaying = self.spool_path + '.replay'
+        if not os.path.exists(replaying):
+            if not os.path.exists(self.spool_path):
+                self._spooled = False
+                return
+            os.rename(self.spool_path, replaying)
+        with open(replaying) as f:
+            batch = []
+            for line in f:
+                batch.append(line.rstrip('\n'))
+                if len(batch) == self.batch_size:
+                    self._write_spooled(batch, f, replaying)
+                    batch = []
+            if len(batch) > 0:
+                self._write_spooled(batch, f, replaying)
+        os.remove(replaying)
+        self._spooled = os.path.exists(self.spool_path)
+
+    def _write_spooled(self, batch: typing.List[str], f: typing.TextIO, path: str) -> None:
+        try:
+            self._write(batch)
+        except InfluxDBClientError as e:
+            if e.code is not None and 400 <= e.code < 500:
+                # Retrying invalid lines won't help, skip them
+                print("InfluxDB rejected {} spooled lines: {}".format(len(batch), e), file=sys.stderr)
+                self.rejected += len(batch)
+                return
+            self._restore_spool(batch, f, path)
+            raise
+        except Exception:
+            self._restore_spool(batch, f, path)
+            raise
+
+    def _restore_spool(self, batch: typing.List[str], f: typing.TextIO, path: str) -> None:
+        """Put the unwritten lines back in front of the spool"""
+        with open(path + '.tmp', 'w') as tmp:
+            tmp.write('\n'.join(batch) + '\n')
+            for line in f:
+                tmp.write(line)
+            if os.path.exists(self.spool_path):
+                with open(self.spool_path) as spool:
+                    for line in spool:
+                        tmp.write(line)
+        os.replace(path + '.tmp', self.spool_path)
+        os.remove(path)
@@ -0,0 +1,237 @@
+import bisect
+import http.server
+import sys
+import threading
+import typing
+
+
+def _format_labels(names: typing.Sequence[str], values: typing.Sequence[str], extra: str = '') -> str:
+    items = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for name, value in zip(names, values)]
+    if extra:
+        items.append(extra)
+    if len(items) == 0:
+        return ''
+    return '{' + ','.join(items) + '}'
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n: float = 1) -> None:
+        self.value += n
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: typing.Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labels: typing.Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        The child for these label values. Look it up once and keep it: updating
+        a child is a plain attribute update.
+        """
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def _samples(self) -> typing.Iterator[str]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.type)]
+        lines.extend(self._samples())
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, n: float = 1) -> None:
+        """Increment the counter without labels"""
+        self.labels().inc(n)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield "{}{} {}".format(self.name, _format_labels(self.label_names, values), child.value)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+    default_buckets = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, name: str, help: str, labels: typing.Sequence[str] = (),
+                 buckets: typing.Sequence[float] = None):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets if buckets is not None else self.default_buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        """Observe a value of the histogram without labels"""
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                le = 'le="{}"'.format('+Inf' if bound == float('inf') else repr(float(bound)))
+                yield "{}_bucket{} {}".format(self.name, _format_labels(self.label_names, values, le), cumulative)
+            labels = _format_labels(self.label_names, values)
+            yield "{}_sum{} {}".format(self.name, labels, child.sum)
+            yield "{}_count{} {}".format(self.name, labels, child.count)
+
+
+class Registry:
+    """
+    A set of metrics, rendered in the Prometheus text format.
+
+    Updating metrics only touches plain attributes; all formatting happens
+    in render(), so instrumentation costs next to nothing when nobody looks.
+    """
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                raise ValueError("Metric {} already registered differently".format(metric.name))
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: typing.Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: typing.Sequence[str] = (),
+                  buckets: typing.Sequence[float] = None) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        return ''.join(metric.render() for metric in list(self._metrics.values()))
+
+    def serve(self, port: int, address: str = '') -> http.server.HTTPServer:
+        """Serve render() over HTTP on a background thread, for Prometheus to scrape"""
+        registry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        return server
+
+    def dump_periodically(self, interval: float, file: typing.TextIO = sys.stderr) -> threading.Event:
+        """Write render() to `file` every `interval` seconds. Set the returned event to stop."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                file.write(self.render())
+                file.flush()
+
+        threading.Thread(target=run, name='metrics-dump', daemon=True).start()
+        return stop
+
+
+class SlaveMetrics:
+    """The metrics of a single slave, with their labels resolved"""
+    __slots__ = ('frames_sent', 'frames_received', 'bytes_sent', 'bytes_received',
+                 'crc_errors', 'invalid_responses', 'timeouts', 'retries', 'decode_time',
+                 '_latency', '_latency_children')
+
+    def __init__(self, metrics: "ModbusMetrics", slave_address: int):
+        self.frames_sent = metrics.frames_sent.labels(slave_address)
+        self.frames_received = metrics.frames_received.labels(slave_address)
+        self.bytes_sent = metrics.bytes_sent.labels(slave_address)
+        self.bytes_received = metrics.bytes_received.labels(slave_address)
+        self.crc_errors = metrics.crc_errors.labels(slave_address)
+        self.invalid_responses = metrics.invalid_responses.labels(slave_address)
+        self.timeouts = metrics.timeouts.labels(slave_address)
+        self.retries = metrics.retries.labels(slave_address)
+        self.decode_time = metrics.decode_time.labels(slave_address)
+        self._latency = lambda function: metrics.latency.labels(slave_address, function)
+        self._latency_children = {}
+
+    def latency(self, function_number: int) -> _HistogramChild:
+        child = self._latency_children.get(function_number)
+        if child is None:
+            child = self._latency_children[function_number] = self._latency(function_number)
+        return child
+
+
+class ModbusMetrics:
+    """Metric families of the Modbus layer; pass to Modbus(metrics=...)"""
+    def __init__(self, registry: Registry):
+        self.frames_sent = registry.counter('modbus_frames_sent_total', 'Request frames sent', ['slave'])
+        self.frames_received = registry.counter('modbus_frames_received_total', 'Valid response frames received',
+                                                ['slave'])
+        self.bytes_sent = registry.counter('modbus_bytes_sent_total', 'Bytes of request frames sent', ['slave'])
+        self.bytes_received = registry.counter('modbus_bytes_received_total', 'Bytes of valid responses received',
+                                               ['slave'])
+        self.crc_errors = registry.counter('modbus_crc_errors_total', 'Corrupt responses (CRC errors)', ['slave'])
+        self.invalid_responses = registry.counter('modbus_invalid_responses_total',
+                                                  'Responses that do not match their request', ['slave'])
+        self.timeouts = registry.counter('modbus_timeouts_total', 'Requests without a (complete) response',
+                                         ['slave'])
+        self.retries = registry.counter('modbus_retries_total', 'Requests sent again after an error', ['slave'])
+        self.latency = registry.histogram('modbus_response_seconds', 'Time from request to complete response',
+                                          ['slave', 'function'])
+        self.decode_time = registry.histogram('modbus_decode_seconds', 'Time to decode the responses of a read',
+                                              ['slave'], buckets=(1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3))
+        self.poll_duration = registry.histogram('poll_duration_seconds', 'Duration of a complete poll cycle')
+        self._slaves = {}
+
+    def for_slave(self, slave_address: int) -> SlaveMetrics:
+        slave = self._slaves.get(slave_address)
+        if slave is None:
+            slave = self._slaves[slave_address] = SlaveMetrics(self, slave_address)
+        return slave
+
+
+REGISTRY = Registry()
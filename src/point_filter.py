@@ -0,0 +1,172 @@
+import collections
+import math
+import typing
+
+
+class Rule(collections.namedtuple('Rule', ['deadband', 'relative', 'heartbeat', 'compression'])):
+    """
+    How to filter a field:
+     * deadband: only emit a value when it differs more than this from the
+       last emitted value. 0 emits every change.
+     * relative: likewise, as a fraction of the last emitted value. The
+       larger of both bands applies.
+     * heartbeat: emit the value anyway when nothing was emitted for this
+       many seconds. None for no heartbeat.
+     * compression: use swinging door compression with this deviation
+       instead of the deadbands: only emit the points needed to reconstruct
+       the series within this deviation by linear interpolation.
+    """
+    __slots__ = ()
+
+    def __new__(cls, deadband: float = 0.0, relative: float = 0.0,
+                heartbeat: float = None, compression: float = None):
+        return super().__new__(cls, deadband, relative, heartbeat, compression)
+
+    @classmethod
+    def parse(cls, spec: str) -> "Rule":
+        """Parse a rule like "deadband=0.5,heartbeat=60" """
+        kwargs = {}
+        for item in spec.split(','):
+            key, sep, value = item.partition('=')
+            if sep == '' or key not in cls._fields:
+                raise ValueError("Invalid filter rule {}, expected KEY=VALUE with KEY one of {}".format(
+                    item, ", ".join(cls._fields)))
+            kwargs[key] = float(value)
+        return cls(**kwargs)
+
+
+class _FieldState:
+    __slots__ = ('last_time', 'last_value', 'held_time', 'held_value', 'slope_upper', 'slope_lower')
+
+    def __init__(self, t: int, value):
+        self.archive(t, value)
+
+    def archive(self, t: int, value) -> None:
+        self.last_time = t
+        self.last_value = value
+        self.held_time = None
+        self.held_value = None
+        self.slope_upper = math.inf
+        self.slope_lower = -math.inf
+
+
+class PointFilter:
+    """
+    Drops fields that did not change meaningfully since they were last
+    emitted, according to a Rule per field.
+
+    `rules` maps a field name, or "measurement.field" for a specific
+    measurement, to its Rule; fields without a rule use `default`, or are
+    always emitted if `default` is None. State is kept per series and field.
+
+    Points must be in the dict format of InfluxDBClient.write_points(). The
+    emitted points carry a 'time' (in ns), since swinging door compression
+    emits values from earlier polls.
+    """
+    def __init__(self, rules: typing.Dict[str, Rule] = None, default: Rule = None):
+        self.rules = rules or {}
+        self.default = default
+        self._state = {}
+
+        self.received = 0
+        self.emitted = 0
+
+    def _rule(self, measurement: str, field: str) -> typing.Optional[Rule]:
+        rule = self.rules.get("{}.{}".format(measurement, field))
+        if rule is None:
+            rule = self.rules.get(field, self.default)
+        return rule
+
+    def filter(self, points: typing.Iterable[dict], time_ns: int) -> typing.List[dict]:
+        """The points (or parts of them) to write for a poll at `time_ns`"""
+        out = []
+        for point in points:
+            measurement = point['measurement']
+            tags = point.get('tags', {})
+            t = point.get('time', time_ns)
+            series = (measurement, tuple(sorted(tags.items())))
+            fields = {}
+            for field, value in point['fields'].items():
+                self.received += 1
+                rule = self._rule(measurement, field)
+                if rule is None:
+                    fields[field] = value
+                    continue
+                for emit_time, emit_value in self._update(rule, (series, field), t, value):
+                    if emit_time == t:
+                        fields[field] = emit_value
+                    else:
+                        out.append(self._point(measurement, tags, field, emit_value, emit_time))
+            if len(fields) > 0:
+                self.emitted += len(fields)
+                out.append({'measurement': measurement, 'tags': tags, 'fields': fields, 'time': t})
+        return out
+
+    def flush(self) -> typing.List[dict]:
+        """Points held back by swinging door compression, e.g. before shutting down"""
+        out = []
+        for ((measurement, tags), field), state in self._state.items():
+            if state.held_time is not None:
+                out.append(self._point(measurement, dict(tags), field, state.held_value, state.held_time))
+                state.archive(state.held_time, state.held_value)
+        return out
+
+    def _point(self, measurement: str, tags: dict, field: str, value, t: int) -> dict:
+        self.emitted += 1
+        return {'measurement': measurement, 'tags': tags, 'fields': {field: value}, 'time': t}
+
+    def _update(self, rule: Rule, key, t: int, value) -> typing.List[typing.Tuple[int, typing.Any]]:
+        """Update the state of a field, returns the (time, value)s to emit"""
+        state = self._state.get(key)
+        if state is None:
+            self._state[key] = _FieldState(t, value)
+            return [(t, value)]
+
+        if rule.heartbeat is not None and t - state.last_time >= rule.heartbeat * 1e9:
+            emit = []
+            if state.held_time is not None:
+                # Still needed to reconstruct the series up to here
+                emit.append((state.held_time, state.held_value))
+            state.archive(t, value)
+            emit.append((t, value))
+            return emit
+
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            if value == state.last_value:
+                return []
+            state.archive(t, value)
+            return [(t, value)]
+
+        if rule.compression is not None:
+            return self._swinging_door(rule.compression, state, t, value)
+
+        band = max(rule.deadband, rule.relative * abs(state.last_value))
+        if not abs(value - state.last_value) > band:
+            return []
+        state.archive(t, value)
+        return [(t, value)]
+
+    @staticmethod
+    def _swinging_door(deviation: float, state: _FieldState, t: int, value: float):
+        dt = t - state.last_time
+        if dt <= 0:
+            return []
+        upper = min(state.slope_upper, (value + deviation - state.last_value) / dt)
+        lower = max(state.slope_lower, (value - deviation - state.last_value) / dt)
+        if lower <= (value - state.last_value) / dt <= upper:
+            # A line to this point passes within `deviation` of all points
+            # since the last emitted one: hold it, it may not be needed
+            state.slope_upper, state.slope_lower = upper, lower
+            state.held_time, state.held_value = t, value
+            return []
+
+        # The doors closed on this point: the held point is needed, and starts
+        # a new segment. (There always is a held point here: the first point
+        # after an emitted one is always within the doors.)
+        emit = [(state.held_time, state.held_value)]
+        state.archive(state.held_time, state.held_value)
+        dt = t - state.last_time
+        state.slope_upper = (value + deviation - state.last_value) / dt
+        state.slope_lower = (value - deviation - state.last_value) / dt
+        state.held_time, state.held_value = t, value
+        return emit
@@ -1,146 +1,379 @@
 import argparse
 import cmath
+import os
+import sys
+import time
+import typing
 
-import serial
 from influxdb import InfluxDBClient
 
-from eastron import DebuggableSerial, Eastron3P3W
+from eastron import Eastron3P3W
+from aggregation import Aggregator, parse_resolutions
+from influx_sink import InfluxSink
+import metrics
+from point_filter import PointFilter, Rule
+from site_snapshot import SiteSample, SiteSnapshot
+from snapshot_store import SnapshotStore
+from transport import TRANSPORTS, open_transport
 
-parser = argparse.ArgumentParser(description='Eastron reader')
-parser.add_argument('--addr', help="Address to query", type=int, default=1)
-parser.add_argument('serial_port', help="Serial port to query on")
-parser.add_argument('--db', help="influx database to write to", default='eastron')
 
-args = parser.parse_args()
-
-
-ser = DebuggableSerial(args.serial_port, 9600, serial.EIGHTBITS, serial.PARITY_EVEN, serial.STOPBITS_ONE)
-ser.debug = False
-ser.reset_input_buffer()
-m = Eastron3P3W(ser, args.addr)
-
-points = [
-    {
-        'measurement': 'power',
-        'tags': {
-            'addr': args.addr,
-            'phase': 'total',
-        },
-        'fields': {
-            'true_W': m.S().real,
-            'reactive_VAr': m.S().imag,
-            'apparent_VA': abs(m.S()),
+def measure(m: Eastron3P3W, addr: int, time_ns: int = None) -> typing.List[dict]:
+    v = m.compute_all()
+    points = [
+        {
+            'measurement': 'power',
+            'tags': {
+                'addr': addr,
+                'phase': 'total',
+            },
+            'fields': {
+                'true_W': v.S.real,
+                'reactive_VAr': v.S.imag,
+                'apparent_VA': abs(v.S),
+            },
         },
-    },
-    {
-        'measurement': 'power',
-        'tags': {
-            'addr': args.addr,
-            'phase': '1',
+        {
+            'measurement': 'power',
+            'tags': {
+                'addr': addr,
+                'phase': '1',
+            },
+            'fields': {
+                'true_W': v.S1_u12.real,
+                'reactive_VAr': v.S1_u12.imag,
+                'apparent_VA': abs(v.S1_u12),
+            },
         },
-        'fields': {
-            'true_W': m.S1_u12().real,
-            'reactive_VAr': m.S1_u12().imag,
-            'apparent_VA': abs(m.S1_u12()),
+        {
+            'measurement': 'power',
+            'tags': {
+                'addr': addr,
+                'phase': '3',
+            },
+            'fields': {
+                'true_W': v.S3_u32.real,
+                'reactive_VAr': v.S3_u32.imag,
+                'apparent_VA': abs(v.S3_u32),
+            },
         },
-    },
-    {
-        'measurement': 'power',
-        'tags': {
-            'addr': args.addr,
-            'phase': '3',
+        {
+            'measurement': 'energy',
+            'tags': {
+                'addr': addr,
+            },
+            'fields': {
+                'true_kWh': v.E.real,
+                'reactive_kVArh': v.E.imag,
+                'apparent_kVAh': abs(v.E),
+            },
         },
-        'fields': {
-            'true_W': m.S3_u32().real,
-            'reactive_VAr': m.S3_u32().imag,
-            'apparent_VA': abs(m.S3_u32()),
+        {
+            'measurement': 'frequency',
+            'tags': {
+                'addr': addr,
+            },
+            'fields': {
+                'frequency': v.f,
+            },
         },
-    },
-    {
-        'measurement': 'energy',
-        'tags': {
-            'addr': args.addr,
+        {
+            'measurement': 'line_voltage',
+            'tags': {
+                'addr': addr,
+                'lines': '12',
+            },
+            'fields': {
+                'voltage_V': v.U12,
+            },
         },
-        'fields': {
-            'true_kWh': m.E().real,
-            'reactive_kVArh': m.E().imag,
-            'apparent_kVAh': abs(m.E()),
+        {
+            'measurement': 'line_voltage',
+            'tags': {
+                'addr': addr,
+                'lines': '23',
+            },
+            'fields': {
+                'voltage_V': v.U23,
+            },
         },
-    },
-    {
-        'measurement': 'frequency',
-        'tags': {
-            'addr': args.addr,
+        {
+            'measurement': 'line_voltage',
+            'tags': {
+                'addr': addr,
+                'lines': '31',
+            },
+            'fields': {
+                'voltage_V': v.U31,
+            },
         },
-        'fields': {
-            'frequency': m.f(),
+        {
+            'measurement': 'line_current',
+            'tags': {
+                'addr': addr,
+                'line': '1',
+            },
+            'fields': {
+                'current_A': abs(v.I1_u1),
+                'angle_deg': cmath.phase(v.I1_u1),
+            },
         },
-    },
-    {
-        'measurement': 'line_voltage',
-        'tags': {
-            'addr': args.addr,
-            'lines': '12',
+        {
+            'measurement': 'line_current',
+            'tags': {
+                'addr': addr,
+                'line': '2',
+            },
+            'fields': {
+                'current_A': abs(v.I2_u2),
+                'angle_deg': cmath.phase(v.I2_u2),
+            },
         },
-        'fields': {
-            'voltage_V': m.U12(),
+        {
+            'measurement': 'line_current',
+            'tags': {
+                'addr': addr,
+                'line': '3',
+            },
+            'fields': {
+                'current_A': abs(v.I3_u3),
+                'angle_deg': cmath.phase(v.I3_u3),
+            },
         },
-    },
-    {
-        'measurement': 'line_voltage',
-        'tags': {
-            'addr': args.addr,
-            'lines': '23',
-        },
-        'fields': {
-            'voltage_V': m.U23(),
-        },
-    },
-    {
-        'measurement': 'line_voltage',
-        'tags': {
-            'addr': args.addr,
-            'lines': '31',
-        },
-        'fields': {
-            'voltage_V': m.U31(),
-        },
-    },
-    {
-        'measurement': 'line_current',
-        'tags': {
-            'addr': args.addr,
-            'line': '1',
-        },
-        'fields': {
-            'current_A': abs(m.I1_u1()),
-            'angle_deg': cmath.phase(m.I1_u1()),
-        },
-    },
-    {
-        'measurement': 'line_current',
-        'tags': {
-            'addr': args.addr,
-            'line': '2',
-        },
-        'fields': {
-            'current_A': abs(m.I2_u2()),
-            'angle_deg': cmath.phase(m.I2_u2()),
-        },
-    },
-    {
-        'measurement': 'line_current',
+    ]
+    if time_ns is not None:
+        for point in points:
+            point['time'] = time_ns
+    return points
+
+
+def site_point(sample: SiteSample, time_ns: int) -> dict:
+    """
+    Point with the aligned sum of S() over all meters. When meters are
+    missing, the point has no power fields, only the number of meters that
+    were (not) there.
+    """
+    fields = {}
+    if sample.total is not None:
+        fields['true_W'] = sample.total.real
+        fields['reactive_VAr'] = sample.total.imag
+        fields['apparent_VA'] = abs(sample.total)
+    fields['meters'] = len(sample.values)
+    fields['missing'] = len(sample.missing)
+    fields['alignment_error_s'] = max(sample.alignment_error.values(), default=0.0)
+    return {
+        'measurement': 'power',
         'tags': {
-            'addr': args.addr,
-            'line': '3',
-        },
-        'fields': {
-            'current_A': abs(m.I3_u3()),
-            'angle_deg': cmath.phase(m.I3_u3()),
+            'addr': 'site',
+            'phase': 'total',
         },
-    },
-]
+        'fields': fields,
+        'time': time_ns,
+    }
+
+
+# Default filter rules for the fields of measure(), see --filter
+FILTER_RULES = {
+    'true_W': Rule(deadband=1.0, relative=0.01),
+    'reactive_VAr': Rule(deadband=1.0, relative=0.01),
+    'apparent_VA': Rule(deadband=1.0, relative=0.01),
+    'true_kWh': Rule(deadband=0.01),
+    'reactive_kVArh': Rule(deadband=0.01),
+    'apparent_kVAh': Rule(deadband=0.01),
+    'frequency': Rule(compression=0.01),
+    'voltage_V': Rule(compression=0.5),
+    'current_A': Rule(deadband=0.01, relative=0.01),
+    'angle_deg': Rule(deadband=0.01),
+}
+
+
+# Fields of measure() that --aggregate doesn't roll up like a gauge: the
+# cumulative energy counters, and the angles
+COUNTER_FIELDS = ('true_kWh', 'reactive_kVArh', 'apparent_kVAh')
+LAST_ONLY_FIELDS = ('angle_deg',)
+
+
+def run_periodic(interval: float, func: typing.Callable,
+                 clock: typing.Callable = time.monotonic,
+                 sleep: typing.Callable = time.sleep,
+                 cycles: int = None):
+    """
+    Call `func` every `interval` seconds, on a fixed grid.
+
+    The next run is scheduled relative to the previous deadline, not to the end
+    of `func`, so the time spent in `func` does not accumulate as drift. When a
+    run overruns one or more slots, those slots are skipped instead of running
+    back-to-back to catch up.
+    """
+    next_run = clock()
+    while cycles is None or cycles > 0:
+        func()
+        if cycles is not None:
+            cycles -= 1
+        next_run += interval
+        now = clock()
+        if next_run < now:
+            missed = int((now - next_run) // interval) + 1
+            next_run += missed * interval
+        sleep(next_run - now)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Eastron reader')
+    parser.add_argument('--addr', help="Address to query, may be repeated to query multiple meters on the bus",
+                        type=int, action='append')
+    parser.add_argument('serial_port', help="Serial port to query on, or host:port for TCP transports")
+    parser.add_argument('--transport', help="How to reach the meters", choices=TRANSPORTS, default='serial')
+    parser.add_argument('--capture', help="Record all traffic in this ring file, for capture.py to replay. "
+                                         "Not supported with --transport tcp", default=None)
+    parser.add_argument('--db', help="influx database to write to", default='eastron')
+    parser.add_argument('--interval', help="Keep running, and poll every INTERVAL seconds", type=float, default=None)
+    parser.add_argument('--spool', help="File to buffer points in while the database is unreachable. "
+                                        "Only used with --interval", default=None)
+    parser.add_argument('--filter', help="Filter rule for a field, e.g. voltage_V=compression=0.5,heartbeat=60 "
+                                         "or power.true_W=deadband=5. Only used with --interval",
+                        action='append', default=[])
+    parser.add_argument('--heartbeat', help="Write every field at least every HEARTBEAT seconds, even if it "
+                                            "did not change. Only used with --interval", type=float, default=300)
+    parser.add_argument('--no-filter', help="Write every field of every poll", action='store_true')
+    parser.add_argument('--metrics-port', help="Serve Prometheus metrics of the Modbus traffic on this port",
+                        type=int, default=None)
+    parser.add_argument('--metrics-dump', help="Print the metrics to stderr every METRICS_DUMP seconds",
+                        type=float, default=None)
+    parser.add_argument('--aggregate', help="Only write rollups (mean, min, max, percentiles, integral; the "
+                                            "last value and increase of energy counters) over "
+                                            "windows of these comma separated lengths in seconds, e.g. 1,60,900. "
+                                            "Only used with --interval", default=None)
+    parser.add_argument('--store', help="Also keep the raw readings of every meter in a local store in this "
+                                        "directory (a subdirectory per meter)", default=None)
+    parser.add_argument('--store-days', help="Days of readings to keep in --store", type=float, default=28)
+    parser.add_argument('--site', help="Also write the total power of all meters, interpolated to a common "
+                                       "time grid. Only used with --interval", action='store_true')
+
+    args = parser.parse_args()
+    if args.addr is None:
+        args.addr = [1]
+
+    rules = {
+        field: rule._replace(heartbeat=args.heartbeat)
+        for field, rule in FILTER_RULES.items()
+    }
+    for spec in args.filter:
+        field, _, rule = spec.partition('=')
+        try:
+            rule = Rule.parse(rule)
+        except ValueError as e:
+            parser.error(str(e))
+        if rule.heartbeat is None:
+            rule = rule._replace(heartbeat=args.heartbeat)
+        rules[field] = rule
+
+    resolutions = None
+    if args.aggregate is not None:
+        try:
+            resolutions = parse_resolutions(args.aggregate)
+        except ValueError as e:
+            parser.error(str(e))
+
+    modbus_metrics = None
+    if args.metrics_port is not None or args.metrics_dump is not None:
+        modbus_metrics = metrics.ModbusMetrics(metrics.REGISTRY)
+        if args.metrics_port is not None:
+            metrics.REGISTRY.serve(args.metrics_port)
+        if args.metrics_dump is not None:
+            metrics.REGISTRY.dump_periodically(args.metrics_dump)
+
+    ser = open_transport(args.transport, args.serial_port, capture=args.capture)
+
+    db_con = InfluxDBClient(database=args.db)
+
+    meters = {
+        addr: Eastron3P3W(ser, addr, metrics=modbus_metrics)
+        for addr in args.addr
+    }
+
+    stores = {}
+    if args.store is not None:
+        stores = {
+            addr: SnapshotStore(os.path.join(args.store, str(addr)), Eastron3P3W.registers_used,
+                                retention=args.store_days * 86400)
+            for addr in args.addr
+        }
+
+    point_filter = None
+    aggregator = None
+    site = None
+
+    def poll(write_points: typing.Callable):
+        start = time.monotonic()
+        # Timestamp every meter with the time its readings arrived, not the
+        # time they are written: the meters are read one after another
+        wall_offset = time.time_ns() - int(start * 1e9)
+        points = []
+        for addr, m in meters.items():
+            try:
+                m.refresh()
+                received_ns = wall_offset + int(m.snapshot.timestamp * 1e9)
+                meter_points = measure(m, addr, received_ns)
+                if addr in stores:
+                    try:
+                        stores[addr].append(received_ns, m.snapshot.value)
+                    except ValueError as e:  # e.g. the wall clock was set back
+                        print("Storing reading of meter {} failed: {}".format(addr, e), file=sys.stderr)
+                if site is not None:
+                    for sample in site.add(addr, m.snapshot.timestamp, m.S()):
+                        meter_points.append(site_point(sample, wall_offset + int(sample.time * 1e9)))
+            except Exception as e:
+                # Still write the other meters. Not only bus errors: the
+                # derived maths fails on e.g. a voltage that read 0.
+                print("Reading meter {} failed: {!r}".format(addr, e), file=sys.stderr)
+                continue
+            points += meter_points
+        if site is not None:
+            for sample in site.poll(time.monotonic()):
+                points.append(site_point(sample, wall_offset + int(sample.time * 1e9)))
+        if modbus_metrics is not None:
+            modbus_metrics.poll_duration.observe(time.monotonic() - start)
+        if aggregator is not None:
+            points = aggregator.add(points)
+        elif point_filter is not None:
+            points = point_filter.filter(points, time.time_ns())
+        write_points(points)
+
+    if args.interval is None:
+        poll(db_con.write_points)
+        for store in stores.values():
+            store.close()
+        return
+
+    # Don't let database latency or outages delay the polling
+    sink = InfluxSink(db_con, spool_path=args.spool).start()
+    if args.site:
+        site = SiteSnapshot(args.addr, args.interval)
+    if resolutions is not None:
+        aggregator = Aggregator(resolutions, max_gap=3 * args.interval,
+                                counters=COUNTER_FIELDS, last_only=LAST_ONLY_FIELDS)
+    elif not args.no_filter:
+        point_filter = PointFilter(rules)
+
+    def poll_logging_errors():
+        try:
+            poll(sink.write_points)
+        except Exception as e:
+            # Keep running: the next poll may well succeed (e.g. a voltage
+            # that read 0, a gateway that was restarted)
+            print("Poll failed: {!r}".format(e), file=sys.stderr)
+
+    try:
+        run_periodic(args.interval, poll_logging_errors)
+    finally:
+        if aggregator is not None:
+            sink.write_points(aggregator.flush())
+        if point_filter is not None:
+            sink.write_points(point_filter.flush())
+        sink.stop()
+        for store in stores.values():
+            store.close()
 
 
-db_con = InfluxDBClient(database=args.db)
-db_con.write_points(points)
+if __name__ == '__main__':
+    main()
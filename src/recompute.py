@@ -0,0 +1,151 @@
+import argparse
+import csv
+import sys
+import typing
+
+import numpy
+
+from eastron import Eastron3P3W
+import eastron_numpy
+
+
+# Input column name -> register it holds
+RAW_COLUMNS = {
+    'U12': 'Line 1 to Line 2 volts [V]',
+    'U23': 'Line 2 to Line 3 volts [V]',
+    'U31': 'Line 3 to Line 1 volts [V]',
+    'P1': 'Phase 1 power [W]',
+    'Q1': 'Phase 1 volt amps reactive [VAr]',
+    'P3': 'Phase 3 power [W]',
+    'Q3': 'Phase 3 volt amps reactive [VAr]',
+}
+
+OUTPUT_COLUMNS = [
+    'true_W', 'reactive_VAr', 'apparent_VA',
+    'I1_A', 'I1_deg', 'I2_A', 'I2_deg', 'I3_A', 'I3_deg',
+]
+
+
+def read_csv_chunks(f: typing.TextIO, column_names: dict, time_column: str,
+                    chunk_size: int) -> typing.Iterator[dict]:
+    """
+    Yield chunks of {column: array}, plus {'time': list} of at most `chunk_size` rows.
+    `column_names` maps our column names to the names in the CSV header.
+    """
+    reader = csv.reader(f)
+    header = next(reader)
+    indices = {name: header.index(csv_name) for name, csv_name in column_names.items()}
+    time_index = header.index(time_column)
+
+    rows = []
+    for row in reader:
+        rows.append(row)
+        if len(rows) == chunk_size:
+            yield _rows_to_chunk(rows, indices, time_index)
+            rows = []
+    if len(rows) > 0:
+        yield _rows_to_chunk(rows, indices, time_index)
+
+
+def _rows_to_chunk(rows: list, indices: dict, time_index: int) -> dict:
+    chunk = {
+        name: numpy.array([float(row[i]) if row[i] != '' else numpy.nan for row in rows])
+        for name, i in indices.items()
+    }
+    chunk['time'] = [row[time_index] for row in rows]
+    return chunk
+
+
+def read_parquet_chunks(path: str, column_names: dict, time_column: str,
+                        chunk_size: int) -> typing.Iterator[dict]:
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Reading Parquet files requires pyarrow")
+
+    parquet_file = pyarrow.parquet.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size,
+                                           columns=[time_column] + list(column_names.values())):
+        chunk = {
+            name: batch.column(batch.schema.get_field_index(parquet_name)).to_numpy(zero_copy_only=False)
+            for name, parquet_name in column_names.items()
+        }
+        chunk['time'] = batch.column(batch.schema.get_field_index(time_column)).to_pylist()
+        yield chunk
+
+
+def recompute(chunk: dict) -> dict:
+    """Derive the corrected series for a chunk of raw columns"""
+    length = len(chunk['time'])
+    data = {
+        addr: numpy.full(length, numpy.nan)
+        for addr in Eastron3P3W.registers_used
+    }
+    for name, register in RAW_COLUMNS.items():
+        data[Eastron3P3W.register_map.by_name[register].addr] = chunk[name]
+
+    v = eastron_numpy.compute_all(data)
+    return {
+        'time': chunk['time'],
+        'true_W': v.S.real,
+        'reactive_VAr': v.S.imag,
+        'apparent_VA': numpy.abs(v.S),
+        'I1_A': numpy.abs(v.I1_u1),
+        'I1_deg': numpy.degrees(numpy.angle(v.I1_u1)),
+        'I2_A': numpy.abs(v.I2_u2),
+        'I2_deg': numpy.degrees(numpy.angle(v.I2_u2)),
+        'I3_A': numpy.abs(v.I3_u3),
+        'I3_deg': numpy.degrees(numpy.angle(v.I3_u3)),
+    }
+
+
+def write_csv_chunks(chunks: typing.Iterable[dict], out: typing.TextIO) -> int:
+    """Write recomputed chunks as CSV, returns the number of rows written"""
+    writer = csv.writer(out)
+    writer.writerow(['time'] + OUTPUT_COLUMNS)
+    rows = 0
+    for chunk in chunks:
+        columns = [chunk[name].tolist() for name in OUTPUT_COLUMNS]
+        writer.writerows(zip(chunk['time'], *columns))
+        rows += len(chunk['time'])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute 3P3W corrections from raw values. '
+                                                 'The input is processed in chunks, so memory use '
+                                                 'does not depend on its length.')
+    parser.add_argument('input', help="CSV or Parquet (*.parquet) file with raw values")
+    parser.add_argument('--output', help="CSV file to write, default stdout", default=None)
+    parser.add_argument('--time-column', help="Name of the time column", default='time')
+    parser.add_argument('--column', help="Name of a raw column in the input, e.g. --column P1=power_1_true_W",
+                        action='append', default=[])
+    parser.add_argument('--chunk-size', help="Rows to process at once", type=int, default=100000)
+
+    args = parser.parse_args()
+
+    column_names = {name: name for name in RAW_COLUMNS.keys()}
+    for mapping in args.column:
+        name, sep, input_name = mapping.partition('=')
+        if sep == '' or input_name == '':
+            parser.error("Invalid --column {}, expected NAME=INPUT_NAME".format(mapping))
+        if name not in RAW_COLUMNS:
+            parser.error("Unknown column {}, expected one of {}".format(name, ", ".join(RAW_COLUMNS.keys())))
+        column_names[name] = input_name
+
+    out = sys.stdout if args.output is None else open(args.output, 'w', newline='')
+    try:
+        if args.input.endswith('.parquet'):
+            chunks = read_parquet_chunks(args.input, column_names, args.time_column, args.chunk_size)
+            write_csv_chunks((recompute(c) for c in chunks), out)
+        else:
+            with open(args.input, newline='') as f:
+                chunks = read_csv_chunks(f, column_names, args.time_column, args.chunk_size)
+                write_csv_chunks((recompute(c) for c in chunks), out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
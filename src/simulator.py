@@ -0,0 +1,298 @@
+import os
+import random
+import select
+import socket
+import struct
+import threading
+import time
+import tty
+import typing
+
+from eastron import Eastron, crc_valid, eastron_crc
+
+
+def default_values(seed: int = 0) -> dict:
+    """Plausible, distinct float values for all of Eastron.defined_registers"""
+    rnd = random.Random(seed)
+    return {
+        info['addr']: round(rnd.uniform(0, 250), 3)
+        for info in Eastron.defined_registers.values()
+    }
+
+
+def default_holding_values(system_type: float = 3.0) -> dict:
+    """Holding registers of a meter configured as `system_type` (3: 3P4W)"""
+    return {
+        0x0002: 60.0,  # Demand period [min]
+        Eastron.system_type_register: system_type,
+        0x0012: 0.0,  # One stop bit, no parity
+        0x0014: 1.0,  # Node address
+        0x001c: 2.0,  # 9600 baud
+        0xfc00: 12345678,  # Serial number
+    }
+
+
+class Sdm630Simulator:
+    """
+    Answers Modbus RTU requests like one or more SDM630 meters on a bus.
+
+    The simulator talks over a file descriptor: the master side of a pty
+    (see open_pty()), or one end of a socket pair; or over a TCP connection,
+    see open_tcp(). `slaves` maps slave
+    addresses to {register address: float value} of the input registers,
+    `holding` likewise for the holding registers; unknown addresses read
+    as 0.0. Integer values are served as 32-bit integers instead of floats.
+    Holding registers can be written with functions 6 and 16.
+
+    To mimic a real line, responses can be delayed by the time needed to
+    send them at `baudrate` (None for no delay) plus a fixed `turnaround`
+    time, and corrupted: `crc_error_rate` is the probability of a response
+    with a bad CRC, `drop_rate` the probability of a response with a
+    missing byte.
+    """
+    def __init__(self, fd: typing.Optional[int],
+                 slaves: typing.Dict[int, dict] = None,
+                 holding: typing.Dict[int, dict] = None,
+                 framing: str = 'rtu',
+                 baudrate: int = None,
+                 bits_per_char: int = 11,
+                 turnaround: float = 0.0,
+                 crc_error_rate: float = 0.0,
+                 drop_rate: float = 0.0,
+                 seed: int = None):
+        self.fd = fd
+        self.framing = framing
+        self._listener = None
+        if slaves is None:
+            slaves = {1: default_values()}
+        self.slaves = slaves
+        if holding is None:
+            holding = {slave: default_holding_values() for slave in slaves}
+        self.holding = holding
+        self.baudrate = baudrate
+        self.bits_per_char = bits_per_char
+        self.turnaround = turnaround
+        self.crc_error_rate = crc_error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+
+        self.requests = 0
+        self.responses = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+        self._buffer = bytearray()
+        self._connection = None
+        self._drop_connection = threading.Event()
+        self._transaction_id = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def open_pty(cls, **kwargs) -> typing.Tuple["Sdm630Simulator", str]:
+        """
+        Create a simulator on a new pty. Returns the simulator and the path of
+        the pty to open as serial port.
+        """
+        master, slave = os.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        path = os.ttyname(slave)
+        sim = cls(master, **kwargs)
+        sim._pty_slave = slave  # keep the pty alive until the client opens it
+        return sim, path
+
+    @classmethod
+    def open_tcp(cls, framing: str = 'tcp', **kwargs) -> typing.Tuple["Sdm630Simulator", str]:
+        """
+        Create a simulator listening on a local TCP port, with 'rtu' (RTU over
+        TCP) or 'tcp' (Modbus TCP) framing. Returns the simulator and host:port
+        to connect to. One connection is served at a time; when it is closed,
+        the next one is accepted.
+        """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        sim = cls(None, framing=framing, **kwargs)
+        sim._listener = listener
+        return sim, "{}:{}".format(*listener.getsockname())
+
+    def start(self) -> "Sdm630Simulator":
+        self._thread = threading.Thread(target=self.serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._listener is not None:
+            self._listener.close()
+            if self._connection is not None:
+                self._connection.close()
+        else:
+            os.close(self.fd)
+        if hasattr(self, '_pty_slave'):
+            os.close(self._pty_slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _accept(self) -> bool:
+        readable, _, _ = select.select([self._listener], [], [], 0.05)
+        if not readable:
+            return False
+        self._connection, _ = self._listener.accept()
+        self._connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.fd = self._connection.fileno()
+        return True
+
+    def drop_connection(self) -> None:
+        """Close the TCP connection, like a gateway that restarts"""
+        self._drop_connection.set()
+
+    def _close_connection(self) -> None:
+        self._connection.close()
+        self._connection = None
+        self._buffer.clear()
+
+    def serve(self) -> None:
+        while not self._stop.is_set():
+            if self._listener is not None:
+                if self._drop_connection.is_set() and self._connection is not None:
+                    self._drop_connection.clear()
+                    self._close_connection()
+                if self._connection is None and not self._accept():
+                    continue
+            readable, _, _ = select.select([self.fd], [], [], 0.05)
+            if not readable:
+                continue
+            data = os.read(self.fd, 4096)
+            if len(data) == 0:
+                if self._listener is None:
+                    return
+                self._close_connection()
+                continue
+            self.bytes_received += len(data)
+            self._buffer += data
+            extract = self._extract_tcp_requests if self.framing == 'tcp' else self._extract_requests
+            for request in extract():
+                response = self.handle_request(request)
+                if response is not None:
+                    self._send(response, len(request))
+
+    mbap = struct.Struct(">HHHB")
+
+    def _extract_tcp_requests(self) -> typing.Iterator[bytes]:
+        """MBAP framed requests, converted to RTU so they can be handled the same way"""
+        while len(self._buffer) >= self.mbap.size:
+            transaction_id, protocol_id, length, unit_id = self.mbap.unpack_from(self._buffer)
+            if len(self._buffer) < 6 + length:
+                return
+            pdu = bytes(self._buffer[self.mbap.size:6 + length])
+            del self._buffer[:6 + length]
+            self._transaction_id = transaction_id
+            yield self._frame(bytes([unit_id]), pdu)
+
+    def _extract_requests(self) -> typing.Iterator[bytes]:
+        while len(self._buffer) >= 8:
+            func = self._buffer[1]
+            if func == 16:
+                if len(self._buffer) < 7:
+                    return
+                length = 7 + self._buffer[6] + 2
+            else:
+                length = 8
+            if len(self._buffer) < length:
+                return
+            request = bytes(self._buffer[:length])
+            if not crc_valid(request):
+                # A real slave stays silent; drop a byte to find the next frame
+                del self._buffer[:1]
+                continue
+            del self._buffer[:length]
+            yield request
+
+    @staticmethod
+    def _frame(*parts: bytes) -> bytes:
+        msg = b''.join(parts)
+        return msg + struct.pack("<H", eastron_crc(msg))
+
+    def _read_registers(self, values: dict, start_addr: int, num: int) -> bytes:
+        payload = bytearray(2 * num)
+        addr = start_addr - start_addr % 2
+        while addr < start_addr + num:
+            raw = self._pack(values.get(addr, 0.0))
+            for i in range(2):
+                if start_addr <= addr + i < start_addr + num:
+                    offset = 2 * (addr + i - start_addr)
+                    payload[offset:offset + 2] = raw[2*i:2*i + 2]
+            addr += 2
+        return bytes(payload)
+
+    @staticmethod
+    def _pack(value) -> bytes:
+        return struct.pack(">I" if isinstance(value, int) else ">f", value)
+
+    def _write_registers(self, values: dict, start_addr: int, words: bytes) -> None:
+        """Overwrite registers with `words`, one 16-bit half of a value at a time"""
+        for i in range(len(words) // 2):
+            addr = start_addr + i
+            base = addr - addr % 2
+            old = values.get(base, 0.0)
+            raw = bytearray(self._pack(old))
+            offset = 2 * (addr - base)
+            raw[offset:offset + 2] = words[2*i:2*i + 2]
+            values[base] = struct.unpack(">I" if isinstance(old, int) else ">f", raw)[0]
+
+    def handle_request(self, request: bytes) -> typing.Optional[bytes]:
+        """Response frame for `request`, or None if no slave answers it"""
+        slave_address, func = request[0], request[1]
+        if slave_address not in self.slaves:
+            return None
+        self.requests += 1
+
+        if func in (3, 4):
+            values = self.slaves[slave_address] if func == 4 else self.holding.get(slave_address, {})
+            start_addr, num = struct.unpack_from(">HH", request, 2)
+            if num < 1 or num > 125:
+                return self._frame(bytes([slave_address, func | 0x80, 3]))
+            payload = self._read_registers(values, start_addr, num)
+            return self._frame(bytes([slave_address, func, len(payload)]), payload)
+
+        if func == 6:
+            self._write_registers(self.holding.setdefault(slave_address, {}),
+                                  struct.unpack_from(">H", request, 2)[0], request[4:6])
+            return request  # Echo
+        if func == 16:
+            start_addr, num, byte_count = struct.unpack_from(">HHB", request, 2)
+            if num < 1 or num > 123 or byte_count != 2 * num:
+                return self._frame(bytes([slave_address, func | 0x80, 3]))
+            self._write_registers(self.holding.setdefault(slave_address, {}), start_addr, request[7:7 + byte_count])
+            return self._frame(request[:6])
+
+        return self._frame(bytes([slave_address, func | 0x80, 1]))  # Illegal function
+
+    def _send(self, response: bytes, request_length: int = 0) -> None:
+        if self.framing == 'tcp':
+            pdu = response[1:-2]
+            response = self.mbap.pack(self._transaction_id, 0, len(pdu) + 1, response[0]) + pdu
+        if self.crc_error_rate and self.random.random() < self.crc_error_rate:
+            response = response[:-1] + bytes([response[-1] ^ 0xff])
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            i = self.random.randrange(len(response))
+            response = response[:i] + response[i+1:]
+
+        delay = self.turnaround
+        if self.baudrate is not None:
+            # The request took this long to arrive, and the response takes this long to go out
+            delay += (request_length + len(response)) * self.bits_per_char / self.baudrate
+        if delay > 0:
+            time.sleep(delay)
+
+        os.write(self.fd, response)
+        self.responses += 1
+        self.bytes_sent += len(response)
@@ -0,0 +1,144 @@
+import collections
+import typing
+
+from eastron import Eastron3P3W
+
+
+# One point of the common sample grid:
+#  * time: the grid time
+#  * total: the sum of `values`, or None when meters are missing: a sum
+#    without them would pass for the site total
+#  * values: {meter: value}, each interpolated to `time`
+#  * alignment_error: {meter: seconds}, the distance in time to the nearest
+#    reading the value was interpolated from, plus half the time it took to
+#    read the meter
+#  * missing: the meters without a reading within `max_delay` of `time`
+SiteSample = collections.namedtuple('SiteSample', ['time', 'total', 'values', 'alignment_error', 'missing'])
+
+
+class SiteSnapshot:
+    """
+    Aligns readings of many meters, taken one after another, to a common
+    grid of `interval` seconds, and sums them.
+
+    Readings are add()ed with the time they were received (see
+    BusScheduler's `timestamped` tasks), in any order between meters but in
+    time order per meter. Once every meter has a reading at or after a grid
+    time, the value of each meter at that grid time is linearly interpolated
+    between the readings around it. A grid time is not held back more than
+    `max_delay` seconds (default: 2 intervals) for a meter that stopped
+    answering; such meters are reported as missing instead. Grid times
+    without a value of any meter (e.g. during an outage) are skipped.
+
+    Per meter, only the readings around the next grid time are kept, and
+    each grid time costs a single pass over the meters, so this scales
+    linearly with the number of meters.
+    """
+    def __init__(self, meters: typing.Iterable, interval: float, max_delay: float = None):
+        self.interval = interval
+        self.max_delay = 2 * interval if max_delay is None else max_delay
+        self._readings = {meter: collections.deque() for meter in meters}  # meter -> (time, value, spread)
+        self._next_time = None
+        self._ready = 0  # meters with a reading at or after _next_time
+
+        self.emitted = 0
+        self.max_alignment_error = 0.0
+
+    def add(self, meter, t: float, value, spread: float = 0.0) -> typing.List[SiteSample]:
+        """
+        Add the reading `value` of `meter`, received at `t`. `spread` is the
+        time it took to read it (e.g. the time between the first and the last
+        frame). Returns the grid points that became complete.
+        """
+        readings = self._readings[meter]
+        if self._next_time is None:
+            self._next_time = (t // self.interval + 1) * self.interval
+        if (len(readings) == 0 or readings[-1][0] < self._next_time) and t >= self._next_time:
+            self._ready += 1
+        readings.append((t, value, spread))
+        return self._complete(t)
+
+    def poll(self, now: float) -> typing.List[SiteSample]:
+        """Grid points that are complete, or that should not wait any longer at `now`"""
+        if self._next_time is None:
+            return []
+        return self._complete(now)
+
+    def _complete(self, now: float) -> typing.List[SiteSample]:
+        out = []
+        while self._ready == len(self._readings) or now - self._next_time > self.max_delay:
+            sample = self._sample(self._next_time)
+            if len(sample.values) > 0:
+                out.append(sample)
+            self._next_time += self.interval
+            self._ready = sum(
+                1 for readings in self._readings.values()
+                if len(readings) > 0 and readings[-1][0] >= self._next_time
+            )
+        return out
+
+    def _sample(self, t: float) -> SiteSample:
+        values = {}
+        errors = {}
+        missing = []
+        for meter, readings in self._readings.items():
+            # Keep the last reading before `t`, and everything after it
+            while len(readings) >= 2 and readings[1][0] <= t:
+                readings.popleft()
+            if len(readings) == 0:
+                missing.append(meter)
+                continue
+            t0, v0, spread0 = readings[0]
+            if t0 >= t or len(readings) == 1:
+                # Nothing on the other side of `t`: hold the nearest reading
+                if abs(t - t0) > self.max_delay:
+                    missing.append(meter)
+                    continue
+                values[meter] = v0
+                errors[meter] = abs(t - t0) + spread0 / 2
+                continue
+            t1, v1, spread1 = readings[1]
+            if min(t - t0, t1 - t) > self.max_delay:
+                # Don't make up values across an outage
+                missing.append(meter)
+                continue
+            values[meter] = v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+            if t - t0 < t1 - t:
+                errors[meter] = t - t0 + spread0 / 2
+            else:
+                errors[meter] = t1 - t + spread1 / 2
+
+        if len(values) > 0:
+            self.emitted += 1
+            self.max_alignment_error = max(self.max_alignment_error, max(errors.values()))
+        total = sum(values.values()) if len(missing) == 0 else None
+        return SiteSample(time=t, total=total, values=values,
+                          alignment_error=errors, missing=missing)
+
+
+def add_site_power_tasks(scheduler, slave_addresses: typing.Iterable[int], snapshot: SiteSnapshot,
+                         callback: typing.Callable, **kwargs) -> list:
+    """
+    Poll Eastron3P3W.S() of every meter on `scheduler`'s line every
+    `snapshot.interval` seconds, and pass the aligned site totals
+    (SiteSample, with complex values) to `callback`.
+
+    Only the four registers that S() needs are read, to keep the time
+    between the meters' readings short.
+    """
+    addresses = [Eastron3P3W._P1, Eastron3P3W._Q1, Eastron3P3W._P3, Eastron3P3W._Q3]
+
+    def make_callback(slave_address: int):
+        def on_reading(values: dict, frame_times: typing.Sequence[float]) -> None:
+            S = complex(values[Eastron3P3W._P1], values[Eastron3P3W._Q1]) + \
+                complex(values[Eastron3P3W._P3], values[Eastron3P3W._Q3])
+            t = (frame_times[0] + frame_times[-1]) / 2
+            for sample in snapshot.add(slave_address, t, S, frame_times[-1] - frame_times[0]):
+                callback(sample)
+        return on_reading
+
+    return [
+        scheduler.add_float_task(scheduler.meter(slave_address, Eastron3P3W), addresses, snapshot.interval,
+                                 callback=make_callback(slave_address), timestamped=True, **kwargs)
+        for slave_address in slave_addresses
+    ]
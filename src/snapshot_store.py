@@ -0,0 +1,222 @@
+import bisect
+import collections
+import os
+import typing
+
+import numpy
+
+
+# The rows of a single segment that fall in a queried range. `times` (int64,
+# ns) and every array in `columns` ({address: float32 array}) are views into
+# the segment file, not copies.
+Chunk = collections.namedtuple('Chunk', ['times', 'columns'])
+
+
+class _Segment:
+    """
+    A file with a fixed number of rows: a header, then the time column, then
+    one float32 column per register address. Rows are only counted as
+    written once the header says so, so a crash while appending loses at
+    most that row.
+    """
+    magic = b'EASTRSEG'
+    version = 1
+    header_dtype = numpy.dtype([('magic', 'S8'), ('version', '<u4'), ('columns', '<u4'),
+                                ('capacity', '<u8'), ('rows', '<u8')])
+    header_size = 4096
+
+    def __init__(self, path: str, addresses: typing.Sequence[int] = None, capacity: int = None,
+                 writable: bool = False):
+        self.path = path
+        if addresses is not None:
+            self._create(path, addresses, capacity)
+        mode = 'r+' if writable else 'r'
+        self.header = numpy.memmap(path, self.header_dtype, mode, offset=0, shape=(1,))
+        if self.header['magic'][0] != self.magic or self.header['version'][0] != self.version:
+            raise ValueError("{} is not a segment file".format(path))
+        columns = int(self.header['columns'][0])
+        self.capacity = int(self.header['capacity'][0])
+        self.addresses = [int(a) for a in numpy.memmap(path, '<u2', 'r', offset=self.header_dtype.itemsize,
+                                                        shape=(columns,))]
+        self.times = numpy.memmap(path, '<i8', mode, offset=self.header_size, shape=(self.capacity,))
+        self.values = numpy.memmap(path, '<f4', mode, offset=self.header_size + 8 * self.capacity,
+                                   shape=(columns, self.capacity))
+        self.column_index = {addr: i for i, addr in enumerate(self.addresses)}
+
+    @classmethod
+    def _create(cls, path: str, addresses: typing.Sequence[int], capacity: int) -> None:
+        if cls.header_dtype.itemsize + 2 * len(addresses) > cls.header_size:
+            raise ValueError("Too many columns")
+        with open(path + '.tmp', 'wb') as f:
+            f.truncate(cls.header_size + (8 + 4 * len(addresses)) * capacity)
+            header = numpy.zeros((), cls.header_dtype)
+            header['magic'] = cls.magic
+            header['version'] = cls.version
+            header['columns'] = len(addresses)
+            header['capacity'] = capacity
+            f.write(header.tobytes())
+            f.write(numpy.asarray(addresses, dtype='<u2').tobytes())
+        os.replace(path + '.tmp', path)
+
+    @property
+    def rows(self) -> int:
+        return int(self.header['rows'][0])
+
+    def last_time(self) -> int:
+        return int(self.times[self.rows - 1])
+
+    def append(self, t_ns: int, values: numpy.ndarray) -> None:
+        row = self.rows
+        self.times[row] = t_ns
+        self.values[:, row] = values
+        self.header['rows'][0] = row + 1
+
+    def chunk(self, start_ns: int, end_ns: int, addresses: typing.Iterable[int] = None) -> Chunk:
+        """The rows with start_ns <= time < end_ns"""
+        rows = self.rows
+        times = self.times[:rows]
+        first, last = numpy.searchsorted(times, [start_ns, end_ns], side='left')
+        if addresses is None:
+            addresses = self.addresses
+        return Chunk(
+            times=times[first:last],
+            columns={
+                addr: self.values[self.column_index[addr], first:last]
+                for addr in addresses
+                if addr in self.column_index
+            },
+        )
+
+    def flush(self) -> None:
+        if self.times.mode != 'r':
+            self.values.flush()
+            self.times.flush()
+            self.header.flush()
+
+
+class SnapshotStore:
+    """
+    Local, append-only store of raw snapshots ({address: float}, e.g. of
+    read_input_registers_float()) of a single meter, in `directory`.
+
+    Every register address gets a float32 column, next to an int64 column
+    with the time in ns; both are memory mapped. The columns are kept in
+    segment files of `segment_rows` rows each (a day of 1 s snapshots by
+    default), named after the time of their first row. When a segment is
+    full, a new one is started, and segments with only rows older than
+    `retention` seconds (relative to the newest row) are deleted.
+
+    query() returns views into the mapped files, so reading a range does not
+    copy it. Snapshots must be appended in increasing time order.
+    """
+    suffix = '.seg'
+
+    def __init__(self, directory: str, addresses: typing.Sequence[int],
+                 segment_rows: int = 86400, retention: float = None):
+        self.directory = directory
+        self.addresses = list(addresses)
+        self.segment_rows = segment_rows
+        self.retention = retention
+        os.makedirs(directory, exist_ok=True)
+
+        self._segments = {}  # first time -> _Segment, opened as needed
+        self._starts = sorted(
+            int(name[:-len(self.suffix)])
+            for name in os.listdir(directory)
+            if name.endswith(self.suffix)
+        )
+        self._active = None
+        if len(self._starts) > 0 and _Segment(self._path(self._starts[-1])).rows == 0:
+            # Left behind by a crash right after _rotate(); it is named after
+            # a row that never made it, so start over from the previous one
+            os.remove(self._path(self._starts.pop()))
+        if len(self._starts) > 0:
+            last = _Segment(self._path(self._starts[-1]), writable=True)
+            if last.addresses == self.addresses and last.rows < last.capacity:
+                # Continue where we left off
+                self._active = self._segments[self._starts[-1]] = last
+
+        self.appended = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _path(self, start_ns: int) -> str:
+        return os.path.join(self.directory, "{:020d}{}".format(start_ns, self.suffix))
+
+    def _segment(self, start_ns: int) -> _Segment:
+        segment = self._segments.get(start_ns)
+        if segment is None:
+            segment = self._segments[start_ns] = _Segment(self._path(start_ns))
+        return segment
+
+    def last_time(self) -> typing.Optional[int]:
+        # The newest segment can be empty (e.g. after a crash right after
+        # _rotate()), so look back until a segment has rows
+        for start in reversed(self._starts):
+            segment = self._segment(start)
+            if segment.rows > 0:
+                return segment.last_time()
+        return None
+
+    def append(self, t_ns: int, values: typing.Union[dict, typing.Sequence[float]]) -> None:
+        """
+        Append a snapshot taken at `t_ns`: a dict {address: value} (addresses
+        that are missing are stored as NaN), or values in the order of
+        `addresses`.
+        """
+        if isinstance(values, dict):
+            values = numpy.array([values.get(addr, numpy.nan) for addr in self.addresses], dtype=numpy.float32)
+        last = self.last_time()
+        if last is not None and t_ns <= last:
+            raise ValueError("Snapshot at {} is not newer than the last one, at {}".format(t_ns, last))
+        if self._active is None or self._active.rows == self._active.capacity:
+            self._rotate(t_ns)
+        self._active.append(t_ns, values)
+        self.appended += 1
+
+    def _rotate(self, t_ns: int) -> None:
+        if self._active is not None:
+            self._active.flush()
+        self._active = self._segments[t_ns] = _Segment(self._path(t_ns), self.addresses, self.segment_rows,
+                                                       writable=True)
+        self._starts.append(t_ns)
+        if self.retention is not None:
+            self._expire(t_ns - int(self.retention * 1e9))
+
+    def _expire(self, before_ns: int) -> None:
+        """Delete the segments that only hold rows from before `before_ns`"""
+        # A segment ends where the next one starts
+        while len(self._starts) >= 2 and self._starts[1] <= before_ns:
+            start = self._starts.pop(0)
+            self._segments.pop(start, None)
+            os.remove(self._path(start))
+
+    def query(self, start_ns: int, end_ns: int,
+              addresses: typing.Iterable[int] = None) -> typing.Iterator[Chunk]:
+        """
+        The snapshots with start_ns <= time < end_ns, as a Chunk per segment,
+        oldest first. Only the columns of `addresses` (default: all) are
+        returned.
+        """
+        if addresses is not None:
+            addresses = list(addresses)
+        first = max(0, bisect.bisect_right(self._starts, start_ns) - 1)
+        for start in self._starts[first:]:
+            if start >= end_ns:
+                break
+            chunk = self._segment(start).chunk(start_ns, end_ns, addresses)
+            if len(chunk.times) > 0:
+                yield chunk
+
+    def flush(self) -> None:
+        if self._active is not None:
+            self._active.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._segments.clear()
+        self._active = None
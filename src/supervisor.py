@@ -0,0 +1,300 @@
+import argparse
+import collections
+import multiprocessing
+import multiprocessing.connection
+import sys
+import threading
+import time
+import typing
+
+import serial
+
+from eastron import Eastron3P3W
+
+
+# A serial port (or gateway) with meters on it, see transport.open_transport()
+PortConfig = collections.namedtuple('PortConfig', ['name', 'kind', 'address', 'slaves'])
+
+
+class _Stopped(Exception):
+    pass
+
+
+def port_worker(port: PortConfig, interval: float, conn: multiprocessing.connection.Connection,
+                stop: "multiprocessing.synchronize.Event") -> None:
+    """
+    Poll all meters on `port` every `interval` seconds, and send the points of
+    every poll over `conn` as a single batch, also when it is empty: that is
+    the heartbeat.
+
+    Runs in its own process, so reading, decoding and the derived maths of
+    different ports don't share a GIL. Errors of a single meter are logged;
+    errors of the port itself end the process, for the supervisor to restart.
+    """
+    # Imported here: the supervisor process itself never touches a port
+    from read_influx import measure, run_periodic
+    from transport import open_transport
+
+    transport = open_transport(port.kind, port.address)
+    meters = {addr: Eastron3P3W(transport, addr) for addr in port.slaves}
+
+    def poll():
+        if stop.is_set():
+            raise _Stopped()
+        start = time.monotonic()
+        wall_offset = time.time_ns() - int(start * 1e9)
+        points = []
+        for addr, m in meters.items():
+            try:
+                m.refresh()
+                meter_points = measure(m, addr, wall_offset + int(m.snapshot.timestamp * 1e9))
+            except serial.SerialException:
+                raise  # The port is gone: leave it to the supervisor to reopen it
+            except Exception as e:
+                # Not only bus errors: the derived maths fails on e.g. a
+                # voltage that read 0. That is no reason to restart the port.
+                print("Reading meter {} on {} failed: {!r}".format(addr, port.name, e), file=sys.stderr)
+                continue
+            for point in meter_points:
+                point['tags']['port'] = port.name
+                points.append(point)
+        conn.send(points)
+
+    try:
+        run_periodic(interval, poll, sleep=stop.wait)
+    except _Stopped:
+        pass
+    finally:
+        transport.close()
+
+
+class _Worker:
+    __slots__ = ('port', 'process', 'conn', 'stop', 'started', 'last_seen', 'next_start', 'backoff',
+                 'restarts', 'batches', 'points')
+
+    def __init__(self, port: PortConfig):
+        self.port = port
+        self.process = None
+        self.conn = None
+        self.stop = None
+        self.started = None
+        self.last_seen = None
+        self.next_start = 0.0
+        self.backoff = 0.0
+        self.restarts = 0
+        self.batches = 0
+        self.points = 0
+
+
+class Supervisor:
+    """
+    Runs one worker process per port (see port_worker()), and passes the
+    batches of points they send back to `handle_points`, in this process.
+
+    A worker that exits (e.g. because its USB adapter disappeared), or that
+    did not send a batch for `health_timeout` seconds (default: 3 intervals
+    plus 10 s), is stopped and started again after an exponentially
+    increasing delay between `min_restart_delay` and `max_restart_delay`. The
+    delay is reset once a worker delivers a batch.
+    """
+    def __init__(self, ports: typing.Iterable[PortConfig], interval: float,
+                 handle_points: typing.Callable[[typing.List[dict]], None],
+                 health_timeout: float = None,
+                 min_restart_delay: float = 1.0,
+                 max_restart_delay: float = 60.0,
+                 worker: typing.Callable = port_worker,
+                 clock: typing.Callable = time.monotonic):
+        self.interval = interval
+        self.handle_points = handle_points
+        self.health_timeout = 3 * interval + 10 if health_timeout is None else health_timeout
+        self.min_restart_delay = min_restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.worker = worker
+        self.clock = clock
+        self.workers = {port.name: _Worker(port) for port in ports}
+        self._stop = threading.Event()
+
+    def _start(self, w: _Worker) -> None:
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        # An event per worker: killing a process while it waits on an event
+        # leaves that event unusable
+        w.stop = multiprocessing.Event()
+        w.process = multiprocessing.Process(target=self.worker, args=(w.port, self.interval, sender, w.stop),
+                                            name='worker-{}'.format(w.port.name), daemon=True)
+        w.process.start()
+        sender.close()  # Only the worker writes; this way, EOF means the worker is gone
+        w.conn = receiver
+        w.started = w.last_seen = self.clock()
+
+    def _kill(self, w: _Worker, reason: str) -> None:
+        if w.process.is_alive():
+            w.process.terminate()
+        w.process.join(5)
+        if w.process.is_alive():
+            w.process.kill()
+            w.process.join()
+        w.backoff = min(self.max_restart_delay, max(self.min_restart_delay, 2 * w.backoff))
+        print("Worker for {} {} (exit code {}), restarting in {}s".format(
+            w.port.name, reason, w.process.exitcode, w.backoff), file=sys.stderr)
+        w.conn.close()
+        w.process = w.conn = w.stop = None
+        w.restarts += 1
+        w.next_start = self.clock() + w.backoff
+
+    def _receive(self, w: _Worker) -> None:
+        try:
+            while w.conn.poll():
+                points = w.conn.recv()
+                w.last_seen = self.clock()
+                w.backoff = 0.0
+                w.batches += 1
+                w.points += len(points)
+                self.handle_points(points)
+        except (EOFError, OSError):
+            self._kill(w, "exited")
+
+    def check(self) -> None:
+        """Start workers that are due, and stop the ones that are unhealthy"""
+        now = self.clock()
+        for w in self.workers.values():
+            if w.process is None:
+                if now >= w.next_start:
+                    self._start(w)
+            elif not w.process.is_alive() and not w.conn.poll():
+                self._kill(w, "exited")
+            elif now - w.last_seen > self.health_timeout:
+                self._kill(w, "sent nothing for {:.0f}s".format(now - w.last_seen))
+
+    def run(self, duration: float = None) -> None:
+        """Supervise the workers, for `duration` seconds or until stop()"""
+        end = None if duration is None else self.clock() + duration
+        while not self._stop.is_set() and (end is None or self.clock() < end):
+            self.check()
+            conns = {w.conn: w for w in self.workers.values() if w.conn is not None}
+            timeout = min(self.interval, 1.0)
+            if end is not None:
+                timeout = max(0.0, min(timeout, end - self.clock()))
+            if len(conns) == 0:
+                self._stop.wait(timeout)
+                continue
+            for conn in multiprocessing.connection.wait(list(conns.keys()), timeout):
+                self._receive(conns[conn])
+
+    def stop(self) -> None:
+        """Stop all workers, after handling the batches they already sent"""
+        self._stop.set()
+        for w in self.workers.values():
+            if w.process is not None:
+                w.stop.set()
+        for w in self.workers.values():
+            if w.process is None:
+                continue
+            deadline = self.clock() + self.interval + 5
+            try:
+                # Keep reading while waiting, a worker can block on a full pipe
+                while w.conn.poll(max(0.0, deadline - self.clock())):
+                    self.handle_points(w.conn.recv())
+            except (EOFError, OSError):
+                pass
+            w.process.join(max(0.0, deadline - self.clock()))
+            if w.process.is_alive():
+                w.process.terminate()
+                w.process.join()
+            w.conn.close()
+            w.process = w.conn = w.stop = None
+
+    def status(self) -> dict:
+        """{port name: {'alive', 'restarts', 'batches', 'points', 'last_seen'}}"""
+        now = self.clock()
+        return {
+            name: {
+                'alive': w.process is not None and w.process.is_alive(),
+                'restarts': w.restarts,
+                'batches': w.batches,
+                'points': w.points,
+                'last_seen': None if w.last_seen is None else now - w.last_seen,
+            }
+            for name, w in self.workers.items()
+        }
+
+
+def parse_port(spec: str, kind: str) -> PortConfig:
+    """Parse a port like /dev/ttyUSB0=1,2,3"""
+    address, sep, slaves = spec.rpartition('=')
+    if sep == '':
+        raise ValueError("Invalid port {}, expected ADDRESS=SLAVE[,SLAVE...]".format(spec))
+    return PortConfig(name=address, kind=kind, address=address,
+                      slaves=[int(slave) for slave in slaves.split(',')])
+
+
+def main():
+    from influxdb import InfluxDBClient
+
+    from aggregation import Aggregator, parse_resolutions
+    from influx_sink import InfluxSink
+    from point_filter import PointFilter
+    from read_influx import COUNTER_FIELDS, FILTER_RULES, LAST_ONLY_FIELDS
+    from transport import TRANSPORTS
+
+    parser = argparse.ArgumentParser(description='Eastron reader for many ports, with a process per port')
+    parser.add_argument('--port', help="Port and the meters on it, e.g. /dev/ttyUSB0=1,2,3. Repeat for every port",
+                        action='append', required=True)
+    parser.add_argument('--transport', help="How to reach the meters", choices=TRANSPORTS, default='serial')
+    parser.add_argument('--interval', help="Poll every INTERVAL seconds", type=float, default=1.0)
+    parser.add_argument('--db', help="influx database to write to", default='eastron')
+    parser.add_argument('--spool', help="File to buffer points in while the database is unreachable",
+                        default=None)
+    parser.add_argument('--heartbeat', help="Write every field at least every HEARTBEAT seconds, even if it "
+                                            "did not change", type=float, default=300)
+    parser.add_argument('--no-filter', help="Write every field of every poll", action='store_true')
+    parser.add_argument('--aggregate', help="Only write rollups over windows of these comma separated lengths "
+                                            "in seconds, e.g. 1,60,900", default=None)
+    args = parser.parse_args()
+
+    try:
+        ports = [parse_port(spec, args.transport) for spec in args.port]
+    except ValueError as e:
+        parser.error(str(e))
+
+    resolutions = None
+    if args.aggregate is not None:
+        try:
+            resolutions = parse_resolutions(args.aggregate)
+        except ValueError as e:
+            parser.error(str(e))
+
+    sink = InfluxSink(InfluxDBClient(database=args.db), spool_path=args.spool).start()
+    aggregator = None
+    point_filter = None
+    if resolutions is not None:
+        aggregator = Aggregator(resolutions, max_gap=3 * args.interval,
+                                counters=COUNTER_FIELDS, last_only=LAST_ONLY_FIELDS)
+    elif not args.no_filter:
+        point_filter = PointFilter({
+            field: rule._replace(heartbeat=args.heartbeat)
+            for field, rule in FILTER_RULES.items()
+        })
+
+    def handle_points(points: typing.List[dict]) -> None:
+        if aggregator is not None:
+            points = aggregator.add(points)
+        elif point_filter is not None:
+            points = point_filter.filter(points, time.time_ns())
+        sink.write_points(points)
+
+    supervisor = Supervisor(ports, args.interval, handle_points)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+        if aggregator is not None:
+            sink.write_points(aggregator.flush())
+        if point_filter is not None:
+            sink.write_points(point_filter.flush())
+        sink.stop()
+
+
+if __name__ == '__main__':
+    main()
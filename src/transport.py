@@ -0,0 +1,262 @@
+import socket
+import struct
+import time
+import typing
+
+import serial
+
+from capture import CapturingTransport, FrameCapture
+from eastron import DebuggableSerial, ReadTimeout
+
+
+class _TcpConnection:
+    """
+    A connection to a gateway that is opened again on the next request after
+    it broke, e.g. because the gateway restarted. Only the requests in
+    flight fail, with ConnectionError.
+    """
+    def __init__(self, host: str, port: int, connect_timeout: float):
+        self.address = (host, port)
+        self.connect_timeout = connect_timeout
+        self.sock = None
+        self.reconnects = 0
+        self._connect()
+
+    def _connect(self) -> None:
+        self.sock = socket.create_connection(self.address, timeout=self.connect_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._connected()
+
+    def _connected(self) -> None:
+        """Set up a new connection"""
+
+    def _socket(self) -> socket.socket:
+        """The connection, opened again if it broke"""
+        if self.sock is None:
+            try:
+                self._connect()
+            except OSError as e:
+                raise ConnectionError("Connecting to {}:{} failed: {}".format(*self.address, e))
+            self.reconnects += 1
+        return self.sock
+
+    def _connection_lost(self, reason) -> ConnectionError:
+        """Drop the connection; returns the error to raise"""
+        self.close()
+        return ConnectionError("Connection to {}:{} lost: {}".format(*self.address, reason))
+
+    def _sendall(self, data: bytes) -> None:
+        sock = self._socket()
+        try:
+            sock.sendall(data)
+        except OSError as e:
+            raise self._connection_lost(e)
+
+    def _recv(self, size: int) -> bytes:
+        if self.sock is None:
+            raise ConnectionError("Not connected to {}:{}".format(*self.address))
+        try:
+            data = self.sock.recv(size)
+        except socket.timeout:
+            raise TimeoutError("No new bytes received within timeout")
+        except OSError as e:
+            raise self._connection_lost(e)
+        if len(data) == 0:
+            raise self._connection_lost("closed by peer")
+        return data
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class RtuOverTcpTransport(_TcpConnection):
+    """
+    Modbus RTU frames over a TCP connection, as offered by transparent
+    RS485-to-Ethernet gateways. Drop-in replacement for DebuggableSerial.
+    """
+    def __init__(self, host: str, port: int, connect_timeout: float = 5.0):
+        self._timeout = None
+        super().__init__(host, port, connect_timeout)
+
+    def _connected(self) -> None:
+        self._timeout = self.sock.gettimeout()
+
+    def _set_timeout(self, timeout: typing.Optional[float]) -> None:
+        if timeout != self._timeout:
+            self.sock.settimeout(timeout)
+            self._timeout = timeout
+
+    def write(self, data: bytes) -> int:
+        self._sendall(data)
+        return len(data)
+
+    def read_with_idle_timeout(self, size: int = 1, timeout: float = 0.1) -> bytearray:
+        if self.sock is not None:
+            self._set_timeout(timeout)
+        data = bytearray()
+        while len(data) < size:
+            try:
+                data += self._recv(size - len(data))
+            except TimeoutError:
+                raise ReadTimeout(data)
+        return data
+
+    def reset_input_buffer(self) -> None:
+        if self.sock is None:
+            return
+        try:
+            self._set_timeout(0)
+            while len(self.sock.recv(4096)) > 0:
+                pass
+        except (BlockingIOError, socket.timeout):
+            return
+        except OSError as e:
+            # Called while handling a failed request: don't raise, the next
+            # request connects again
+            self._connection_lost(e)
+            return
+        self._connection_lost("closed by peer")
+
+
+class ModbusTcpTransport(_TcpConnection):
+    """
+    Native Modbus TCP: requests carry an MBAP header instead of a CRC.
+
+    Up to `max_outstanding` requests are sent before waiting for the
+    responses, which are matched to their request by transaction ID. This
+    hides the network round trip time when reading a multi-frame plan.
+    """
+    mbap = struct.Struct(">HHHB")  # transaction ID, protocol ID, length, unit ID
+
+    def __init__(self, host: str, port: int = 502,
+                 max_outstanding: int = 4,
+                 timeout: float = 1.0,
+                 connect_timeout: float = 5.0):
+        self.timeout = timeout
+        self.max_outstanding = max_outstanding
+        self._transaction_id = 0
+        self._buffer = bytearray()
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        super().__init__(host, port, connect_timeout)
+
+    def _connected(self) -> None:
+        self.sock.settimeout(self.timeout)
+        self._buffer.clear()
+
+    def reset_input_buffer(self) -> None:
+        # Late responses are recognized by their transaction ID and skipped.
+        # Discarding a partial one would lose track of where the next starts.
+        pass
+
+    def _next_transaction_id(self) -> int:
+        self._transaction_id = (self._transaction_id + 1) & 0xffff
+        return self._transaction_id
+
+    def _send_request(self, unit_id: int, function_number: int,
+                      start_address: int, number_of_points: int, data: bytes = b'') -> int:
+        transaction_id = self._next_transaction_id()
+        pdu = struct.pack(">BHH", function_number, start_address, number_of_points) + data
+        adu = self.mbap.pack(transaction_id, 0, len(pdu) + 1, unit_id) + pdu
+        self._sendall(adu)
+        self.frames_sent += 1
+        self.bytes_sent += len(adu)
+        return transaction_id
+
+    def _recv_exactly(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            self._buffer += self._recv(4096)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def _read_response(self) -> typing.Tuple[int, dict]:
+        header = self._recv_exactly(self.mbap.size)
+        transaction_id, protocol_id, length, unit_id = self.mbap.unpack(header)
+        if protocol_id != 0 or length < 2:
+            # Out of step with the stream: start over on a new connection
+            self.close()
+            raise ValueError("Invalid MBAP header")
+        pdu = self._recv_exactly(length - 1)
+        func = pdu[0]
+        resp = {
+            'slave_address': unit_id,
+            'function': func,
+            'frame': header + pdu,
+        }
+        if func & 0x80:
+            resp['exception_code'] = pdu[1]
+            resp['payload'] = pdu[1:2]
+        elif func in (1, 2, 3, 4):
+            resp['payload'] = pdu[2:2 + pdu[1]]
+        else:
+            resp['payload'] = pdu[1:]
+        return transaction_id, resp
+
+    def transact(self, unit_id: int, function_number: int,
+                 start_address: int, number_of_points: int, data: bytes = b'') -> dict:
+        return self.transact_many(unit_id, [(function_number, start_address, number_of_points, data)])[0]
+
+    def transact_many(self, unit_id: int,
+                      requests: typing.List[tuple]) -> typing.List[dict]:
+        """
+        Execute (function, start_address, number_of_points[, data]) requests,
+        pipelined. Every response gets the time since its request was sent, as
+        'latency'.
+        """
+        responses = [None] * len(requests)
+        outstanding = {}  # transaction ID -> (index in requests, time sent)
+        next_request = 0
+        while next_request < len(requests) or len(outstanding) > 0:
+            while next_request < len(requests) and len(outstanding) < self.max_outstanding:
+                transaction_id = self._send_request(unit_id, *requests[next_request])
+                outstanding[transaction_id] = (next_request, time.monotonic())
+                next_request += 1
+            transaction_id, resp = self._read_response()
+            sent = outstanding.pop(transaction_id, None)
+            if sent is None:
+                continue  # Late response to an earlier, abandoned request
+            index, sent_at = sent
+            resp['latency'] = time.monotonic() - sent_at
+            responses[index] = resp
+        return responses
+
+
+TRANSPORTS = ['serial', 'rtu-tcp', 'tcp']
+
+
+def _host_port(address: str, default_port: int = None) -> typing.Tuple[str, int]:
+    host, sep, port = address.rpartition(':')
+    if sep == '':
+        if default_port is None:
+            raise ValueError("Expected host:port, got {}".format(address))
+        return address, default_port
+    return host, int(port)
+
+
+def open_transport(kind: str, address: str, baudrate: int = 9600, capture: str = None):
+    """
+    Open a transport of the given kind:
+     * serial: `address` is the serial device
+     * rtu-tcp: `address` is host:port of a transparent gateway
+     * tcp: `address` is host[:port] of a Modbus TCP gateway
+
+    With `capture`, all traffic is recorded in that capture file, see
+    capture.FrameCapture. Not supported for tcp.
+    """
+    if kind == 'serial':
+        transport = DebuggableSerial(address, baudrate, serial.EIGHTBITS, serial.PARITY_EVEN, serial.STOPBITS_ONE,
+                                     timeout=0.1)
+        transport.debug = False
+        transport.reset_input_buffer()
+    elif kind == 'rtu-tcp':
+        transport = RtuOverTcpTransport(*_host_port(address))
+    elif kind == 'tcp':
+        transport = ModbusTcpTransport(*_host_port(address, 502))
+    else:
+        raise ValueError("Unknown transport {}".format(kind))
+    if capture is not None:
+        transport = CapturingTransport(transport, FrameCapture(capture))
+    return transport
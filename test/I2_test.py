@@ -274,3 +274,28 @@ def test_I31():
 
         I2 = e.I2_u1()
         assert abs(I2) < 1
+
+
+@pytest.mark.parametrize("params", params)
+def test_compute_all(params):
+    with mock.patch('src.eastron.Eastron3P3W._data', return_value=convert_addr(params)):
+        e = eastron.Eastron3P3W(None, None)
+        v = e.compute_all()
+
+        for name in v._fields:
+            assert getattr(v, name) == approx(getattr(e, name)())
+
+
+def test_compute_all_vectorised():
+    import src.eastron_numpy as eastron_numpy
+
+    snapshots = [convert_addr(p[0][0]) for p in params]
+    columns = {
+        addr: [s[addr] for s in snapshots]
+        for addr in snapshots[0].keys()
+    }
+    v = eastron_numpy.compute_all(columns)
+    for i, s in enumerate(snapshots):
+        expected = eastron.Eastron3P3W.derive(s)
+        for name in v._fields:
+            assert getattr(v, name)[i] == approx(getattr(expected, name))
@@ -0,0 +1,116 @@
+import random
+
+import pytest
+
+import src.aggregation as aggregation
+
+
+def test_p2_quantile():
+    rnd = random.Random(0)
+    values = [rnd.gauss(0, 1) for _ in range(10000)]
+    median = aggregation.P2Quantile(0.5)
+    p95 = aggregation.P2Quantile(0.95)
+    for x in values:
+        median.add(x)
+        p95.add(x)
+    values.sort()
+    assert median.value() == pytest.approx(values[5000], abs=0.05)
+    assert p95.value() == pytest.approx(values[9500], abs=0.05)
+
+
+def test_p2_quantile_few_values():
+    q = aggregation.P2Quantile(0.5)
+    for x in [3, 1, 2]:
+        q.add(x)
+    assert q.value() == 2
+
+
+def point(value, addr=1):
+    return {'measurement': 'power', 'tags': {'addr': addr}, 'fields': {'true_W': value}}
+
+
+def test_windows():
+    a = aggregation.Aggregator(resolutions=(10, 60), quantiles=(0.5,))
+    out = []
+    for t in range(0, 61):
+        out += a.add([point(float(t % 10))], t + 0.5)
+
+    tens = [p for p in out if p['tags']['resolution'] == '10s']
+    assert len(tens) == 6
+    assert [p['time'] for p in tens] == [i * 10 * 10**9 for i in range(6)]
+    assert tens[0]['tags'] == {'addr': 1, 'resolution': '10s'}
+    fields = tens[1]['fields']
+    assert fields['true_W_mean'] == 4.5
+    assert fields['true_W_min'] == 0
+    assert fields['true_W_max'] == 9
+    assert fields['true_W_p50'] == pytest.approx(4.5, abs=1)
+
+    minutes = [p for p in out if p['tags']['resolution'] == '60s']
+    assert len(minutes) == 1
+    assert minutes[0]['fields']['true_W_mean'] == 4.5
+
+    partial = a.flush()
+    assert {p['tags']['resolution'] for p in partial} == {'10s', '60s'}
+    assert a.flush() == []
+
+
+def test_energy_integration():
+    a = aggregation.Aggregator(resolutions=(60,), quantiles=())
+    out = []
+    # 3600 W, polled every 0.7 s: 60 Wh per minute
+    t = 0.0
+    while t < 180:
+        out += a.add([point(3600.0)], t)
+        t += 0.7
+    assert [p['fields']['true_W_integral_h'] for p in out] == pytest.approx([60, 60])
+
+
+def test_integration_skips_gaps():
+    a = aggregation.Aggregator(resolutions=(60,), quantiles=(), max_gap=5)
+    a.add([point(3600.0)], 0)
+    a.add([point(3600.0)], 10)
+    a.add([point(3600.0)], 12)
+    out = a.add([point(3600.0)], 60)
+    assert out[0]['fields']['true_W_integral_h'] == pytest.approx(2)
+
+
+def test_series_are_independent():
+    a = aggregation.Aggregator(resolutions=(1,), quantiles=())
+    a.add([point(1.0, 1), point(2.0, 2)], 0)
+    out = a.add([point(1.0, 1), point(2.0, 2)], 1)
+    assert {p['tags']['addr']: p['fields']['true_W_mean'] for p in out} == {1: 1.0, 2: 2.0}
+
+
+def test_windows_by_point_time():
+    a = aggregation.Aggregator(resolutions=(10,), quantiles=())
+    received = dict(point(1.0), time=9 * 10**9)
+    # Written after the window boundary, but received before it
+    assert a.add([received], 10.5) == []
+    out = a.add([dict(point(2.0), time=11 * 10**9)], 12)
+    assert [(p['time'], p['fields']['true_W_mean']) for p in out] == [(0, 1.0)]
+
+
+def test_counters_and_angles():
+    a = aggregation.Aggregator(resolutions=(10,), quantiles=(), counters=['kWh'], last_only=['angle'])
+    out = []
+    for t in range(0, 25):
+        out += a.add([{'measurement': 'm', 'fields': {'kWh': 100.0 + t, 'angle': float(t % 3)}}], t)
+    assert [p['fields'] for p in out] == [
+        {'kWh_last': 109.0, 'kWh_increase': 9.0, 'angle_last': 0.0},
+        # Including the increase from the last sample of the previous window
+        {'kWh_last': 119.0, 'kWh_increase': 10.0, 'angle_last': 1.0},
+    ]
+
+
+def test_int_fields_roll_up_as_floats():
+    a = aggregation.Aggregator(resolutions=(10,), quantiles=(0.5,))
+    a.add([{'measurement': 'm', 'fields': {'meters': 3}}], 0)
+    out = a.add([{'measurement': 'm', 'fields': {'meters': 2}}], 10)
+    assert all(type(v) is float for v in out[0]['fields'].values())
+
+
+def test_parse_resolutions():
+    assert aggregation.parse_resolutions('1,60,900') == [1, 60, 900]
+    for spec in ['1,x', '0', '-60', 'nan', '1,,2']:
+        with pytest.raises(ValueError):
+            aggregation.parse_resolutions(spec)
@@ -0,0 +1,123 @@
+import src.bus_scheduler as bus_scheduler
+from fake_bus import FakeBus
+
+
+def make_scheduler():
+    bus = FakeBus()
+    s = bus_scheduler.BusScheduler(bus, clock=bus.clock, sleep=bus.sleep)
+    return bus, s
+
+
+def test_inter_frame_gap():
+    assert bus_scheduler.inter_frame_gap(9600) == 3.5 * 11 / 9600
+    assert bus_scheduler.inter_frame_gap(115200) == 0.00175
+
+
+def test_intervals():
+    bus, s = make_scheduler()
+    fast, slow = [], []
+    s.add_task(s.meter(1), [(0, 2)], 1, callback=fast.append)
+    s.add_task(s.meter(2), [(0x48, 4)], 5, callback=slow.append)
+    s.run(10)
+
+    assert len(fast) == 10
+    assert len(slow) == 2
+    assert fast[0] == {0: 1000, 1: 1001}
+    assert slow[0] == {0x48: 2072, 0x49: 2073, 0x4a: 2074, 0x4b: 2075}
+
+
+def test_priority_preempts_between_frames():
+    bus, s = make_scheduler()
+    low = s.add_task(s.meter(1), [(0, 2), (200, 2), (400, 2)], 10, priority=5)
+    high = s.add_task(s.meter(2), [(0, 2)], 10, priority=0)
+    s.step()
+    assert bus.requests[-1][1] == 2
+    s.step()
+    assert bus.requests[-1][1] == 1
+    assert low.frame_index == 1 and high.polls == 1
+
+
+def test_inter_frame_gap_respected():
+    bus, s = make_scheduler()
+    s.add_task(s.meter(1), [(0, 2), (200, 2)], 1)
+    s.step()
+    s.step()
+    (t0, *_), (t1, *_) = bus.requests
+    assert t1 - t0 >= bus.latency + s.gap
+
+
+def test_float_task_and_utilisation():
+    bus, s = make_scheduler()
+    results = []
+    s.add_float_task(s.meter(1), [0, 2], 1, callback=results.append)
+    s.run(2)
+    assert set(results[0].keys()) == {0, 2}
+
+    u = s.utilisation()
+    assert u['frames'] == 2
+    assert u['bytes'] == 2 * (8 + 5 + 8)
+    assert 0 < u['wire_utilisation'] < u['utilisation'] < 1
+
+
+def test_prebuilt_requests():
+    bus, s = make_scheduler()
+    task = s.add_task(s.meter(3), [(0, 2), (200, 2)], 1)
+    assert list(task.requests) == [
+        s.meter(3)._construct_request(3, 4, 0, 2),
+        s.meter(3)._construct_request(3, 4, 200, 2),
+    ]
+
+
+def test_background_decode():
+    bus = FakeBus()
+    s = bus_scheduler.BusScheduler(bus, background_decode=True, clock=bus.clock, sleep=bus.sleep)
+    results = []
+    s.add_task(s.meter(1), [(0, 2), (200, 1)], 1, callback=results.append)
+    s.run(3)
+    s.close()
+    assert results == [{0: 1000, 1: 1001, 200: 1200}] * 3
+
+
+def test_back_to_back():
+    bus, s = make_scheduler()
+    task = s.add_task(s.meter(1), [(0, 2)], 0)
+    s.run(1)
+    assert task.polls == int(1 / (bus.latency + s.gap)) + 1
+    assert task.skipped == 0
+
+
+class DeadSlaveBus(FakeBus):
+    """Slave 2 never answers"""
+    def write(self, data):
+        super().write(data)
+        if data[0] == 2:
+            self.response = b''
+
+    def read_with_idle_timeout(self, size=1, timeout=0.1):
+        if len(self.response) == 0:
+            self.now += timeout
+            raise TimeoutError()
+        return super().read_with_idle_timeout(size, timeout)
+
+
+def test_dead_slave_is_backed_off():
+    bus = DeadSlaveBus()
+    s = bus_scheduler.BusScheduler(bus, clock=bus.clock, sleep=bus.sleep)
+    alive = s.add_task(s.meter(1), [(0, 2)], 1)
+    dead = s.add_task(s.meter(2), [(0, 2)], 1)
+    s.run(60)
+
+    assert alive.polls == 60
+    health = s.meter(2).health
+    assert health.failures == dead.errors
+    # 3 failures open the circuit, after that only a single trial per back-off
+    assert dead.errors < 10
+    assert sum(1 for r in bus.requests if r[1] == 2) == 3 * dead.errors
+
+
+def test_failed_frame_counts_request_bytes_only():
+    bus = DeadSlaveBus()
+    s = bus_scheduler.BusScheduler(bus, clock=bus.clock, sleep=bus.sleep)
+    s.add_task(s.meter(2, retries=0), [(0, 2)], 1)
+    s.step()
+    assert s.utilisation()['bytes'] == 8
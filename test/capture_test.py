@@ -0,0 +1,109 @@
+import struct
+
+import pytest
+import serial
+
+import src.capture as capture
+import src.eastron as eastron
+import src.simulator as simulator
+
+
+def test_ring_keeps_newest_records(tmp_path):
+    path = str(tmp_path / 'ring')
+    with capture.FrameCapture(path, capacity=100) as c:
+        for i in range(20):
+            c.record(capture.TX if i % 2 == 0 else capture.RX, bytes([i]) * 5, t_ns=i)
+        assert c.overwritten > 0
+
+    records = list(capture.read_capture(path))
+    # 16 bytes per record: the last 6 fit in 100 bytes
+    assert [t for t, _, _ in records] == list(range(14, 20))
+    assert records[-1] == (19, capture.RX, bytes([19]) * 5)
+
+
+def test_reopen_appends(tmp_path):
+    path = str(tmp_path / 'ring')
+    with capture.FrameCapture(path, capacity=1000) as c:
+        c.record(capture.TX, b'abc', t_ns=1)
+    with capture.FrameCapture(path, capacity=5000) as c:
+        assert c.capacity == 1000
+        c.record(capture.RX, b'de', t_ns=2)
+    assert list(capture.read_capture(path)) == [(1, capture.TX, b'abc'), (2, capture.RX, b'de')]
+
+
+def test_record_too_large(tmp_path):
+    with capture.FrameCapture(str(tmp_path / 'ring'), capacity=32) as c:
+        with pytest.raises(ValueError):
+            c.record(capture.TX, bytes(30))
+
+
+def test_capture_and_replay(tmp_path):
+    path = str(tmp_path / 'ring')
+    values = simulator.default_values()
+    sim, pty = simulator.Sdm630Simulator.open_pty(slaves={1: values})
+    with sim, capture.FrameCapture(path) as c:
+        ser = eastron.DebuggableSerial(pty, 9600, serial.EIGHTBITS, serial.PARITY_EVEN, serial.STOPBITS_ONE,
+                                       timeout=0.1)
+        m = eastron.Eastron3P3W(capture.CapturingTransport(ser, c), 1)
+        live = m.refresh()
+        with pytest.raises(TimeoutError):
+            eastron.Eastron(capture.CapturingTransport(ser, c), 7, retries=0).read_input_registers_float([0])
+        ser.close()
+
+    replay = capture.CaptureReplay.from_file(path)
+    decoded = {}
+
+    def collect(t_ns, request, resp, floats):
+        if floats is not None:
+            _, _, start, num = struct.unpack_from(">BBHH", request)
+            decoded.update(zip(capture.CaptureReplay._float_addresses(start, num), floats))
+
+    stats = replay.run(callback=collect)
+    assert stats['exchanges'] == len(m.plan_reads([(a, 2) for a in m.registers_used])) + 1
+    assert stats['timeouts'] == 1
+    assert stats['responses'] == stats['exchanges'] - 1
+    for addr, value in live.items():
+        assert decoded[addr] == value
+
+
+def test_replay_corrupt_response():
+    request = eastron.Modbus._construct_request(1, 4, 0, 2)
+    good = bytes([1, 4, 4]) + struct.pack(">f", 230.0)
+    good += struct.pack("<H", eastron.eastron_crc(good))
+    bad = good[:-1] + bytes([good[-1] ^ 0xff])
+    replay = capture.CaptureReplay([
+        (0, capture.TX, request), (1, capture.RX, bad),
+        (2, capture.TX, request), (3, capture.RX, good[:4]), (4, capture.RX, good[4:]),
+    ])
+    results = []
+    stats = replay.run(callback=lambda *args: results.append(args[3]))
+    assert stats['crc_errors'] == 1 and stats['responses'] == 1
+    assert results[0] is None
+    assert list(results[1]) == [230.0]
+
+
+def test_tcp_is_not_captured(tmp_path):
+    class FakeTcp:
+        def transact(self, *args):
+            pass
+
+    with capture.FrameCapture(str(tmp_path / 'ring')) as c:
+        with pytest.raises(ValueError):
+            capture.CapturingTransport(FakeTcp(), c)
+
+
+def test_truncated_response_is_captured(tmp_path):
+    path = str(tmp_path / 'ring')
+    # Every response loses a byte, so every read times out part-way
+    sim, pty = simulator.Sdm630Simulator.open_pty(drop_rate=1.0, seed=1)
+    with sim, capture.FrameCapture(path) as c:
+        ser = eastron.DebuggableSerial(pty, 9600, serial.EIGHTBITS, serial.PARITY_EVEN, serial.STOPBITS_ONE,
+                                       timeout=0.1)
+        with pytest.raises(TimeoutError):
+            eastron.Eastron(capture.CapturingTransport(ser, c), 1, retries=0).read_input_registers_float([0])
+        ser.close()
+
+    received = b''.join(data for _, direction, data in capture.read_capture(path) if direction == capture.RX)
+    assert len(received) == sim.bytes_sent > 3
+    stats = capture.CaptureReplay.from_file(path).run()
+    assert stats['timeouts'] == 1
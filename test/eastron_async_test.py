@@ -0,0 +1,167 @@
+import asyncio
+import os
+import struct
+import tty
+
+import pytest
+
+import src.eastron_async as eastron_async
+import src.simulator as simulator
+from src.eastron import eastron_crc
+
+
+def float_registers(values: dict) -> dict:
+    registers = {}
+    for addr, value in values.items():
+        registers[addr], registers[addr+1] = struct.unpack(">HH", struct.pack(">f", value))
+    return registers
+
+
+async def fake_meter(fd: int, slave_address: int, registers: dict, truncate: int = 0):
+    """
+    Answer function 4 requests on the master side of a pty. The first
+    `truncate` responses are cut off half-way.
+    """
+    loop = asyncio.get_running_loop()
+    buffer = bytearray()
+    received = asyncio.Event()
+
+    def on_readable():
+        buffer.extend(os.read(fd, 4096))
+        received.set()
+    loop.add_reader(fd, on_readable)
+    try:
+        while True:
+            while len(buffer) < 8:
+                received.clear()
+                await received.wait()
+            request = bytes(buffer[:8])
+            del buffer[:8]
+            slave, func, start, num = struct.unpack(">BBHH", request[:6])
+            if slave != slave_address:
+                continue
+            msg = struct.pack(">BBB", slave, func, 2*num)
+            for a in range(start, start+num):
+                msg += struct.pack(">H", registers.get(a, 0))
+            msg += struct.pack("<H", eastron_crc(msg))
+            if truncate > 0:
+                truncate -= 1
+                msg = msg[:len(msg) // 2]
+            os.write(fd, msg)
+    finally:
+        loop.remove_reader(fd)
+
+
+def open_pty():
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    return master, slave
+
+
+def test_read_float():
+    async def main():
+        master, slave = open_pty()
+        meter = asyncio.ensure_future(fake_meter(master, 3, float_registers({0x00c8: 230.5, 0x000c: -12.25})))
+
+        port = eastron_async.AsyncSerial(slave)
+        e = eastron_async.AsyncEastron(port, 3)
+        values = await e.read_input_registers_float([0x00c8, 0x000c])
+
+        meter.cancel()
+        port.close()
+        os.close(master)
+        os.close(slave)
+        return values
+
+    assert asyncio.run(main()) == {0x00c8: 230.5, 0x000c: -12.25}
+
+
+def test_concurrent_ports():
+    async def main():
+        ports = []
+        meters = []
+        for i in range(3):
+            master, slave = open_pty()
+            meters.append(asyncio.ensure_future(fake_meter(master, 1, float_registers({0: float(i)}))))
+            ports.append(eastron_async.AsyncSerial(slave))
+        values = await asyncio.gather(*[
+            eastron_async.AsyncEastron(port, 1).read_input_registers_float([0])
+            for port in ports
+        ])
+        for m in meters:
+            m.cancel()
+        for p in ports:
+            p.close()
+        return values
+
+    assert asyncio.run(main()) == [{0: 0.0}, {0: 1.0}, {0: 2.0}]
+
+
+def test_timeout():
+    async def main():
+        master, slave = open_pty()
+        port = eastron_async.AsyncSerial(slave)
+        e = eastron_async.AsyncEastron(port, 1)
+        try:
+            with pytest.raises(TimeoutError):
+                await e.read_input_registers_float([0])
+        finally:
+            port.close()
+            os.close(master)
+            os.close(slave)
+
+    asyncio.run(main())
+
+
+def test_retry_after_truncated_response():
+    async def main():
+        master, slave = open_pty()
+        meter = asyncio.ensure_future(fake_meter(master, 1, float_registers({0: 1.5}), truncate=1))
+        port = eastron_async.AsyncSerial(slave)
+        e = eastron_async.AsyncEastron(port, 1)
+        try:
+            # The half response is dropped, not mistaken for the start of the next one
+            assert await e.read_input_registers_float([0]) == {0: 1.5}
+            assert e.health.retries == 1 and e.health.successes == 1
+        finally:
+            meter.cancel()
+            port.close()
+            os.close(master)
+            os.close(slave)
+
+    asyncio.run(main())
+
+
+def test_config_and_writes():
+    sim, path = simulator.Sdm630Simulator.open_pty()
+
+    async def main():
+        fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        port = eastron_async.AsyncSerial(fd)
+        e = eastron_async.AsyncEastron(port, 1, wiring='auto')
+        try:
+            await e.write_config('Demand period [min]', 15.0)
+            await e.write_register(0x0014, 0x40e0)  # High half of 7.0
+            config = await e.config()
+            values = await e.read_all()
+            assert e.wiring == '4w'
+            # Detecting the wiring used the cached configuration
+            assert (e._config.hits, e._config.misses) == (1, 1)
+            return config, values
+        finally:
+            port.close()
+            os.close(fd)
+
+    with sim:
+        config, values = asyncio.run(main())
+    assert config['Demand period [min]'] == 15.0
+    assert config['Network node'] == 7.0
+    assert values['Frequency of supply voltage [Hz]'] == pytest.approx(simulator.default_values()[0x0046])
+    assert len(values) == len(eastron_async.AsyncEastron.register_map.select('4w'))
+
+
+def test_sync_request_is_refused():
+    e = eastron_async.AsyncEastron(None, 1)
+    with pytest.raises(TypeError):
+        e._request(4, 0, 2)
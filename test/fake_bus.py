@@ -0,0 +1,48 @@
+import struct
+
+from src.eastron import eastron_crc
+
+
+class FakeBus:
+    """
+    Serial port stand-in answering function 4 requests, on a fake clock.
+
+    Registers are read from `registers` (0xffff if they're not in it), or
+    are slave * 1000 + address without it. Every request is logged in
+    `requests` as (time, slave, start address, number of registers).
+    """
+    def __init__(self, registers: dict = None, latency: float = 0.05):
+        self.registers = registers
+        self.now = 0.0
+        self.latency = latency
+        self.baudrate = 9600
+        self.requests = []
+        self.response = b''
+
+    @property
+    def frames(self) -> list:
+        """(start address, number of registers) of every request"""
+        return [(start, num) for _, _, start, num in self.requests]
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.now += duration
+
+    def write(self, data):
+        slave, func, start, num = struct.unpack_from(">BBHH", data)
+        self.requests.append((self.now, slave, start, num))
+        msg = struct.pack(">BBB", slave, func, 2*num)
+        for a in range(start, start+num):
+            if self.registers is None:
+                msg += struct.pack(">H", slave * 1000 + a)
+            else:
+                msg += struct.pack(">H", self.registers.get(a, 0xffff))
+        msg += struct.pack("<H", eastron_crc(msg))
+        self.response = msg
+        self.now += self.latency
+
+    def read_with_idle_timeout(self, size=1, timeout=0.1):
+        data, self.response = self.response[:size], self.response[size:]
+        return data
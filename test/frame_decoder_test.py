@@ -0,0 +1,122 @@
+import struct
+
+import pytest
+
+import src.eastron as eastron
+
+
+def frame(*data: int) -> bytes:
+    msg = bytes(data)
+    return msg + struct.pack("<H", eastron.eastron_crc(msg))
+
+
+def test_single_frame_in_pieces():
+    d = eastron.RtuFrameDecoder()
+    f = frame(1, 4, 4, 0x43, 0x66, 0x80, 0x00)
+    assert d.bytes_needed() == 3
+    d.feed(f[:3])
+    assert d.next_frame() is None
+    assert d.bytes_needed() == len(f) - 3
+    d.feed(f[3:])
+    resp = d.next_frame()
+    assert resp['slave_address'] == 1
+    assert resp['function'] == 4
+    assert resp['payload'] == bytes([0x43, 0x66, 0x80, 0x00])
+    assert d.next_frame() is None
+
+
+def test_multiple_frames():
+    d = eastron.RtuFrameDecoder()
+    d.feed(frame(1, 4, 2, 0, 1) + frame(2, 4, 2, 0, 2) + frame(3, 4, 2)[:3])
+    assert [f['slave_address'] for f in d] == [1, 2]
+    assert d.bytes_needed() == 4
+
+
+def test_exception_response():
+    d = eastron.RtuFrameDecoder()
+    d.feed(frame(1, 0x84, 2))
+    resp = d.next_frame()
+    assert resp['function'] == 0x84
+    assert resp['exception_code'] == 2
+
+
+def test_resync_after_garbage():
+    d = eastron.RtuFrameDecoder()
+    d.feed(b'\x00\xff\x12' + frame(1, 4, 2, 0, 7))
+    resp = d.next_frame()
+    assert resp['payload'] == b'\x00\x07'
+    assert d.discarded_bytes == 3
+
+
+def test_resync_after_crc_error():
+    d = eastron.RtuFrameDecoder()
+    bad = bytearray(frame(1, 4, 2, 0, 1))
+    bad[-1] ^= 0xff
+    d.feed(bytes(bad) + frame(1, 4, 2, 0, 2))
+    resp = d.next_frame()
+    assert resp['payload'] == b'\x00\x02'
+    assert d.crc_errors >= 1
+
+
+def test_read_modbus_response_crc_error():
+    bad = bytearray(frame(1, 4, 2, 0, 1))
+    bad[-1] ^= 0xff
+    data = bytes(bad)
+
+    def get_n_bytes(n):
+        nonlocal data
+        if len(data) == 0:
+            raise eastron.ReadTimeout()
+        chunk, data = data[:n], data[n:]
+        return chunk
+
+    with pytest.raises(eastron.CrcError):
+        eastron.Modbus._read_modbus_response(get_n_bytes)
+
+
+def test_read_modbus_response_after_long_garbage():
+    # Garbage that looks like the start of a 260 byte response
+    data = b'\x00\x04\xff' + frame(1, 4, 2, 0, 7)
+
+    def get_n_bytes(n):
+        nonlocal data
+        chunk, data = data[:n], data[n:]
+        if len(chunk) < n:
+            raise eastron.ReadTimeout(chunk)
+        return chunk
+
+    resp = eastron.Modbus._read_modbus_response(get_n_bytes)
+    assert resp['payload'] == b'\x00\x07'
+
+
+def test_request_raises_modbus_exception():
+    class ExceptionSerial:
+        def write(self, data):
+            self.response = frame(1, 0x84, 2)
+
+        def read_with_idle_timeout(self, size=1, timeout=0.1):
+            data, self.response = self.response[:size], self.response[size:]
+            return data
+
+    m = eastron.Modbus(ExceptionSerial(), 1)
+    with pytest.raises(eastron.ModbusException) as e:
+        m.read_input_registers(0, 2)
+    assert e.value.exception_code == 2
+
+
+def test_table_crc_and_residue():
+    for msg in [b'', b'\x01\x04\x00\x00\x00\x02', bytes(range(256))]:
+        assert eastron.table_crc(msg) == eastron.eastron_crc(msg)
+        frame = msg + struct.pack("<H", eastron.eastron_crc(msg))
+        assert eastron.crc_valid(frame)
+        assert not eastron.crc_valid(frame[:-1] + bytes([frame[-1] ^ 1]))
+
+
+def test_request_frame_cache():
+    m = eastron.Modbus(None, 7)
+    frames = [(0, 2), (0x48, 4)]
+    requests = m._request_frames(4, frames)
+    assert requests == tuple(m._construct_request(7, 4, s, n) for s, n in frames)
+    assert m._request_frames(4, list(frames)) is requests
+    assert m._request_frames(3, frames) != requests
+    assert eastron.Modbus(None, 8)._request_frames(4, frames) != requests
@@ -0,0 +1,126 @@
+import struct
+
+import pytest
+import serial
+
+import src.eastron as eastron
+import src.simulator as simulator
+
+
+class SimulatedBus:
+    """Hands requests straight to a simulator, and logs them"""
+    def __init__(self, sim):
+        self.sim = sim
+        self.requests = []
+        self.pending = b''
+
+    def write(self, data):
+        self.requests.append(bytes(data))
+        self.pending = self.sim.handle_request(bytes(data)) or b''
+
+    def read_with_idle_timeout(self, size=1, timeout=0.1):
+        if len(self.pending) == 0:
+            raise TimeoutError()
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+def make_meter(**kwargs):
+    sim = simulator.Sdm630Simulator(None, **kwargs)
+    bus = SimulatedBus(sim)
+    return eastron.Eastron(bus, 1), bus, sim
+
+
+def test_write_registers():
+    m, bus, sim = make_meter()
+    m.write_register(0x0002, 0x41f0)  # High half of 30.0
+    assert sim.holding[1][0x0002] == 30.0
+    assert bus.requests[-1][1] == 6
+
+    m.write_registers(0x0014, struct.unpack(">HH", struct.pack(">f", 7.0)))
+    assert sim.holding[1][0x0014] == 7.0
+    assert bus.requests[-1][1] == 16
+
+
+def test_write_registers_splits_frames():
+    m, bus, sim = make_meter()
+    m.write_registers(0x1000, [0] * 200)
+    assert [(r[1], struct.unpack_from(">HH", r, 2)) for r in bus.requests] == [
+        (16, (0x1000, 123)), (16, (0x1000 + 123, 77)),
+    ]
+
+
+def test_batch_groups_requests():
+    m, bus, sim = make_meter()
+    batch = m.batch() \
+        .write_registers(0x0002, [0x41f0]) \
+        .write_registers(0x0003, [0x0000]) \
+        .read_input_registers((0x0000, 2), (0x0004, 2)) \
+        .read_holding_registers((0x0002, 2), (0x000a, 2))
+    assert len(batch) == 4
+    result = batch.execute()
+    assert len(bus.requests) == 4
+    # Writes first, merged into one frame; then the reads of each function.
+    # Input registers are bridged, holding registers are not.
+    assert [r[1] for r in bus.requests] == [16, 4, 3, 3]
+
+    holding = eastron.Eastron._registers_to_float(result[3], [0x0002, 0x000a])
+    assert holding == {0x0002: 30.0, 0x000a: 3.0}
+    values = simulator.default_values()
+    inputs = eastron.Eastron._registers_to_float(result[4], [0x0000, 0x0004])
+    assert inputs[0x0004] == pytest.approx(values[0x0004], rel=1e-6)
+
+
+def test_config_is_cached():
+    m, bus, sim = make_meter()
+    config = m.config()
+    assert config['System type'] == 3.0
+    assert config['Serial number'] == 12345678
+    assert isinstance(config['Serial number'], int)
+    requests = len(bus.requests)
+
+    assert m.wiring_mode() is None
+    m.wiring = 'auto'
+    assert m.wiring_mode() == '4w'
+    assert m.config() is config
+    assert len(bus.requests) == requests
+
+    m.write_config('Demand period [min]', 15.0)
+    assert sim.holding[1][0x0002] == 15.0
+    assert m.config()['Demand period [min]'] == 15.0
+
+
+def test_config_over_tcp():
+    import src.transport as transport
+    sim, address = simulator.Sdm630Simulator.open_tcp(framing='tcp')
+    with sim:
+        t = transport.open_transport('tcp', address)
+        m = eastron.Eastron(t, 1)
+        m.write_config('Network node', 2.0)
+        config = m.read_config()
+        t.close()
+    assert config['Network node'] == 2.0
+    assert config['Serial number'] == 12345678
+
+
+def test_config_over_serial():
+    sim, path = simulator.Sdm630Simulator.open_pty()
+    with sim:
+        ser = eastron.DebuggableSerial(path, 9600, serial.EIGHTBITS, serial.PARITY_EVEN, serial.STOPBITS_ONE,
+                                       timeout=0.1)
+        m = eastron.Eastron(ser, 1)
+        m.write_config('Baud rate', 3.0)
+        config = m.config()
+        ser.close()
+    assert config['Baud rate'] == 3.0
+
+
+def test_forbidden_ranges_per_function():
+    m = eastron.Eastron(None, 1, forbidden_ranges={4: [(0x0004, 2)]})
+    assert len(m.plan_reads((0x0000, 2), (0x0008, 2))) == 2
+    # The input register hole does not affect holding registers
+    m.holding_gap_threshold = 48
+    assert len(m.plan_reads((0x0000, 2), (0x0008, 2), function_number=3)) == 1
+    with pytest.raises(ValueError):
+        m.plan_reads((0x0004, 2))
+    m.plan_reads((0x0004, 2), function_number=3)
@@ -0,0 +1,127 @@
+import numpy
+from influxdb.exceptions import InfluxDBServerError, InfluxDBClientError
+
+import src.influx_sink as influx_sink
+
+
+class FakeClient:
+    def __init__(self):
+        self.lines = []
+        self.fail = None
+
+    def write_points(self, lines, protocol='json'):
+        assert protocol == 'line'
+        if self.fail is not None:
+            raise self.fail
+        if any(line.startswith('bad') for line in lines):
+            raise InfluxDBClientError("bad", 400)
+        self.lines += lines
+
+
+POINT = {
+    'measurement': 'power',
+    'tags': {'addr': 1, 'phase': 'total'},
+    'fields': {'true_W': 1.5, 'count': 3},
+}
+
+
+def test_line_protocol():
+    s = influx_sink.LineProtocolSerializer()
+    assert s.serialize(POINT, 123) == 'power,addr=1,phase=total true_W=1.5,count=3i 123'
+    assert s.serialize({'measurement': 'a b', 'tags': {'t,x': 'y=z'}, 'fields': {'s': 'q"'}}) == \
+        'a\\ b,t\\,x=y\\=z s="q\\""'
+
+
+def test_line_protocol_like_influxdb_client():
+    s = influx_sink.LineProtocolSerializer()
+    # None fields and empty tags are left out, as make_line() does
+    assert s.serialize({'measurement': 'm', 'tags': {'a': '', 'b': 'x'}, 'fields': {'f': None, 'g': 1.0}}) == \
+        'm,b=x g=1.0'
+    assert s.serialize({'measurement': 'm', 'fields': {'f': None}}) is None
+    assert s.serialize({'measurement': 'm', 'fields': {
+        'f': numpy.float32(0.5), 'g': numpy.float64(1.5), 'i': numpy.int16(3)}}) == 'm f=0.5,g=1.5,i=3i'
+
+
+def test_point_without_fields_skipped():
+    sink = influx_sink.InfluxSink(FakeClient())
+    sink.write_points([{'measurement': 'm', 'fields': {'f': None}}, POINT])
+    assert sink._queue.qsize() == 1
+
+
+def test_batches_written_in_background():
+    client = FakeClient()
+    sink = influx_sink.InfluxSink(client, flush_interval=0.01).start()
+    sink.write_points([POINT, POINT])
+    sink.stop()
+    assert len(client.lines) == 2
+    assert sink.written == 2
+
+
+def test_spool_and_replay(tmp_path):
+    client = FakeClient()
+    client.fail = InfluxDBServerError("down")
+    clock = [0.0]
+    sink = influx_sink.InfluxSink(client, spool_path=str(tmp_path / 'spool'), clock=lambda: clock[0])
+
+    sink._deliver(['a 1', 'b 2'])
+    assert sink.failures == 1
+    assert (tmp_path / 'spool').read_text() == 'a 1\nb 2\n'
+
+    # Backing off: goes straight to the spool
+    clock[0] = 0.5
+    sink._deliver(['c 3'])
+    assert sink.failures == 1
+    assert client.lines == []
+
+    client.fail = None
+    clock[0] = 10
+    sink._deliver(['d 4'])
+    assert client.lines == ['a 1', 'b 2', 'c 3', 'd 4']
+    assert not (tmp_path / 'spool').exists()
+
+
+def test_replay_failure_keeps_order(tmp_path):
+    client = FakeClient()
+    sink = influx_sink.InfluxSink(client, spool_path=str(tmp_path / 'spool'), batch_size=1,
+                                  clock=lambda: 100)
+    (tmp_path / 'spool').write_text('a 1\nb 2\n')
+    sink._spooled = True
+    client.fail = ConnectionError()
+    sink._deliver(['c 3'])
+    assert (tmp_path / 'spool').read_text() == 'a 1\nb 2\nc 3\n'
+
+
+def test_in_memory_retention():
+    client = FakeClient()
+    client.fail = ConnectionError()
+    sink = influx_sink.InfluxSink(client, max_queue=2, clock=lambda: 0)
+    sink._deliver(['a 1', 'b 2', 'c 3'])
+    assert sink.dropped == 1
+    client.fail = None
+    sink._retry_at = 0
+    sink._deliver([])
+    assert client.lines == ['b 2', 'c 3']
+
+
+def test_rejected_batch_dropped():
+    client = FakeClient()
+    client.fail = InfluxDBClientError("bad", 400)
+    sink = influx_sink.InfluxSink(client)
+    sink._deliver(['x'])
+    assert sink.rejected == 1
+    assert sink.failures == 0
+
+
+def test_rejected_held_batch_dropped():
+    client = FakeClient()
+    client.fail = ConnectionError()
+    sink = influx_sink.InfluxSink(client, batch_size=1, clock=lambda: 0)
+    sink._deliver(['bad 1', 'ok 2'])
+    client.fail = None
+    sink._retry_at = 0
+    sink._deliver(['ok 3'])
+    assert client.lines == ['ok 2', 'ok 3']
+    assert sink.rejected == 1
+    assert len(sink._retained) == 0
+    sink._deliver(['ok 4'])
+    assert client.lines == ['ok 2', 'ok 3', 'ok 4']
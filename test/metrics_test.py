@@ -0,0 +1,103 @@
+import urllib.request
+
+import pytest
+import serial
+
+import src.eastron as eastron
+import src.metrics as metrics
+import src.simulator as simulator
+import src.transport as transport
+
+
+def test_render():
+    r = metrics.Registry()
+    c = r.counter('frames_total', 'Frames', ['slave'])
+    c.labels(1).inc()
+    c.labels(1).inc(2)
+    c.labels('2').inc()
+    h = r.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+    h.observe(0.05)
+    h.observe(0.5)
+    h.observe(5)
+
+    assert r.render() == (
+        '# HELP frames_total Frames\n'
+        '# TYPE frames_total counter\n'
+        'frames_total{slave="1"} 3\n'
+        'frames_total{slave="2"} 1\n'
+        '# HELP latency_seconds Latency\n'
+        '# TYPE latency_seconds histogram\n'
+        'latency_seconds_bucket{le="0.1"} 1\n'
+        'latency_seconds_bucket{le="1.0"} 2\n'
+        'latency_seconds_bucket{le="+Inf"} 3\n'
+        'latency_seconds_sum 5.55\n'
+        'latency_seconds_count 3\n'
+    )
+    assert r.counter('frames_total', 'Frames', ['slave']) is c
+
+
+def test_modbus_metrics():
+    r = metrics.Registry()
+    mm = metrics.ModbusMetrics(r)
+    sim, path = simulator.Sdm630Simulator.open_pty()
+    with sim:
+        ser = eastron.DebuggableSerial(path, 9600, serial.EIGHTBITS, serial.PARITY_EVEN, serial.STOPBITS_ONE,
+                                       timeout=0.1)
+        e = eastron.Eastron(ser, 1, metrics=mm)
+        e.read_input_registers_float([0, 2, 0x100])
+        ser.close()
+
+    slave = mm.for_slave(1)
+    assert slave.frames_sent.value == 2
+    assert slave.frames_received.value == 2
+    assert slave.bytes_sent.value == 2 * 8
+    assert slave.bytes_received.value == sim.bytes_sent
+    assert slave.latency(4).count == 2
+    assert slave.decode_time.count == 1
+    assert 'modbus_response_seconds_count{slave="1",function="4"} 2' in r.render()
+
+
+def test_serve():
+    r = metrics.Registry()
+    r.counter('up', 'Up').inc()
+    server = r.serve(0, '127.0.0.1')
+    try:
+        with urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(server.server_address[1])) as resp:
+            assert resp.read().decode() == r.render()
+    finally:
+        server.shutdown()
+
+
+def test_modbus_tcp_metrics():
+    mm = metrics.ModbusMetrics(metrics.Registry())
+    sim, address = simulator.Sdm630Simulator.open_tcp(slaves={1: {0: 1.0, 200: 2.0}})
+    with sim:
+        t = transport.open_transport('tcp', address)
+        e = eastron.Eastron(t, 1, metrics=mm)
+        e.read_input_registers_float([0, 200])
+        t.close()
+
+    slave = mm.for_slave(1)
+    assert slave.frames_sent.value == slave.frames_received.value == 2
+    assert slave.bytes_sent.value == 2 * 12
+    assert slave.bytes_received.value == sim.bytes_sent
+    assert slave.latency(4).count == 2
+
+
+def test_invalid_response_is_not_a_crc_error():
+    class OtherSlave:
+        def write(self, data):
+            msg = bytes([2, 4, 2, 0, 0])
+            self.pending = msg + eastron.struct.pack("<H", eastron.eastron_crc(msg))
+
+        def read_with_idle_timeout(self, size=1, timeout=0.1):
+            data, self.pending = self.pending[:size], self.pending[size:]
+            return data
+
+    mm = metrics.ModbusMetrics(metrics.Registry())
+    e = eastron.Modbus(OtherSlave(), 1, retries=0, metrics=mm)
+    with pytest.raises(ValueError):
+        e.read_input_registers((0, 1))
+    slave = mm.for_slave(1)
+    assert slave.invalid_responses.value == 1
+    assert slave.crc_errors.value == 0
@@ -0,0 +1,101 @@
+import pytest
+
+import src.point_filter as point_filter
+
+S = 1000000000  # ns
+
+
+def point(value, field='voltage_V', measurement='line_voltage', addr=1):
+    return {'measurement': measurement, 'tags': {'addr': addr}, 'fields': {field: value}}
+
+
+def run(f, values, field='voltage_V'):
+    """Feed one value per second, returns the emitted (second, value)s"""
+    emitted = []
+    for i, value in enumerate(values):
+        for p in f.filter([point(value, field)], i * S):
+            emitted.append((p['time'] // S, p['fields'][field]))
+    return emitted
+
+
+def test_no_rule_passes_everything():
+    f = point_filter.PointFilter()
+    assert run(f, [1.0, 1.0, 1.0]) == [(0, 1.0), (1, 1.0), (2, 1.0)]
+
+
+def test_change_detection():
+    f = point_filter.PointFilter(default=point_filter.Rule())
+    assert run(f, [1.0, 1.0, 2.0, 2.0, 1.0]) == [(0, 1.0), (2, 2.0), (4, 1.0)]
+    assert (f.received, f.emitted) == (5, 3)
+
+
+def test_deadband():
+    f = point_filter.PointFilter({'voltage_V': point_filter.Rule(deadband=0.5)})
+    assert run(f, [230.0, 230.4, 230.8, 230.5, 229.0]) == [(0, 230.0), (2, 230.8), (4, 229.0)]
+
+
+def test_relative_deadband():
+    f = point_filter.PointFilter({'voltage_V': point_filter.Rule(relative=0.1)})
+    assert run(f, [100.0, 109.0, 111.0, 121.0]) == [(0, 100.0), (2, 111.0)]
+
+
+def test_heartbeat():
+    f = point_filter.PointFilter({'voltage_V': point_filter.Rule(deadband=1, heartbeat=2)})
+    assert run(f, [1.0] * 5) == [(0, 1.0), (2, 1.0), (4, 1.0)]
+
+
+def test_rule_per_measurement():
+    f = point_filter.PointFilter({
+        'true_W': point_filter.Rule(deadband=100),
+        'energy.true_W': point_filter.Rule(),
+    })
+    assert f.filter([point(1.0, 'true_W', 'power')], 0) != []
+    assert f.filter([point(2.0, 'true_W', 'power')], S) == []
+    assert f.filter([point(1.0, 'true_W', 'energy')], 0) != []
+    assert f.filter([point(2.0, 'true_W', 'energy')], S) != []
+
+
+def test_series_are_independent():
+    f = point_filter.PointFilter(default=point_filter.Rule())
+    assert len(f.filter([point(1.0, addr=1), point(1.0, addr=2)], 0)) == 2
+    assert f.filter([point(1.0, addr=1), point(2.0, addr=2)], S) == [
+        {'measurement': 'line_voltage', 'tags': {'addr': 2}, 'fields': {'voltage_V': 2.0}, 'time': S},
+    ]
+
+
+def test_swinging_door_linear():
+    f = point_filter.PointFilter({'voltage_V': point_filter.Rule(compression=0.1)})
+    # A straight line needs only its end points
+    assert run(f, [float(i) for i in range(10)]) == [(0, 0.0)]
+    assert [(p['time'] // S, p['fields']['voltage_V']) for p in f.flush()] == [(9, 9.0)]
+    assert f.flush() == []
+
+
+def test_swinging_door_corner():
+    f = point_filter.PointFilter({'voltage_V': point_filter.Rule(compression=0.1)})
+    values = [0.0, 1.0, 2.0, 3.0, 3.0, 3.0, 3.0]
+    # The corner at t=3 is emitted once the series leaves the line through it
+    assert run(f, values) == [(0, 0.0), (3, 3.0)]
+
+
+def test_swinging_door_reconstruction():
+    f = point_filter.PointFilter({'voltage_V': point_filter.Rule(compression=0.5)})
+    values = [230 + ((i * 7) % 11) / 30 + i / 20 for i in range(50)]
+    emitted = run(f, values)
+    emitted += [(p['time'] // S, p['fields']['voltage_V']) for p in f.flush()]
+    assert len(emitted) < len(values) / 2
+    for (t0, v0), (t1, v1) in zip(emitted, emitted[1:]):
+        for t in range(t0, t1 + 1):
+            assert values[t] == pytest.approx(v0 + (v1 - v0) * (t - t0) / (t1 - t0), abs=0.5 + 1e-9)
+
+
+def test_swinging_door_heartbeat_keeps_held_point():
+    f = point_filter.PointFilter({'voltage_V': point_filter.Rule(compression=0.5, heartbeat=10)})
+    # Without the held point at t=9, the series would ramp from 0 to 10
+    assert run(f, [0.0] * 10 + [10.0]) == [(0, 0.0), (9, 0.0), (10, 10.0)]
+
+
+def test_rule_parse():
+    assert point_filter.Rule.parse("deadband=0.5,heartbeat=60") == point_filter.Rule(deadband=0.5, heartbeat=60)
+    with pytest.raises(ValueError):
+        point_filter.Rule.parse("foo=1")
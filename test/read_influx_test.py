@@ -0,0 +1,45 @@
+import src.read_influx as read_influx
+from src.site_snapshot import SiteSample
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.sleeps.append(duration)
+        self.now += duration
+
+
+def test_run_periodic_no_drift():
+    c = FakeClock()
+    runs = []
+
+    def work():
+        runs.append(c.now)
+        c.now += 0.3
+
+    read_influx.run_periodic(1, work, clock=c.clock, sleep=c.sleep, cycles=4)
+    assert runs == [0, 1, 2, 3]
+
+
+def test_run_periodic_skips_overrun():
+    c = FakeClock()
+    runs = []
+
+    def work():
+        runs.append(c.now)
+        c.now += 2.5 if len(runs) == 2 else 0.1
+
+    read_influx.run_periodic(1, work, clock=c.clock, sleep=c.sleep, cycles=4)
+    assert runs == [0, 1, 4, 5]
+
+
+def test_partial_site_point_has_no_power():
+    sample = SiteSample(time=1.0, total=None, values={1: 100j}, alignment_error={1: 0.1}, missing=[2])
+    point = read_influx.site_point(sample, 123)
+    assert point['fields'] == {'meters': 1, 'missing': 1, 'alignment_error_s': 0.1}
@@ -0,0 +1,122 @@
+import pytest
+
+import src.eastron as eastron
+from fake_bus import FakeBus
+
+
+def plan(registers, max_registers=64, gap_threshold=0, forbidden=(), joined=()):
+    return eastron.Modbus._plan_reads(sorted(registers), max_registers, gap_threshold, forbidden, joined)
+
+
+def test_adjacent():
+    p = plan([0, 1, 2, 3])
+    assert p.frames == [(0, 4)]
+    assert p.junk_bytes == 0
+
+
+def test_gap_not_bridged():
+    p = plan([0, 1, 4, 5], gap_threshold=2)
+    assert p.frames == [(0, 2), (4, 2)]
+
+
+def test_gap_bridged():
+    p = plan([0, 1, 4, 5], gap_threshold=4)
+    assert p.frames == [(0, 6)]
+    assert p.junk_bytes == 4
+    assert p.request_bytes == 8
+    assert p.response_bytes == 5 + 12
+
+
+def test_max_registers():
+    p = plan(range(0, 130))
+    assert p.frames == [(0, 64), (64, 64), (128, 2)]
+
+
+def test_forbidden():
+    p = plan([0, 1, 4, 5], gap_threshold=100, forbidden=[3])
+    assert p.frames == [(0, 2), (4, 2)]
+
+    with pytest.raises(ValueError):
+        plan([0, 1], forbidden=[1])
+
+
+def test_joined_registers_stay_together():
+    p = plan(range(0, 8), max_registers=3, joined={1, 3, 5, 7})
+    assert p.frames == [(0, 2), (2, 2), (4, 2), (6, 2)]
+    # Impossible to keep together
+    with pytest.raises(ValueError):
+        plan(range(0, 4), max_registers=3, joined={1, 2, 3})
+
+
+def test_fewest_bytes_for_equal_frames():
+    # Greedily extending the first frame would read 0..63 + 70..71;
+    # covering 60..71 in the second frame reads less.
+    p = plan([0, 1, 60, 61, 70, 71], max_registers=64, gap_threshold=200)
+    assert len(p) == 2
+    assert p.frames == [(0, 2), (60, 12)]
+
+
+def test_defined_registers():
+    e = eastron.Eastron(None, 1)
+    # The registers of one wiring mode: the others are read along
+    ranges = [(r.addr, 2) for r in e.register_map.select('3w')]
+    adjacent_only = eastron.Modbus(None, 1).plan_reads(ranges)
+    bridged = e.plan_reads(ranges)
+    assert len(bridged) < len(adjacent_only)
+    assert set(bridged.registers) == set(adjacent_only.registers)
+    # ... but never the undefined registers between them
+    defined = {info['addr'] + i for info in e.defined_registers.values() for i in range(2)}
+    assert all(a in defined for start, num in bridged.frames for a in range(start, start + num))
+
+
+def test_undefined_registers_can_be_requested():
+    e = eastron.Eastron(None, 1)
+    assert e.plan_reads((0x0058, 2)).frames == [(0x0058, 2)]
+    assert e.plan_reads((0x0054, 2), (0x0064, 2)).frames == [(0x0054, 2), (0x0064, 2)]
+
+
+def test_read_input_registers_drops_junk():
+    s = FakeBus({0: 10, 1: 11, 4: 14})
+    m = eastron.Modbus(s, 1, gap_threshold=4)
+    assert m.read_input_registers((0, 2), (4, 1)) == {0: 10, 1: 11, 4: 14}
+    assert s.frames == [(0, 5)]
+
+
+def float_registers(values: dict) -> dict:
+    registers = {}
+    for addr, value in values.items():
+        registers[addr], registers[addr+1] = eastron.struct.unpack(">HH", eastron.struct.pack(">f", value))
+    return registers
+
+
+def test_read_input_registers_float():
+    values = {0x00: 1.5, 0x02: -2.25, 0x07: 3.0, 0x48: 1e6}  # 0x07 is not aligned with its frame start
+    s = FakeBus(float_registers(values))
+    e = eastron.Eastron(s, 1)
+    assert e.read_input_registers_float(list(values.keys())) == values
+    assert len(s.requests) == 2
+
+
+def test_read_input_registers_float_array():
+    values = {0x48: 4.0, 0x00: 1.5, 0x0c: -2.25}
+    s = FakeBus(float_registers(values))
+    e = eastron.Eastron(s, 1)
+    result = e.read_input_registers_float(list(values.keys()), as_array=True)
+    assert list(result) == list(values.values())
+
+
+def test_floats_are_not_split_over_frames():
+    values = {a: float(a) for a in range(0, 140, 2)}
+    s = FakeBus(float_registers(values))
+    e = eastron.Eastron(s, 1, max_registers_per_request=63)
+    assert e.read_input_registers_float(list(values.keys())) == values
+    assert all(num % 2 == 0 for _, num in s.frames)
+
+
+def test_floats_that_cant_stay_whole():
+    # Overlapping floats need 3 registers in one frame
+    s = FakeBus(float_registers({0: 1.0}))
+    e = eastron.Eastron(s, 1, max_registers_per_request=2)
+    with pytest.raises(ValueError):
+        e.read_input_registers_float([0, 1])
+    assert s.frames == []
@@ -0,0 +1,41 @@
+import csv
+import io
+
+from pytest import approx
+
+import src.recompute as recompute
+
+
+RAW_CSV = """time,U12,U23,U31,P1,Q1,P3,Q3
+1,100,100,100,1000,0,0,0
+2,100,100,100,0,0,1000,0
+3,235.34,237.46,236.40,2116,-446,295,85
+"""
+
+
+def test_recompute_chunks():
+    chunks = list(recompute.read_csv_chunks(io.StringIO(RAW_CSV),
+                                            {n: n for n in recompute.RAW_COLUMNS},
+                                            'time', chunk_size=2))
+    assert [len(c['time']) for c in chunks] == [2, 1]
+
+    out = io.StringIO()
+    rows = recompute.write_csv_chunks((recompute.recompute(c) for c in chunks), out)
+    assert rows == 3
+
+    result = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert result[0]['time'] == '1'
+    assert float(result[0]['I1_A']) == approx(10)
+    assert float(result[0]['I1_deg']) == approx(-30)
+    assert float(result[0]['I2_A']) == approx(10)
+    assert float(result[0]['I2_deg']) == approx(30)
+    assert float(result[1]['I3_deg']) == approx(30)
+    assert float(result[2]['I1_A']) == approx(9.198, rel=0.01)
+    assert float(result[2]['true_W']) == approx(2116 + 295)
+
+
+def test_column_mapping():
+    data = "ts,a,b,c,d,e,f,g\n1,100,100,100,1000,0,0,0\n"
+    names = dict(zip(['U12', 'U23', 'U31', 'P1', 'Q1', 'P3', 'Q3'], 'abcdefg'))
+    chunk, = recompute.read_csv_chunks(io.StringIO(data), names, 'ts', chunk_size=10)
+    assert list(chunk['P1']) == [1000]
@@ -0,0 +1,89 @@
+import pytest
+import serial
+
+import src.eastron as eastron
+import src.simulator as simulator
+
+
+def open_serial(path):
+    return eastron.DebuggableSerial(path, 9600, serial.EIGHTBITS, serial.PARITY_EVEN, serial.STOPBITS_ONE,
+                                    timeout=0.1)
+
+
+def test_compiled_map():
+    rm = eastron.Eastron.register_map
+    assert len(rm) == len(eastron.Eastron.defined_registers)
+    assert list(rm.addresses) == sorted(info['addr'] for info in eastron.Eastron.defined_registers.values())
+    for i, register in enumerate(rm):
+        assert register.index == i
+        assert rm.by_addr[register.addr] is register
+        assert rm.by_name[register.name] is register
+
+    u12 = rm.by_name['Line 1 to Line 2 volts [V]']
+    assert u12.addr == 0xc8
+    assert u12 in rm.select('3w') and u12 in rm.select('4w')
+    assert u12 not in rm.select('2w')
+    assert list(rm.mode_addresses['2w']) == [r.addr for r in rm.select('2w')]
+
+
+def test_subclass_gets_own_map():
+    class Small(eastron.Eastron):
+        defined_registers = {
+            'b': {'addr': 0x02, '4w': True, '3w': False, '2w': False},
+            'a': {'addr': 0x00, '4w': True, '3w': True, '2w': True},
+        }
+
+    assert [r.name for r in Small.register_map] == ['a', 'b']
+    assert [r.name for r in Small.register_map.select('3w')] == ['a']
+    assert len(eastron.Eastron.register_map) == len(eastron.Eastron.defined_registers)
+
+
+def test_plan_is_cached():
+    e = eastron.Eastron(None, 1)
+    rm = e.register_map
+    assert rm.plan(e, '3w') is rm.plan(e, '3w')
+    assert rm.plan(e, '3w').frames == e.plan_reads([(r.addr, 2) for r in rm.select('3w')]).frames
+
+    other = eastron.Eastron(None, 1, gap_threshold=0)
+    assert rm.plan(other, '3w') is not rm.plan(e, '3w')
+
+
+def test_read_registers():
+    values = simulator.default_values()
+    sim, path = simulator.Sdm630Simulator.open_pty(slaves={1: values})
+    with sim:
+        ser = open_serial(path)
+        e = eastron.Eastron(ser, 1)
+        result = e.read_registers('3w')
+        ser.close()
+
+    registers = e.register_map.select('3w')
+    assert len(result) == len(registers)
+    for register, value in zip(registers, result):
+        assert value == pytest.approx(values[register.addr], rel=1e-6)
+
+
+def test_wiring_mode_selects_registers():
+    assert eastron.Eastron(None, 1).registers() == eastron.Eastron.register_map.registers
+    assert eastron.Eastron(None, 1, wiring='3w').registers() == eastron.Eastron.register_map.select('3w')
+    assert all('3w' in r.modes for r in eastron.Eastron3P3W(None, 1).registers())
+    for addr in eastron.Eastron3P3W.registers_used:
+        assert '3w' in eastron.Eastron.register_map.by_addr[addr].modes
+    with pytest.raises(ValueError):
+        eastron.Eastron(None, 1, wiring='5w')
+
+    e = eastron.Eastron(None, 1)
+    assert e.register_map.plan(e, '3w').total_bytes < e.register_map.plan(e).total_bytes
+
+
+def test_detect_wiring():
+    sim, path = simulator.Sdm630Simulator.open_pty(holding={1: simulator.default_holding_values(2.0)})
+    with sim:
+        ser = open_serial(path)
+        e = eastron.Eastron(ser, 1, wiring='auto')
+        result = e.read_all()
+        ser.close()
+
+    assert e.wiring == '3w'
+    assert set(result.keys()) == {r.name for r in e.register_map.select('3w')}
+    assert 'Phase 1 line to neutral volts [V]' not in result
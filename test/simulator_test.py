@@ -0,0 +1,63 @@
+import pytest
+import serial
+
+import src.eastron as eastron
+import src.simulator as simulator
+import src.benchmark as benchmark
+
+
+def open_serial(path):
+    return eastron.DebuggableSerial(path, 9600, serial.EIGHTBITS, serial.PARITY_EVEN, serial.STOPBITS_ONE,
+                                    timeout=0.1)
+
+
+def test_read_all_registers():
+    values = simulator.default_values()
+    sim, path = simulator.Sdm630Simulator.open_pty(slaves={1: values})
+    with sim:
+        ser = open_serial(path)
+        e = eastron.Eastron(ser, 1)
+        result = e.read_input_registers_float(list(values.keys()))
+        ser.close()
+
+    for addr, value in values.items():
+        assert result[addr] == pytest.approx(value, rel=1e-6)
+    assert sim.responses == len(e.plan_reads([(a, 2) for a in values.keys()]))
+
+
+def test_multiple_slaves():
+    sim, path = simulator.Sdm630Simulator.open_pty(slaves={1: {0: 1.0}, 2: {0: 2.0}})
+    with sim:
+        ser = open_serial(path)
+        assert eastron.Eastron(ser, 2).read_input_registers_float([0]) == {0: 2.0}
+        assert eastron.Eastron(ser, 1).read_input_registers_float([0]) == {0: 1.0}
+        with pytest.raises(TimeoutError):
+            eastron.Eastron(ser, 3).read_input_registers_float([0])
+        ser.close()
+
+
+def test_crc_errors():
+    sim, path = simulator.Sdm630Simulator.open_pty(crc_error_rate=1.0)
+    with sim:
+        ser = open_serial(path)
+        with pytest.raises(ValueError):
+            eastron.Eastron(ser, 1).read_input_registers_float([0])
+        ser.close()
+
+
+def test_illegal_function():
+    sim, path = simulator.Sdm630Simulator.open_pty()
+    with sim:
+        ser = open_serial(path)
+        m = eastron.Modbus(ser, 1)
+        with pytest.raises(eastron.ModbusException):
+            m._request(2, 0, 1)
+        ser.close()
+
+
+@pytest.mark.parametrize("workload", benchmark.WORKLOADS.keys())
+def test_benchmark(workload):
+    result = benchmark.run(benchmark.WORKLOADS[workload], 3)
+    assert result['errors'] == 0
+    assert result['frames'] >= 3
+    assert result['registers_per_s'] > 0
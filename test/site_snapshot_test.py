@@ -0,0 +1,86 @@
+import pytest
+
+import src.bus_scheduler as bus_scheduler
+from src.eastron import Eastron
+import src.site_snapshot as site_snapshot
+from fake_bus import FakeBus
+
+
+def test_interpolates_to_grid():
+    s = site_snapshot.SiteSnapshot(['a', 'b'], 1.0)
+    # Both meters ramp at 10/s, but are read at different times
+    assert s.add('a', 0.1, 1.0) == []
+    assert s.add('b', 0.6, 6.0) == []
+    assert s.add('a', 1.1, 11.0) == []
+    samples = s.add('b', 1.6, 16.0)
+    assert len(samples) == 1
+    sample = samples[0]
+    assert sample.time == 1.0
+    assert sample.values == pytest.approx({'a': 10.0, 'b': 10.0})
+    assert sample.total == pytest.approx(20.0)
+    assert sample.alignment_error == pytest.approx({'a': 0.1, 'b': 0.4})
+    assert sample.missing == []
+    assert s.max_alignment_error == pytest.approx(0.4)
+
+
+def test_spread_counts_as_error():
+    s = site_snapshot.SiteSnapshot(['a'], 1.0)
+    s.add('a', 0.9, 0.0, spread=0.2)
+    sample, = s.add('a', 1.9, 0.0)
+    assert sample.alignment_error['a'] == pytest.approx(0.2)
+
+
+def test_missing_meter_does_not_block():
+    s = site_snapshot.SiteSnapshot(['a', 'dead'], 1.0, max_delay=2.0)
+    s.add('dead', 0.5, 100.0)
+    out = []
+    for i in range(1, 6):
+        out += s.add('a', i + 0.1, 1.0)
+    assert [sample.time for sample in out] == [1.0, 2.0, 3.0]
+    # Held while recent enough, then left out
+    assert [sample.missing for sample in out] == [[], [], ['dead']]
+    assert out[0].total == pytest.approx(101.0)
+    # Not a site total without 'dead'
+    assert out[2].total is None
+    assert out[2].values == {'a': 1.0}
+    assert s.poll(10.0)[-1].time == 7.0
+
+
+def test_all_missing_is_skipped():
+    s = site_snapshot.SiteSnapshot(['a', 'b'], 1.0, max_delay=2.0)
+    s.add('a', 0.5, 1.0)
+    s.add('b', 0.5, 2.0)
+    out = s.poll(10.0)
+    # Held until 2.0, nothing after that
+    assert [sample.time for sample in out] == [1.0, 2.0]
+    assert s.emitted == 2
+    # No values are made up across the outage
+    out = s.add('a', 10.5, 1.0) + s.add('b', 11.5, 2.0)
+    assert [sample.time for sample in out] == [9.0, 10.0]
+    assert out[0].missing == ['b'] and out[0].total is None
+    assert out[1].total == pytest.approx(3.0)
+
+
+def test_site_power_on_scheduler():
+    bus = FakeBus(latency=0.02)
+    scheduler = bus_scheduler.BusScheduler(bus, clock=bus.clock, sleep=bus.sleep)
+    slaves = range(1, 25)
+    snapshot = site_snapshot.SiteSnapshot(slaves, 1.0)
+    samples = []
+    site_snapshot.add_site_power_tasks(scheduler, slaves, snapshot, samples.append)
+    scheduler.run(10)
+
+    assert len(samples) >= 8
+    # FakeBus answers constant registers, so the aligned values are exact
+    expected = {}
+    for slave in slaves:
+        registers = {a: slave * 1000 + a for a in range(0, 0x20)}
+        v = Eastron._registers_to_float(registers, [0x0c, 0x18, 0x10, 0x1c])
+        expected[slave] = complex(v[0x0c], v[0x18]) + complex(v[0x10], v[0x1c])
+    for sample in samples:
+        assert sample.missing == []
+        assert sample.total == pytest.approx(sum(expected.values()))
+    # One read of all meters takes ~24 * (latency + gap); no reading is
+    # further than that from the grid time it is used for
+    cycle = len(slaves) * (bus.latency + scheduler.gap)
+    assert 0 < snapshot.max_alignment_error <= cycle
@@ -0,0 +1,122 @@
+import struct
+
+import pytest
+
+import src.eastron as eastron
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def response(slave, *registers):
+    msg = struct.pack(">BBB", slave, 4, 2 * len(registers)) + struct.pack(">{}H".format(len(registers)), *registers)
+    return msg + struct.pack("<H", eastron.eastron_crc(msg))
+
+
+class ScriptedSerial:
+    """Answers each request with the next scripted response; None times out"""
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.pending = b''
+        self.writes = 0
+        self.resets = 0
+        self.timeouts = []
+
+    def write(self, data):
+        self.writes += 1
+        self.pending = self.responses.pop(0)
+
+    def read_with_idle_timeout(self, size=1, timeout=0.1):
+        self.timeouts.append(timeout)
+        if self.pending is None or len(self.pending) == 0:
+            raise TimeoutError()
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def reset_input_buffer(self):
+        self.resets += 1
+        self.pending = b''
+
+
+def test_adaptive_timeout():
+    h = eastron.SlaveHealth(initial_timeout=0.1, min_timeout=0.02, factor=2, min_samples=5)
+    for _ in range(4):
+        h.record_success(0.03)
+    assert h.timeout == 0.1
+    h.record_success(0.03)
+    assert h.timeout == pytest.approx(0.06)
+    for _ in range(50):
+        h.record_success(0.001)
+    assert h.timeout == 0.02
+
+
+def test_circuit_breaker():
+    clock = FakeClock()
+    h = eastron.SlaveHealth(failure_threshold=2, min_backoff=5, max_backoff=20, clock=clock)
+    h.record_failure()
+    assert not h.is_open()
+    h.record_failure()
+    assert h.is_open()
+    with pytest.raises(eastron.SlaveUnavailable):
+        h.check(1)
+    clock.now = 5
+    assert not h.is_open()
+    h.record_failure()  # trial request failed: back off longer
+    assert h.open_until == 15
+    clock.now = 15
+    h.record_success(0.01)
+    assert not h.is_open() and h.backoff == 0
+
+
+def test_retry_after_crc_error():
+    bad = bytearray(response(1, 1, 2))
+    bad[-1] ^= 0xff
+    ser = ScriptedSerial(bytes(bad), response(1, 1, 2))
+    m = eastron.Modbus(ser, 1)
+    assert m.read_input_registers((0, 2)) == {0: 1, 1: 2}
+    assert ser.writes == 2
+    assert ser.resets == 1
+    assert m.health.retries == 1 and m.health.failures == 0
+
+
+def test_retries_exhausted():
+    ser = ScriptedSerial(None, None, None, None, None, None, None, None, None)
+    m = eastron.Modbus(ser, 1, retries=2, health=eastron.SlaveHealth(failure_threshold=2))
+    with pytest.raises(TimeoutError):
+        m.read_input_registers((0, 2))
+    assert ser.writes == 3
+    with pytest.raises(TimeoutError):
+        m.read_input_registers((0, 2))
+    # The circuit is open now: no more bus traffic
+    with pytest.raises(eastron.SlaveUnavailable):
+        m.read_input_registers((0, 2))
+    assert ser.writes == 6
+
+
+def test_timeout_is_used():
+    ser = ScriptedSerial(response(1, 1, 2))
+    m = eastron.Modbus(ser, 1)
+    m.health.timeout = 0.042
+    m.read_input_registers((0, 2))
+    assert set(ser.timeouts) == {0.042}
+
+
+def test_retry_after_short_response():
+    # E.g. a late response to an earlier, smaller read
+    ser = ScriptedSerial(response(1, 7), response(1, 1, 2))
+    m = eastron.Modbus(ser, 1)
+    assert m.read_input_registers((0, 2)) == {0: 1, 1: 2}
+    assert ser.writes == 2
+    assert m.health.retries == 1
+
+
+def test_retry_after_response_of_other_slave():
+    ser = ScriptedSerial(response(2, 1, 2), response(1, 3, 4))
+    m = eastron.Modbus(ser, 1)
+    assert m.read_input_registers((0, 2)) == {0: 3, 1: 4}
+    assert m.health.retries == 1 and m.health.successes == 1
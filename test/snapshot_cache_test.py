@@ -0,0 +1,76 @@
+import src.eastron as eastron
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_expiry():
+    clock = FakeClock()
+    fetched = []
+
+    def fetch():
+        fetched.append(clock.now)
+        return len(fetched)
+
+    c = eastron.SnapshotCache(fetch, max_age=1, clock=clock)
+    assert c.get() == 1
+    assert c.get() == 1
+    clock.now = 0.5
+    assert c.get() == 1
+    clock.now = 1.5
+    assert c.get() == 2
+    assert (c.hits, c.misses, c.expirations) == (2, 2, 1)
+
+
+def test_stale():
+    clock = FakeClock()
+    c = eastron.SnapshotCache(None, max_age=1, clock=clock)
+    assert c.stale()
+    c.refresh(1)
+    assert not c.stale()
+    clock.now = 1.5
+    assert c.stale()
+    assert (c.hits, c.misses, c.expirations) == (1, 2, 1)
+
+
+def test_cache_without_max_age():
+    c = eastron.SnapshotCache(lambda: object())
+    first = c.get()
+    assert c.get() is first
+    c.refresh()
+    assert c.get() is not first
+    c.refresh(42)
+    assert c.get() == 42
+
+
+class CountingEastron3P3W(eastron.Eastron3P3W):
+    reads = 0
+
+    def read_input_registers_float(self, *addresses, as_array=False):
+        self.reads += 1
+        return {a: 100.0 for a in self.registers_used}
+
+
+def test_shared_transaction():
+    e = CountingEastron3P3W(None, 1)
+    e.S()
+    e.I2_u2()
+    e.E()
+    assert e.reads == 1
+    assert e.snapshot.misses == 1
+
+    e.refresh()
+    e.S()
+    assert e.reads == 2
+
+
+def test_refresh_with_data():
+    e = CountingEastron3P3W(None, 1)
+    e.refresh({a: 1.0 for a in e.registers_used})
+    assert e.U12() == 1.0
+    assert e.reads == 0
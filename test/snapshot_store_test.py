@@ -0,0 +1,101 @@
+import os
+
+import numpy
+import pytest
+
+from src.eastron import Eastron3P3W
+import src.eastron_numpy as eastron_numpy
+import src.snapshot_store as snapshot_store
+
+
+S = 1000000000
+
+
+def test_append_and_query(tmp_path):
+    with snapshot_store.SnapshotStore(str(tmp_path), [0, 2, 4], segment_rows=10) as store:
+        for i in range(25):
+            store.append(i * S, {0: i, 2: 2 * i})  # 4 is missing
+        chunks = list(store.query(5 * S, 22 * S, addresses=[2, 4]))
+
+    assert [(c.times[0], len(c.times)) for c in chunks] == [(5 * S, 5), (10 * S, 10), (20 * S, 2)]
+    times = numpy.concatenate([c.times for c in chunks])
+    values = numpy.concatenate([c.columns[2] for c in chunks])
+    assert list(times) == [i * S for i in range(5, 22)]
+    assert list(values) == [2 * i for i in range(5, 22)]
+    assert chunks[0].columns[4].dtype == numpy.float32
+    assert numpy.isnan(chunks[0].columns[4]).all()
+    assert sorted(os.listdir(str(tmp_path))) == ["{:020d}.seg".format(t * S) for t in (0, 10, 20)]
+
+
+def test_query_returns_views(tmp_path):
+    store = snapshot_store.SnapshotStore(str(tmp_path), [0], segment_rows=100)
+    for i in range(10):
+        store.append(i, [float(i)])
+    chunk, = store.query(2, 5)
+    assert isinstance(chunk.columns[0], numpy.memmap)
+    assert not chunk.columns[0].flags.owndata and not chunk.times.flags.owndata
+    assert list(chunk.columns[0]) == [2.0, 3.0, 4.0]
+    # Rows appended later show up in new queries of the same segment
+    store.append(10, [10.0])
+    chunk, = store.query(9, 11)
+    assert list(chunk.columns[0]) == [9.0, 10.0]
+
+
+def test_reopen_continues_segment(tmp_path):
+    with snapshot_store.SnapshotStore(str(tmp_path), [0, 2], segment_rows=10) as store:
+        for i in range(3):
+            store.append(i, [i, i])
+    with snapshot_store.SnapshotStore(str(tmp_path), [0, 2], segment_rows=10) as store:
+        assert store.last_time() == 2
+        with pytest.raises(ValueError):
+            store.append(2, [0, 0])
+        store.append(3, [3, 3])
+        chunk, = store.query(0, 10)
+        assert list(chunk.times) == [0, 1, 2, 3]
+    assert len(os.listdir(str(tmp_path))) == 1
+
+    # Different registers: a new segment, old ones stay readable
+    with snapshot_store.SnapshotStore(str(tmp_path), [0, 4], segment_rows=10) as store:
+        store.append(4, [4, 4])
+        chunks = list(store.query(0, 10))
+        assert [sorted(c.columns) for c in chunks] == [[0, 2], [0, 4]]
+
+
+def test_last_time_skips_empty_segment(tmp_path):
+    with snapshot_store.SnapshotStore(str(tmp_path), [0], segment_rows=10) as store:
+        for i in range(3):
+            store.append(i, [i])
+        store._rotate(100)  # as if we crashed before the first row of a new segment
+        assert store.last_time() == 2
+        with pytest.raises(ValueError):
+            store.append(1, [1])
+    with snapshot_store.SnapshotStore(str(tmp_path), [0], segment_rows=10) as store:
+        assert store.last_time() == 2
+        with pytest.raises(ValueError):
+            store.append(1, [1])
+        store.append(3, [3])
+        chunk, = store.query(0, 10)
+        assert list(chunk.times) == [0, 1, 2, 3]
+    assert os.listdir(str(tmp_path)) == ["{:020d}.seg".format(0)]
+
+
+def test_retention(tmp_path):
+    with snapshot_store.SnapshotStore(str(tmp_path), [0], segment_rows=10, retention=30) as store:
+        for i in range(100):
+            store.append(i * S, [i])
+        # Segments that only hold rows older than 30s before the newest segment started are gone
+        first = next(store.query(0, 1000 * S))
+        assert first.times[0] == 60 * S
+    assert len(os.listdir(str(tmp_path))) == 4
+
+
+def test_recompute_from_store(tmp_path):
+    registers = Eastron3P3W.registers_used
+    with snapshot_store.SnapshotStore(str(tmp_path), registers) as store:
+        data = {addr: 1.0 for addr in registers}
+        data.update({Eastron3P3W._U12: 100.0, Eastron3P3W._U23: 100.0, Eastron3P3W._P1: 1000.0})
+        for i in range(5):
+            store.append(i, data)
+        chunk, = store.query(0, 5)
+        v = eastron_numpy.compute_all(chunk.columns)
+    assert numpy.abs(v.I1_u1) == pytest.approx([10.0] * 5, rel=1e-3)
@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+import src.simulator as simulator
+import src.supervisor as supervisor
+
+
+def exiting_worker(port, interval, conn, stop):
+    conn.send([{'measurement': 'test', 'tags': {'port': port.name}, 'fields': {'pid': os.getpid()}}])
+    sys.exit(1)
+
+
+def silent_worker(port, interval, conn, stop):
+    stop.wait(60)
+
+
+def test_polls_every_port():
+    sims = [simulator.Sdm630Simulator.open_pty(slaves={1: simulator.default_values(),
+                                                       2: simulator.default_values()})
+            for _ in range(2)]
+    ports = [supervisor.PortConfig(name=path, kind='serial', address=path, slaves=[1, 2]) for _, path in sims]
+    batches = []
+    s = supervisor.Supervisor(ports, 0.2, batches.append)
+    for sim, _ in sims:
+        sim.start()
+    try:
+        s.run(1.5)
+    finally:
+        s.stop()
+        for sim, _ in sims:
+            sim.stop()
+
+    seen = {(p['tags']['port'], p['tags']['addr']) for batch in batches for p in batch}
+    assert seen == {(path, addr) for _, path in sims for addr in (1, 2)}
+    status = s.status()
+    assert all(st['restarts'] == 0 and st['batches'] >= 3 for st in status.values())
+    # Points are timestamped at reception, in the worker
+    assert all('time' in p for batch in batches for p in batch)
+
+
+def test_failing_meter_does_not_stop_port():
+    # All zeroes: deriving the 3P3W values divides by a voltage of 0
+    broken = {addr: 0.0 for addr in simulator.default_values()}
+    sim, path = simulator.Sdm630Simulator.open_pty(slaves={1: broken, 2: simulator.default_values()})
+    batches = []
+    s = supervisor.Supervisor([supervisor.PortConfig(path, 'serial', path, [1, 2])], 0.2, batches.append)
+    sim.start()
+    try:
+        s.run(1.0)
+    finally:
+        s.stop()
+        sim.stop()
+
+    assert {p['tags']['addr'] for batch in batches for p in batch} == {2}
+    assert s.status()[path]['restarts'] == 0
+
+
+def test_restarts_exited_worker():
+    batches = []
+    s = supervisor.Supervisor([supervisor.PortConfig('a', 'serial', '/dev/null', [1])], 0.1, batches.append,
+                              min_restart_delay=0.1, max_restart_delay=0.2, worker=exiting_worker)
+    s.run(1.0)
+    s.stop()
+    status = s.status()['a']
+    assert status['restarts'] >= 3
+    # Every run delivered its batch, from a new process
+    pids = [batch[0]['fields']['pid'] for batch in batches]
+    assert len(set(pids)) == len(pids) >= 3
+
+
+def test_restarts_hung_worker():
+    s = supervisor.Supervisor([supervisor.PortConfig('a', 'serial', '/dev/null', [1])], 0.1, lambda points: None,
+                              health_timeout=0.3, min_restart_delay=0.1, worker=silent_worker)
+    start = time.monotonic()
+    s.run(1.0)
+    s.stop()
+    assert 1 <= s.status()['a']['restarts'] <= 3
+    assert time.monotonic() - start < 5
+
+
+def test_missing_port_is_retried():
+    s = supervisor.Supervisor([supervisor.PortConfig('gone', 'serial', '/dev/does-not-exist', [1])], 0.1,
+                              lambda points: None, min_restart_delay=0.1, max_restart_delay=0.4)
+    s.run(1.0)
+    s.stop()
+    status = s.status()['gone']
+    assert status['restarts'] >= 2 and status['batches'] == 0
+
+
+def test_parse_port():
+    assert supervisor.parse_port('/dev/ttyUSB0=1,2', 'serial') == \
+        supervisor.PortConfig('/dev/ttyUSB0', 'serial', '/dev/ttyUSB0', [1, 2])
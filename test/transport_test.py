@@ -0,0 +1,122 @@
+import time
+
+import pytest
+
+import src.eastron as eastron
+import src.simulator as simulator
+import src.transport as transport
+
+
+@pytest.mark.parametrize("framing,kind", [('rtu', 'rtu-tcp'), ('tcp', 'tcp')])
+def test_read_all_registers(framing, kind):
+    values = simulator.default_values()
+    sim, address = simulator.Sdm630Simulator.open_tcp(framing=framing, slaves={1: values})
+    with sim:
+        t = transport.open_transport(kind, address)
+        e = eastron.Eastron(t, 1)
+        result = e.read_input_registers_float(list(values.keys()))
+        t.close()
+
+    for addr, value in values.items():
+        assert result[addr] == pytest.approx(value, rel=1e-6)
+
+
+def test_modbus_tcp_pipelining():
+    sim, address = simulator.Sdm630Simulator.open_tcp(slaves={1: {0: 1.0, 200: 2.0, 400: 3.0}})
+    with sim:
+        t = transport.open_transport('tcp', address)
+        t.max_outstanding = 2
+        e = eastron.Eastron(t, 1)
+        assert e.read_input_registers_float([0, 200, 400]) == {0: 1.0, 200: 2.0, 400: 3.0}
+        assert sim.requests == 3
+        t.close()
+
+
+def test_modbus_tcp_exception():
+    sim, address = simulator.Sdm630Simulator.open_tcp()
+    with sim:
+        t = transport.open_transport('tcp', address)
+        with pytest.raises(eastron.ModbusException):
+            eastron.Modbus(t, 1)._request(2, 0, 1)
+        t.close()
+
+
+def test_modbus_tcp_timeout():
+    sim, address = simulator.Sdm630Simulator.open_tcp()
+    with sim:
+        t = transport.ModbusTcpTransport(*transport._host_port(address), timeout=0.1)
+        with pytest.raises(TimeoutError):
+            eastron.Eastron(t, 7).read_input_registers_float([0])
+        t.close()
+
+
+def test_host_port():
+    assert transport._host_port('gw:1234') == ('gw', 1234)
+    assert transport._host_port('gw', 502) == ('gw', 502)
+    with pytest.raises(ValueError):
+        transport._host_port('gw')
+
+
+def test_modbus_tcp_health():
+    sim, address = simulator.Sdm630Simulator.open_tcp(slaves={1: {0: 1.0, 200: 2.0}})
+    with sim:
+        t = transport.ModbusTcpTransport(*transport._host_port(address), timeout=0.1)
+        e = eastron.Eastron(t, 1)
+        e.read_input_registers_float([0, 200])
+        assert e.health.successes == 2 and len(e.health.latencies) == 2
+
+        dead = eastron.Eastron(t, 7, retries=0, health=eastron.SlaveHealth(failure_threshold=1))
+        with pytest.raises(TimeoutError):
+            dead.read_input_registers_float([0, 200])
+        with pytest.raises(eastron.SlaveUnavailable):
+            dead.read_input_registers_float([0, 200])
+        assert dead.health.failures == 1
+        t.close()
+
+
+@pytest.mark.parametrize("framing,kind", [('rtu', 'rtu-tcp'), ('tcp', 'tcp')])
+def test_reconnect(framing, kind):
+    sim, address = simulator.Sdm630Simulator.open_tcp(framing=framing, slaves={1: {0: 1.0}})
+    with sim:
+        t = transport.open_transport(kind, address)
+        e = eastron.Eastron(t, 1, retries=0)
+        assert e.read_input_registers_float([0]) == {0: 1.0}
+
+        sim.drop_connection()
+        time.sleep(0.2)
+        with pytest.raises(ConnectionError):
+            e.read_input_registers_float([0])
+        # The next request connects again
+        assert e.read_input_registers_float([0]) == {0: 1.0}
+
+        # With retries, a dropped connection costs no failed request at all
+        e.retries = 1
+        sim.drop_connection()
+        time.sleep(0.2)
+        assert e.read_input_registers_float([0]) == {0: 1.0}
+        assert t.reconnects == 2
+        t.close()
+
+
+def test_reset_input_buffer_of_lost_connection():
+    class ResetSocket:
+        def settimeout(self, timeout):
+            pass
+
+        def recv(self, size):
+            raise ConnectionResetError()
+
+        def close(self):
+            pass
+
+    sim, address = simulator.Sdm630Simulator.open_tcp(framing='rtu', slaves={1: {0: 1.0}})
+    with sim:
+        t = transport.open_transport('rtu-tcp', address)
+        t.sock.close()
+        t.sock = ResetSocket()
+        # Doesn't raise while a failed request is handled, but connects again
+        t.reset_input_buffer()
+        assert t.sock is None
+        assert eastron.Eastron(t, 1).read_input_registers_float([0]) == {0: 1.0}
+        assert t.reconnects == 1
+        t.close()